@@ -1,25 +1,50 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import time
 from contextlib import asynccontextmanager
 
 from routers import productos, inventario, transacciones, clientes, ventas, analytics
 from database import connect_to_mongo, close_mongo_connection
+from utils.reservas import liberar_reservas_vencidas, BARRIDO_RESERVAS_SEGUNDOS
+from utils.historico import tomar_snapshots, SNAPSHOT_INVENTARIO_HORAS
+from utils.recomendador import recomendador, RECOMENDADOR_INTERVALO_SEGUNDOS
+from utils.tiempo_real import panel_tiempo_real, TIEMPO_REAL_CHANGE_STREAM, TIEMPO_REAL_RESINCRONIZAR_SEGUNDOS
+from utils.post_venta import cola_post_venta
+from utils.tareas import iniciar_tarea_periodica, detener_tareas
+from utils.serializers import RespuestaBSON
+from utils.metricas import latencia_http, exportar_metricas
+from utils.consultas_lentas import ruta_actual, listener_consultas_lentas
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await connect_to_mongo()
+    tareas = [
+        cola_post_venta.iniciar(),
+        iniciar_tarea_periodica("barrido_reservas", liberar_reservas_vencidas, BARRIDO_RESERVAS_SEGUNDOS),
+        # Se revisa a menudo; tomar_snapshots decide si ya toca uno nuevo
+        iniciar_tarea_periodica("snapshots_inventario", tomar_snapshots, min(3600, SNAPSHOT_INVENTARIO_HORAS * 3600)),
+        iniciar_tarea_periodica("recomendador", recomendador.reconstruir, RECOMENDADOR_INTERVALO_SEGUNDOS),
+        # Corrige la deriva de los contadores en vivo (ventas de otros workers, cambio de día)
+        iniciar_tarea_periodica("tiempo_real", panel_tiempo_real.resincronizar, TIEMPO_REAL_RESINCRONIZAR_SEGUNDOS)
+    ]
+    if TIEMPO_REAL_CHANGE_STREAM:
+        # Si el stream se corta se reanuda desde el último evento
+        tareas.append(iniciar_tarea_periodica("tiempo_real_cambios", panel_tiempo_real.escuchar_cambios, 5))
     yield
     # Shutdown
+    await detener_tareas(tareas)
     await close_mongo_connection()
 
 app = FastAPI(
     title="Sistema de Inventario API",
     description="API para gestión de productos, inventario, transacciones, clientes, ventas y analytics",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=RespuestaBSON
 )
 
 # Configurar CORS
@@ -31,6 +56,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def medir_latencia(request: Request, call_next):
+    inicio = time.perf_counter()
+    estado = 500
+    # Visible para el listener de consultas lentas en los hilos de Motor
+    token = ruta_actual.set(f"{request.method} {request.url.path}")
+    try:
+        response = await call_next(request)
+        estado = response.status_code
+        return response
+    finally:
+        # La plantilla de la ruta (no la URL) mantiene acotado el número de series
+        ruta = request.scope.get("route")
+        latencia_http.observar(
+            time.perf_counter() - inicio,
+            request.method,
+            ruta.path if ruta else "sin_ruta",
+            str(estado)
+        )
+        ruta_actual.reset(token)
+
 # Incluir routers
 app.include_router(productos.router, prefix="/api/v1/productos", tags=["productos"])
 app.include_router(inventario.router, prefix="/api/v1/inventario", tags=["inventario"])
@@ -47,6 +93,16 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return PlainTextResponse(exportar_metricas(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/slow-queries")
+async def consultas_lentas(limit: int = Query(50, ge=1, le=200), solo_collscan: bool = False):
+    """Consultas a MongoDB más recientes que superaron el umbral"""
+    return listener_consultas_lentas.recientes(limit, solo_collscan)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -20,6 +20,8 @@ class PrediccionDemanda(BaseModel):
     producto_id: str
     demanda_estimada_7_dias: int
     demanda_estimada_30_dias: int
+    intervalo_7_dias: Optional[Dict[str, int]] = None  # {"inferior", "superior"} al 95%
+    intervalo_30_dias: Optional[Dict[str, int]] = None
     tendencia: str  # "creciente", "decreciente", "estable"
     confianza: float  # 0-1
     factores: List[str]
@@ -40,3 +40,12 @@ class ClienteUpdate(BaseModel):
     nombre: Optional[str] = None
     email: Optional[str] = None
     programa_fidelidad: Optional[ProgramaFidelidad] = None
+
+class AcumulacionPuntos(BaseModel):
+    cliente_id: str
+    puntos: int
+
+class ResultadoPuntosLote(BaseModel):
+    clientes: int
+    actualizados: int
+    no_encontrados: List[str] = []
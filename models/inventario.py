@@ -24,14 +24,26 @@ class Lote(BaseModel):
     fecha_vencimiento: Optional[datetime] = None
     precio_compra: Optional[float] = None
 
-class AjusteHistorial(BaseModel):
+class MovimientoInventario(BaseModel):
     fecha: datetime
-    cantidad_anterior: int
-    ajuste: int
-    cantidad_nueva: int
-    motivo: str
-    tipo: str
-    autorizado_por: str
+    tipo: str  # "ajuste", "venta", "transferencia_salida", "transferencia_entrada"
+    cantidad: int  # Cambio en stock_actual, con signo
+    referencia: Optional[str] = None  # transaccion_id o sucursal de la transferencia
+    motivo: Optional[str] = None
+    tipo_ajuste: Optional[str] = None
+    cantidad_anterior: Optional[int] = None
+    cantidad_nueva: Optional[int] = None
+    autorizado_por: Optional[str] = None
+
+class BucketMovimientos(BaseModel):
+    id: Optional[str] = Field(default=None, alias="_id")
+    producto_id: str
+    sucursal_id: str
+    mes: str  # "YYYY-MM"
+    desde: datetime
+    hasta: datetime
+    cantidad: int
+    movimientos: List[MovimientoInventario]
 
 class Inventario(BaseModel):
     model_config = ConfigDict(
@@ -65,9 +77,17 @@ class Inventario(BaseModel):
     stock_minimo: int = 10
     stock_reservado: int = 0
     lotes: List[Lote] = []
-    ajustes: List[AjusteHistorial] = []
     ultima_actualizacion: datetime = Field(default_factory=datetime.utcnow)
 
+class StockHistorico(BaseModel):
+    producto_id: str
+    sucursal_id: str
+    fecha: datetime
+    stock: int
+    fuente: str  # "snapshot" o "actual": desde dónde se reconstruyó
+    fecha_referencia: datetime
+    movimientos_aplicados: int
+
 class InventarioCreate(BaseModel):
     sucursal_id: str
     producto_id: str
@@ -86,7 +106,18 @@ class TransferenciaStock(BaseModel):
     producto_id: str
     sucursal_origen: str
     sucursal_destino: str
-    cantidad: int
+    cantidad: int = Field(gt=0)
+    motivo: str
+    autorizado_por: str
+
+class ItemTransferencia(BaseModel):
+    producto_id: str
+    cantidad: int = Field(gt=0)
+
+class TransferenciaLote(BaseModel):
+    sucursal_origen: str
+    sucursal_destino: str
+    productos: List[ItemTransferencia]
     motivo: str
     autorizado_por: str
 
@@ -15,6 +15,7 @@ class ProductoCarrito(BaseModel):
     precio_unitario: float
     descuento_aplicado: float = 0.0
     subtotal: float
+    reservado: bool = False  # La cantidad tiene reserva en inventario.stock_reservado
 
 class PromocionAplicada(BaseModel):
     promocion_id: str
@@ -34,6 +35,7 @@ class TransaccionVenta(BaseModel):
     estado: EstadoTransaccion = EstadoTransaccion.INICIADA
     fecha_inicio: datetime = Field(default_factory=datetime.utcnow)
     fecha_finalizacion: Optional[datetime] = None
+    reserva_expira: Optional[datetime] = None
 
 class IniciarTransaccionRequest(BaseModel):
     cliente_id: Optional[str] = None
@@ -41,7 +43,7 @@ class IniciarTransaccionRequest(BaseModel):
 
 class AgregarProductoRequest(BaseModel):
     producto_id: str
-    cantidad: int
+    cantidad: int = Field(gt=0)
 
 class AplicarPromocionRequest(BaseModel):
     codigo_promocion: str
@@ -50,6 +52,14 @@ class FinalizarVentaRequest(BaseModel):
     metodo_pago: str
     monto_recibido: Optional[float] = None
 
+class CheckoutRequest(BaseModel):
+    cliente_id: Optional[str] = None
+    sucursal_id: str
+    productos: List[AgregarProductoRequest]
+    codigos_promocion: List[str] = []
+    metodo_pago: str
+    monto_recibido: Optional[float] = None
+
 class TransferenciaStock(BaseModel):
     producto_id: str
     sucursal_origen: str
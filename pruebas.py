@@ -63,6 +63,21 @@ def ejemplos_ventas():
         }
         response = requests.post(f"{BASE_URL}/api/ventas/finalizar/{transaccion_id}", json=data)
         print_response(response, "Finalizar Venta")
+    
+    # 5. Venta completa en una sola llamada
+    print("\n5. POST /api/ventas/checkout - Registrar la venta completa en una llamada")
+    data = {
+        "cliente_id": "C12345678",
+        "sucursal_id": "S001",
+        "productos": [
+            {"producto_id": "P12345678", "cantidad": 2}
+        ],
+        "codigos_promocion": ["DESC10"],
+        "metodo_pago": "tarjeta_credito",
+        "monto_recibido": 100.00
+    }
+    response = requests.post(f"{BASE_URL}/api/ventas/checkout", json=data)
+    print_response(response, "Checkout")
 
 # ============================================================================
 # ENDPOINTS DE INVENTARIO
@@ -177,6 +192,18 @@ curl -X POST "http://localhost:8000/api/ventas/finalizar/TRANSACTION_ID" \\
     "monto_recibido": 100.00
   }'
 
+# Checkout en una sola llamada
+curl -X POST "http://localhost:8000/api/ventas/checkout" \\
+  -H "Content-Type: application/json" \\
+  -d '{
+    "cliente_id": "C12345678",
+    "sucursal_id": "S001",
+    "productos": [{"producto_id": "P12345678", "cantidad": 2}],
+    "codigos_promocion": ["DESC10"],
+    "metodo_pago": "tarjeta_credito",
+    "monto_recibido": 100.00
+  }'
+
 # ============================================================================
 # INVENTARIO
 # ============================================================================
@@ -1,56 +1,57 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 from models.analytics import VentaTiempoReal, ProductoTrending, PrediccionDemanda, RecomendacionProducto
-from database import get_transacciones_collection, get_productos_collection, get_clientes_collection
+from database import (
+    get_transacciones_collection, get_productos_collection, get_clientes_collection,
+    get_ventas_resumen_collection
+)
+from utils.resumen_ventas import PRODUCTO_TOTAL, clave_fecha, valor_base
+from utils.resolver import resolver_productos
+from utils.cache_catalogo import obtener_productos
+from utils.prediccion import cache_predicciones, prediccion_sin_historial
+from utils.recomendador import recomendador
+from utils.tiempo_real import flujo_eventos
 from datetime import datetime, timedelta
-import random
 
 router = APIRouter()
 
 @router.get("/ventas/tiempo-real", response_model=VentaTiempoReal)
 async def get_ventas_tiempo_real():
     """Dashboard de ventas actuales"""
-    collection = await get_transacciones_collection()
+    collection = await get_ventas_resumen_collection()
     
     hoy = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     ayer = hoy - timedelta(days=1)
     
-    ventas_hoy = await collection.find({
-        "fecha_creacion": {"$gte": hoy},
-        "estado": "finalizada"
-    }).to_list(1000)
-    
-    ventas_ayer = await collection.find({
-        "fecha_creacion": {"$gte": ayer, "$lt": hoy},
-        "estado": "finalizada"
-    }).to_list(1000)
-    
-    # Si no hay ventas con fecha_creacion, buscar por _id (ObjectId contiene timestamp)
-    if not ventas_hoy:
-        from bson import ObjectId
-        inicio_hoy = ObjectId.from_datetime(hoy)
-        ventas_hoy = await collection.find({
-            "_id": {"$gte": inicio_hoy},
-            "estado": "finalizada"
-        }).to_list(1000)
-    
-    def get_total_value(venta):
-        total = venta.get("total", 0)
-        if isinstance(total, dict):
-            return total.get("base", 0)
-        return total
+    # Buckets de total por ticket de hoy y ayer, sumados en el servidor
+    resumen = {
+        dia["_id"]: dia
+        async for dia in collection.aggregate([
+            {"$match": {
+                "fecha": {"$in": [clave_fecha(hoy), clave_fecha(ayer)]},
+                "producto_id": PRODUCTO_TOTAL
+            }},
+            {"$group": {
+                "_id": "$fecha",
+                "total": {"$sum": "$ingresos"},
+                "transacciones": {"$sum": "$transacciones"},
+                "unidades": {"$sum": "$cantidad"}
+            }}
+        ])
+    }
+    vacio = {"total": 0, "transacciones": 0, "unidades": 0}
+    dia_hoy = resumen.get(clave_fecha(hoy), vacio)
+    dia_ayer = resumen.get(clave_fecha(ayer), vacio)
     
     # Calcular métricas
-    total_hoy = sum(get_total_value(venta) for venta in ventas_hoy)
-    total_ayer = sum(get_total_value(venta) for venta in ventas_ayer)
-    transacciones_hoy = len(ventas_hoy)
-    transacciones_ayer = len(ventas_ayer)
+    total_hoy = dia_hoy["total"]
+    total_ayer = dia_ayer["total"]
+    transacciones_hoy = dia_hoy["transacciones"]
+    transacciones_ayer = dia_ayer["transacciones"]
     
     ticket_promedio = total_hoy / transacciones_hoy if transacciones_hoy > 0 else 0
-    productos_vendidos = sum(
-        sum(p.get("cantidad", 0) for p in venta.get("productos", []))
-        for venta in ventas_hoy
-    )
+    productos_vendidos = dia_hoy["unidades"]
     
     # Comparaciones
     comparacion_ventas = ((total_hoy - total_ayer) / total_ayer * 100) if total_ayer > 0 else 0
@@ -67,122 +68,122 @@ async def get_ventas_tiempo_real():
         }
     )
 
+@router.get("/ventas/tiempo-real/stream")
+async def stream_ventas_tiempo_real(sucursal_id: Optional[str] = None):
+    """Dashboard de ventas en vivo por Server-Sent Events.
+
+    Envía un evento snapshot con el estado completo y luego un evento delta
+    por cada venta finalizada; sucursal_id limita los deltas a una sucursal.
+    """
+    return StreamingResponse(
+        flujo_eventos(sucursal_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/productos/trending", response_model=List[ProductoTrending])
 async def get_productos_trending():
     """Productos más vendidos hoy"""
-    transacciones_collection = await get_transacciones_collection()
-    productos_collection = await get_productos_collection()
+    resumen_collection = await get_ventas_resumen_collection()
     
     hoy = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    ayer = hoy - timedelta(days=1)
     
-    ventas_hoy = await transacciones_collection.find({
-        "fecha_creacion": {"$gte": hoy},
-        "estado": "finalizada"
-    }).to_list(1000)
-    
-    if not ventas_hoy:
-        from bson import ObjectId
-        inicio_hoy = ObjectId.from_datetime(hoy)
-        ventas_hoy = await transacciones_collection.find({
-            "_id": {"$gte": inicio_hoy},
-            "estado": "finalizada"
-        }).to_list(1000)
-    
-    def get_subtotal_value(subtotal):
-        if isinstance(subtotal, dict):
-            return subtotal.get("base", 0)
-        return subtotal
-    
-    # Agregar productos vendidos
-    productos_stats = {}
-    for venta in ventas_hoy:
-        for producto in venta.get("productos", []):
-            producto_id = producto["producto_id"]
-            if producto_id not in productos_stats:
-                productos_stats[producto_id] = {
-                    "cantidad": 0,
-                    "ingresos": 0
-                }
-            productos_stats[producto_id]["cantidad"] += producto["cantidad"]
-            productos_stats[producto_id]["ingresos"] += get_subtotal_value(producto.get("subtotal", 0))
-    
-    # Obtener información de productos y crear respuesta
+    # Top 10 de hoy con la cantidad de ayer para calcular el crecimiento
+    top = await resumen_collection.aggregate([
+        {"$match": {
+            "fecha": {"$in": [clave_fecha(hoy), clave_fecha(ayer)]},
+            "producto_id": {"$ne": PRODUCTO_TOTAL}
+        }},
+        {"$group": {
+            "_id": "$producto_id",
+            "cantidad": {"$sum": {"$cond": [{"$eq": ["$fecha", clave_fecha(hoy)]}, "$cantidad", 0]}},
+            "ingresos": {"$sum": {"$cond": [{"$eq": ["$fecha", clave_fecha(hoy)]}, "$ingresos", 0]}},
+            "cantidad_ayer": {"$sum": {"$cond": [{"$eq": ["$fecha", clave_fecha(ayer)]}, "$cantidad", 0]}}
+        }},
+        {"$match": {"cantidad": {"$gt": 0}}},
+        {"$sort": {"cantidad": -1}},
+        {"$limit": 10}
+    ]).to_list(10)
+    
+    # Obtener información de productos en una sola consulta y crear respuesta
+    productos = await resolver_productos((stats["_id"] for stats in top), {"nombre": 1, "codigo": 1})
     trending = []
-    for producto_id, stats in sorted(productos_stats.items(), key=lambda x: x[1]["cantidad"], reverse=True)[:10]:
-        producto = await productos_collection.find_one({"codigo": producto_id})
+    for stats in top:
+        producto_id = stats["_id"]
+        producto = productos.get(producto_id)
         if producto:
+            crecimiento = (
+                (stats["cantidad"] - stats["cantidad_ayer"]) / stats["cantidad_ayer"] * 100
+                if stats["cantidad_ayer"] > 0 else 100.0
+            )
             trending.append(ProductoTrending(
                 producto_id=producto_id,
                 nombre=producto["nombre"],
                 cantidad_vendida=stats["cantidad"],
                 ingresos=stats["ingresos"],
-                crecimiento_porcentaje=random.uniform(5, 25)  # Simulado
+                crecimiento_porcentaje=crecimiento
             ))
     
     return trending
 
+@router.get("/prediccion-demanda", response_model=List[PrediccionDemanda])
+async def get_prediccion_demanda_catalogo():
+    """Estimación de ventas de todo el catálogo"""
+    productos_collection = await get_productos_collection()
+    
+    predicciones = await cache_predicciones.todas()
+    resultado = []
+    async for producto in productos_collection.find({}, {"codigo": 1}):
+        producto_id = producto.get("codigo") or str(producto["_id"])
+        resultado.append(PrediccionDemanda(
+            **(predicciones.get(producto_id) or prediccion_sin_historial(producto_id))
+        ))
+    
+    return resultado
+
 @router.get("/prediccion-demanda/{producto_id}", response_model=PrediccionDemanda)
 async def get_prediccion_demanda(producto_id: str):
     """Estimación de ventas"""
-    collection = await get_transacciones_collection()
-    
-    # Obtener ventas de los últimos 30 días
-    hace_30_dias = datetime.utcnow() - timedelta(days=30)
-    
-    ventas_historicas = await collection.find({
-        "fecha_finalizacion": {"$gte": hace_30_dias},
-        "estado": "finalizada"
-    }).to_list(1000)
-    
-    # Calcular demanda histórica
-    cantidad_total = 0
-    for venta in ventas_historicas:
-        for producto in venta.get("productos", []):
-            if producto["producto_id"] == producto_id:
-                cantidad_total += producto["cantidad"]
-    
-    # Estimaciones simples (en producción usarías ML)
-    demanda_diaria = cantidad_total / 30 if cantidad_total > 0 else 1
-    
-    return PrediccionDemanda(
-        producto_id=producto_id,
-        demanda_estimada_7_dias=int(demanda_diaria * 7),
-        demanda_estimada_30_dias=int(demanda_diaria * 30),
-        tendencia="estable",
-        confianza=0.75,
-        factores=["Historial de ventas", "Temporada actual", "Stock disponible"]
-    )
+    return PrediccionDemanda(**await cache_predicciones.obtener(producto_id))
 
 @router.get("/cliente/{cliente_id}/recomendaciones", response_model=List[RecomendacionProducto])
-async def get_recomendaciones_cliente(cliente_id: str):
+async def get_recomendaciones_cliente(cliente_id: str, limit: int = Query(5, ge=1, le=50)):
     """Productos sugeridos para el cliente"""
     transacciones_collection = await get_transacciones_collection()
-    productos_collection = await get_productos_collection()
-    
-    # Obtener historial del cliente
-    compras_cliente = await transacciones_collection.find({
-        "cliente_id": cliente_id,
-        "estado": "finalizada"
-    }).to_list(100)
-    
-    # Productos comprados por el cliente
-    productos_comprados = set()
-    for compra in compras_cliente:
-        for producto in compra.get("productos", []):
-            productos_comprados.add(producto["producto_id"])
-    
-    # Obtener productos populares que no ha comprado
-    todos_productos = await productos_collection.find().to_list(1000)
     
+    # Veces que el cliente compró cada producto
+    historial = {
+        compra["_id"]: compra["veces"]
+        async for compra in transacciones_collection.aggregate([
+            {"$match": {"cliente_id": cliente_id, "estado": "finalizada"}},
+            {"$project": {"productos": {"$setUnion": ["$productos.producto_id"]}}},
+            {"$unwind": "$productos"},
+            {"$group": {"_id": "$productos", "veces": {"$sum": 1}}}
+        ])
+    }
+    
+    sugeridos = recomendador.recomendar(historial, limit)
+    
+    # Nombres y precios desde el cache del catálogo
+    catalogo = await obtener_productos(
+        [s["producto_id"] for s in sugeridos] + [s["relacionado"] for s in sugeridos if s["relacionado"]]
+    )
     recomendaciones = []
-    for producto in todos_productos[:5]:  # Top 5 recomendaciones
-        if producto["codigo"] not in productos_comprados:
-            recomendaciones.append(RecomendacionProducto(
-                producto_id=producto["codigo"],
-                nombre=producto["nombre"],
-                score_recomendacion=random.uniform(0.7, 0.95),
-                razon="Producto popular en tu categoría favorita",
-                precio=producto["precio"]
-            ))
+    for sugerido in sugeridos:
+        producto = catalogo.get(sugerido["producto_id"])
+        if not producto:
+            continue
+        relacionado = catalogo.get(sugerido["relacionado"]) if sugerido["relacionado"] else None
+        recomendaciones.append(RecomendacionProducto(
+            producto_id=sugerido["producto_id"],
+            nombre=producto["nombre"],
+            score_recomendacion=round(sugerido["score"], 4),
+            razon=(
+                f"Se compra junto con {relacionado['nombre']}" if relacionado
+                else "Producto popular entre los clientes"
+            ),
+            precio=valor_base(producto.get("precio"))
+        ))
     
     return recomendaciones
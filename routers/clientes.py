@@ -1,56 +1,46 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List
-from models.clientes import Cliente, ClienteCreate, ClienteUpdate
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import List, Optional
+from pymongo.errors import DuplicateKeyError
+from models.clientes import Cliente, ClienteCreate, ClienteUpdate, AcumulacionPuntos, ResultadoPuntosLote
+from models.paginacion import Pagina
 from database import get_clientes_collection
+from utils.paginacion import paginar, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from utils.serializers import SerializadorModelo, convertir_bson, parametro_campos
+from utils.fidelidad import acumular_puntos, acumular_puntos_lote
 import uuid
-from bson import ObjectId
 
 router = APIRouter()
 
-def convert_objectid(doc):
-    """Convierte ObjectId a string en un documento"""
-    if doc is None:
-        return None
-    if isinstance(doc, list):
-        return [convert_objectid(item) for item in doc]
-    if isinstance(doc, dict):
-        converted = {}
-        for key, value in doc.items():
-            if isinstance(value, ObjectId):
-                converted[key] = str(value)
-            elif isinstance(value, dict):
-                converted[key] = convert_objectid(value)
-            elif isinstance(value, list):
-                converted[key] = convert_objectid(value)
-            else:
-                converted[key] = value
-        return converted
-    return doc
+serializador = SerializadorModelo(Cliente)
 
-@router.get("/", response_model=List[Cliente])
-async def get_clientes():
+@router.get("/", response_model=Pagina[Cliente])
+async def get_clientes(
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    fields: Optional[str] = parametro_campos()
+):
     """Obtener todos los clientes"""
     collection = await get_clientes_collection()
-    clientes = await collection.find().to_list(1000)
-    return convert_objectid(clientes)
+    clientes, next_cursor = await paginar(collection, {}, cursor, limit, serializador.proyeccion_campos(fields))
+    return serializador.pagina(clientes, next_cursor, fields)
 
 @router.get("/{cliente_id}", response_model=Cliente)
-async def get_cliente(cliente_id: str):
+async def get_cliente(cliente_id: str, fields: Optional[str] = parametro_campos()):
     """Obtener un cliente por ID"""
     collection = await get_clientes_collection()
-    cliente = await collection.find_one({"_id": cliente_id})
+    cliente = await collection.find_one({"_id": cliente_id}, serializador.proyeccion_campos(fields))
     if cliente is None:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
-    return convert_objectid(cliente)
+    return serializador.documento(cliente, fields)
 
 @router.get("/email/{email}", response_model=Cliente)
-async def get_cliente_por_email(email: str):
+async def get_cliente_por_email(email: str, fields: Optional[str] = parametro_campos()):
     """Obtener un cliente por email"""
     collection = await get_clientes_collection()
-    cliente = await collection.find_one({"email": email})
+    cliente = await collection.find_one({"email": email}, serializador.proyeccion_campos(fields))
     if cliente is None:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
-    return convert_objectid(cliente)
+    return serializador.documento(cliente, fields)
 
 @router.post("/", response_model=Cliente, status_code=status.HTTP_201_CREATED)
 async def create_cliente(cliente: ClienteCreate):
@@ -68,11 +58,15 @@ async def create_cliente(cliente: ClienteCreate):
     cliente_dict = cliente.model_dump()
     cliente_dict["_id"] = cliente_id
     
-    result = await collection.insert_one(cliente_dict)
+    try:
+        result = await collection.insert_one(cliente_dict)
+    except DuplicateKeyError:
+        # Otro alta con el mismo email pasó la verificación a la vez (índice email_unico)
+        raise HTTPException(status_code=400, detail="Ya existe un cliente con este email")
     
     if result.inserted_id:
         created_cliente = await collection.find_one({"_id": cliente_id})
-        return convert_objectid(created_cliente)
+        return convertir_bson(created_cliente)
     
     raise HTTPException(status_code=400, detail="Error al crear el cliente")
 
@@ -95,16 +89,19 @@ async def update_cliente(cliente_id: str, cliente: ClienteUpdate):
         if existing_cliente:
             raise HTTPException(status_code=400, detail="Ya existe un cliente con este email")
     
-    result = await collection.update_one(
-        {"_id": cliente_id},
-        {"$set": update_data}
-    )
+    try:
+        result = await collection.update_one(
+            {"_id": cliente_id},
+            {"$set": update_data}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Ya existe un cliente con este email")
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
     
     updated_cliente = await collection.find_one({"_id": cliente_id})
-    return convert_objectid(updated_cliente)
+    return convertir_bson(updated_cliente)
 
 @router.delete("/{cliente_id}")
 async def delete_cliente(cliente_id: str):
@@ -118,41 +115,17 @@ async def delete_cliente(cliente_id: str):
     
     return {"message": "Cliente eliminado exitosamente"}
 
+@router.post("/puntos/lote", response_model=ResultadoPuntosLote)
+async def acumular_puntos_clientes(acumulaciones: List[AcumulacionPuntos]):
+    """Registrar los puntos de muchas ventas (p. ej. las de un día) en un solo bulk_write"""
+    return await acumular_puntos_lote((a.cliente_id, a.puntos) for a in acumulaciones)
+
 @router.post("/{cliente_id}/puntos")
 async def actualizar_puntos_cliente(cliente_id: str, puntos: int):
     """Actualizar puntos del programa de fidelidad"""
-    collection = await get_clientes_collection()
-    
-    # Obtener cliente actual
-    cliente = await collection.find_one({"_id": cliente_id})
-    if not cliente:
-        raise HTTPException(status_code=404, detail="Cliente no encontrado")
-    
-    # Calcular nuevos puntos
-    puntos_actuales = cliente.get("programa_fidelidad", {}).get("puntos", 0)
-    nuevos_puntos = puntos_actuales + puntos
-    
-    # Determinar nuevo nivel
-    if nuevos_puntos >= 5000:
-        nivel = "Platino"
-    elif nuevos_puntos >= 3000:
-        nivel = "Oro"
-    elif nuevos_puntos >= 1000:
-        nivel = "Plata"
-    else:
-        nivel = "Bronce"
-    
-    # Actualizar cliente
-    result = await collection.update_one(
-        {"_id": cliente_id},
-        {"$set": {
-            "programa_fidelidad.puntos": nuevos_puntos,
-            "programa_fidelidad.nivel": nivel
-        }}
-    )
-    
-    if result.matched_count == 0:
+    # Suma y nivel se calculan en el servidor en una sola operación atómica
+    cliente = await acumular_puntos(cliente_id, puntos)
+    if cliente is None:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
     
-    updated_cliente = await collection.find_one({"_id": cliente_id})
-    return convert_objectid(updated_cliente)
+    return convertir_bson(cliente)
@@ -1,45 +1,84 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List
-from models.inventario import Inventario, InventarioCreate, InventarioUpdate, TransferenciaStock, AjusteStock
-from database import get_inventario_collection, get_productos_collection
-from datetime import datetime, timedelta
-from bson import ObjectId
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from typing import Optional
+from models.inventario import (
+    Inventario, InventarioCreate, InventarioUpdate, TransferenciaStock, TransferenciaLote, AjusteStock,
+    BucketMovimientos, StockHistorico
+)
+from models.paginacion import Pagina
+from database import (
+    get_inventario_collection, get_movimientos_collection, get_alertas_stock_collection, ejecutar_en_transaccion
+)
+from utils.cache_catalogo import obtener_producto_por_codigo, obtener_productos
+from utils.cache_http import marca_inventario_sucursal, calcular_etag, no_modificado, con_cache
+from utils.movimientos import movimiento, registrar_movimientos
+from utils.historico import stock_en_fecha
+from utils.paginacion import paginar, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from utils.resolver import resolver_productos
+from utils.serializers import SerializadorModelo, convertir_bson, parametro_campos
+from utils.stock import expr_disponible, lineas_inventario, descontar_stock, acreditar_stock
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 router = APIRouter()
 
-def convert_objectid(doc):
-    """Convierte ObjectId a string en un documento"""
-    if doc and "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    return doc
+# Documentos antiguos aún pueden tener el historial embebido (ver scripts/migrar_ajustes.py)
+SIN_HISTORIAL = {"ajustes": 0}
 
-@router.get("/", response_model=List[Inventario])
-async def get_inventario():
+serializador = SerializadorModelo(Inventario)
+
+@router.get("/", response_model=Pagina[Inventario])
+async def get_inventario(
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    fields: Optional[str] = parametro_campos()
+):
     """Obtener todo el inventario"""
     collection = await get_inventario_collection()
-    inventario = await collection.find().to_list(1000)
-    return [convert_objectid(item) for item in inventario]
+    inventario, next_cursor = await paginar(collection, {}, cursor, limit, serializador.proyeccion_campos(fields))
+    return serializador.pagina(inventario, next_cursor, fields)
 
-@router.get("/sucursal/{sucursal_id}", response_model=List[Inventario])
-async def get_inventario_por_sucursal(sucursal_id: str):
+@router.get("/sucursal/{sucursal_id}", response_model=Pagina[Inventario])
+async def get_inventario_por_sucursal(
+    sucursal_id: str,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    fields: Optional[str] = parametro_campos()
+):
     """Obtener inventario por sucursal"""
+    etag = calcular_etag(request, await marca_inventario_sucursal(sucursal_id))
+    respuesta_304 = no_modificado(request, etag, "inventario_sucursal")
+    if respuesta_304:
+        return respuesta_304
+    
     collection = await get_inventario_collection()
-    inventario = await collection.find({"sucursal_id": sucursal_id}).to_list(1000)
-    return [convert_objectid(item) for item in inventario]
+    inventario, next_cursor = await paginar(
+        collection, {"sucursal_id": sucursal_id}, cursor, limit, serializador.proyeccion_campos(fields)
+    )
+    return con_cache(serializador.pagina(inventario, next_cursor, fields), response, etag, "inventario_sucursal")
 
-@router.get("/producto/{producto_id}", response_model=List[Inventario])
-async def get_inventario_por_producto(producto_id: str):
+@router.get("/producto/{producto_id}", response_model=Pagina[Inventario])
+async def get_inventario_por_producto(
+    producto_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    fields: Optional[str] = parametro_campos()
+):
     """Obtener inventario por producto"""
     collection = await get_inventario_collection()
-    inventario = await collection.find({"producto_id": producto_id}).to_list(1000)
-    return [convert_objectid(item) for item in inventario]
+    inventario, next_cursor = await paginar(
+        collection, {"producto_id": producto_id}, cursor, limit, serializador.proyeccion_campos(fields)
+    )
+    return serializador.pagina(inventario, next_cursor, fields)
 
 @router.post("/", response_model=Inventario, status_code=status.HTTP_201_CREATED)
 async def create_inventario(inventario: InventarioCreate):
     """Crear registro de inventario"""
     collection = await get_inventario_collection()
     
-    # Verificar si ya existe el registro
+    # Verificar si ya existe el registro (el índice único cubre dos altas simultáneas)
     existing = await collection.find_one({
         "sucursal_id": inventario.sucursal_id,
         "producto_id": inventario.producto_id
@@ -54,11 +93,25 @@ async def create_inventario(inventario: InventarioCreate):
     inventario_dict = inventario.model_dump()
     inventario_dict["ultima_actualizacion"] = datetime.utcnow()
     
-    result = await collection.insert_one(inventario_dict)
+    async def crear(session):
+        result = await collection.insert_one(inventario_dict, session=session)
+        # El stock inicial también es un movimiento: el histórico parte de cero
+        if inventario.stock_actual:
+            registro = movimiento("alta", inventario.stock_actual, cantidad_anterior=0, cantidad_nueva=inventario.stock_actual)
+            await registrar_movimientos([(inventario.producto_id, inventario.sucursal_id, registro)], session=session)
+        return result.inserted_id
+    
+    try:
+        inserted_id = await ejecutar_en_transaccion(crear)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=400, 
+            detail="Ya existe un registro de inventario para este producto en esta sucursal"
+        )
     
-    if result.inserted_id:
-        created_inventario = await collection.find_one({"_id": result.inserted_id})
-        return convert_objectid(created_inventario)
+    if inserted_id:
+        created_inventario = await collection.find_one({"_id": inserted_id}, SIN_HISTORIAL)
+        return convertir_bson(created_inventario)
     
     raise HTTPException(status_code=400, detail="Error al crear el registro de inventario")
 
@@ -68,37 +121,67 @@ async def update_inventario(sucursal_id: str, producto_id: str, inventario: Inve
     collection = await get_inventario_collection()
     
     update_data = {k: v for k, v in inventario.model_dump().items() if v is not None}
-    update_data["ultima_actualizacion"] = datetime.utcnow()
     
     if not update_data:
         raise HTTPException(status_code=400, detail="No hay datos para actualizar")
     
-    result = await collection.update_one(
-        {"sucursal_id": sucursal_id, "producto_id": producto_id},
-        {"$set": update_data}
-    )
+    update_data["ultima_actualizacion"] = datetime.utcnow()
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Registro de inventario no encontrado")
+    async def actualizar(session):
+        anterior = await collection.find_one_and_update(
+            {"sucursal_id": sucursal_id, "producto_id": producto_id},
+            {"$set": update_data},
+            projection={"stock_actual": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if anterior is None:
+            raise HTTPException(status_code=404, detail="Registro de inventario no encontrado")
+        
+        # Fijar stock_actual a mano se registra como corrección con su diferencia
+        diferencia = update_data.get("stock_actual", anterior["stock_actual"]) - anterior["stock_actual"]
+        if diferencia:
+            registro = movimiento(
+                "correccion",
+                diferencia,
+                cantidad_anterior=anterior["stock_actual"],
+                cantidad_nueva=update_data["stock_actual"]
+            )
+            await registrar_movimientos([(producto_id, sucursal_id, registro)], session=session)
+    
+    await ejecutar_en_transaccion(actualizar)
     
     updated_inventario = await collection.find_one({
         "sucursal_id": sucursal_id, 
         "producto_id": producto_id
-    })
-    return convert_objectid(updated_inventario)
+    }, SIN_HISTORIAL)
+    return convertir_bson(updated_inventario)
 
 @router.delete("/sucursal/{sucursal_id}/producto/{producto_id}")
 async def delete_inventario(sucursal_id: str, producto_id: str):
     """Eliminar registro de inventario"""
     collection = await get_inventario_collection()
     
-    result = await collection.delete_one({
-        "producto_id": producto_id,
-        "sucursal_id": sucursal_id
-    })
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Registro de inventario no encontrado")
+    async def eliminar(session):
+        eliminado = await collection.find_one_and_delete(
+            {"producto_id": producto_id, "sucursal_id": sucursal_id},
+            projection={"stock_actual": 1},
+            session=session
+        )
+        if eliminado is None:
+            raise HTTPException(status_code=404, detail="Registro de inventario no encontrado")
+        
+        # El stock que desaparece con el registro queda en el historial
+        if eliminado.get("stock_actual"):
+            registro = movimiento(
+                "baja",
+                -eliminado["stock_actual"],
+                cantidad_anterior=eliminado["stock_actual"],
+                cantidad_nueva=0
+            )
+            await registrar_movimientos([(producto_id, sucursal_id, registro)], session=session)
+    
+    await ejecutar_en_transaccion(eliminar)
     
     return {"message": "Registro de inventario eliminado exitosamente"}
 
@@ -106,94 +189,177 @@ async def delete_inventario(sucursal_id: str, producto_id: str):
 async def verificar_disponibilidad(codigo: str):
     """Verificar stock en tiempo real"""
     inventario_collection = await get_inventario_collection()
-    productos_collection = await get_productos_collection()
     
-    producto = await productos_collection.find_one({"codigo": codigo})
+    producto = await obtener_producto_por_codigo(codigo)
     if not producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
     producto_id = str(producto["_id"])
     
-    stock_sucursales = await inventario_collection.find({"producto_id": producto_id}).to_list(100)
+    stock_sucursales = await inventario_collection.find(
+        {"producto_id": producto_id},
+        {"sucursal_id": 1, "stock_actual": 1, "stock_minimo": 1, "stock_reservado": 1}
+    ).to_list(100)
+    
+    # Lo reservado por carritos abiertos no está disponible para otras ventas
+    for item in stock_sucursales:
+        item["stock_disponible"] = item["stock_actual"] - item.get("stock_reservado", 0)
     
     total_stock = sum(item["stock_actual"] for item in stock_sucursales)
+    total_disponible = sum(item["stock_disponible"] for item in stock_sucursales)
     
     return {
         "producto_id": codigo,
         "nombre": producto["nombre"],
         "stock_total": total_stock,
+        "stock_disponible": total_disponible,
         "stock_por_sucursal": [
             {
                 "sucursal_id": item["sucursal_id"],
                 "stock_actual": item["stock_actual"],
+                "stock_reservado": item.get("stock_reservado", 0),
+                "stock_disponible": item["stock_disponible"],
                 "stock_minimo": item["stock_minimo"],
-                "estado": "bajo" if item["stock_actual"] <= item["stock_minimo"] else "normal"
+                "estado": "bajo" if item["stock_disponible"] <= item["stock_minimo"] else "normal"
             }
             for item in stock_sucursales
         ],
-        "disponible": total_stock > 0
+        "disponible": total_disponible > 0
     }
 
+@router.get("/alertas/stock-bajo")
+async def get_alertas_stock_bajo(
+    sucursal_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Productos con stock disponible en o bajo el mínimo tras las últimas ventas"""
+    collection = await get_alertas_stock_collection()
+    
+    filtro = {"sucursal_id": sucursal_id} if sucursal_id else {}
+    alertas = await collection.find(filtro, {"_id": 0}).sort("fecha", -1).to_list(limit)
+    
+    return alertas
+
 @router.post("/transferir")
 async def transferir_stock(transferencia: TransferenciaStock):
     """Transferir stock entre sucursales"""
     collection = await get_inventario_collection()
-    productos_collection = await get_productos_collection()
     
-    producto = await productos_collection.find_one({"codigo": transferencia.producto_id})
+    if transferencia.sucursal_origen == transferencia.sucursal_destino:
+        raise HTTPException(status_code=400, detail="La sucursal origen y destino deben ser distintas")
+    
+    producto = await obtener_producto_por_codigo(transferencia.producto_id)
     if not producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
     producto_id = str(producto["_id"])
     
-    # Verificar stock en sucursal origen
-    stock_origen = await collection.find_one({
-        "producto_id": producto_id,
-        "sucursal_id": transferencia.sucursal_origen
-    })
-    
-    if not stock_origen:
-        raise HTTPException(status_code=404, detail="Producto no encontrado en sucursal origen")
-    
-    if stock_origen["stock_actual"] < transferencia.cantidad:
-        raise HTTPException(status_code=400, detail="Stock insuficiente en sucursal origen")
+    async def transferir(session):
+        ahora = datetime.utcnow()
+        
+        # Débito con guarda: solo se mueve stock disponible (no reservado)
+        debito = await collection.update_one(
+            {
+                "producto_id": producto_id,
+                "sucursal_id": transferencia.sucursal_origen,
+                "$expr": {"$gte": [expr_disponible(), transferencia.cantidad]}
+            },
+            {
+                "$inc": {"stock_actual": -transferencia.cantidad},
+                "$set": {"ultima_actualizacion": ahora}
+            },
+            session=session
+        )
+        if debito.matched_count == 0:
+            stock_origen = await collection.find_one(
+                {"producto_id": producto_id, "sucursal_id": transferencia.sucursal_origen},
+                {"_id": 1},
+                session=session
+            )
+            if not stock_origen:
+                raise HTTPException(status_code=404, detail="Producto no encontrado en sucursal origen")
+            raise HTTPException(status_code=400, detail="Stock insuficiente en sucursal origen")
+        
+        # Crédito en destino, creando el registro si no existe
+        await acreditar_stock(
+            {producto_id: {"cantidad": transferencia.cantidad}},
+            transferencia.sucursal_destino,
+            session,
+            referencia=transferencia.sucursal_origen,
+            motivo=transferencia.motivo,
+            autorizado_por=transferencia.autorizado_por
+        )
+        await registrar_movimientos(
+            [(
+                producto_id,
+                transferencia.sucursal_origen,
+                movimiento(
+                    "transferencia_salida",
+                    -transferencia.cantidad,
+                    referencia=transferencia.sucursal_destino,
+                    motivo=transferencia.motivo,
+                    autorizado_por=transferencia.autorizado_por
+                )
+            )],
+            session=session
+        )
     
-    # Verificar que existe registro en sucursal destino, si no existe lo creamos
-    stock_destino = await collection.find_one({
-        "producto_id": producto_id,
-        "sucursal_id": transferencia.sucursal_destino
-    })
+    await ejecutar_en_transaccion(transferir)
     
-    if not stock_destino:
-        nuevo_registro = {
-            "producto_id": producto_id,
-            "sucursal_id": transferencia.sucursal_destino,
-            "stock_actual": 0,
-            "stock_minimo": 10,
-            "stock_maximo": 1000,
-            "ultima_actualizacion": datetime.utcnow()
-        }
-        await collection.insert_one(nuevo_registro)
-    
-    # Realizar transferencia
-    await collection.update_one(
-        {"producto_id": producto_id, "sucursal_id": transferencia.sucursal_origen},
-        {
-            "$inc": {"stock_actual": -transferencia.cantidad},
-            "$set": {"ultima_actualizacion": datetime.utcnow()}
-        }
-    )
+    return {
+        "message": "Transferencia realizada exitosamente",
+        "transferencia": transferencia.model_dump()
+    }
+
+@router.post("/transferir/lote")
+async def transferir_stock_lote(transferencia: TransferenciaLote):
+    """Transferir varios productos entre sucursales en una sola operación"""
+    if transferencia.sucursal_origen == transferencia.sucursal_destino:
+        raise HTTPException(status_code=400, detail="La sucursal origen y destino deben ser distintas")
+    
+    if not transferencia.productos:
+        raise HTTPException(status_code=400, detail="La transferencia no tiene productos")
+    
+    codigos = [item.producto_id for item in transferencia.productos]
+    repetidos = sorted({codigo for codigo in codigos if codigos.count(codigo) > 1})
+    if repetidos:
+        raise HTTPException(status_code=400, detail=f"Productos repetidos en la transferencia: {', '.join(repetidos)}")
+    
+    lineas = await lineas_inventario(item.model_dump() for item in transferencia.productos)
+    no_encontrados = [linea["codigo"] for clave, linea in lineas.items() if clave.startswith("codigo:")]
+    if no_encontrados:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {', '.join(no_encontrados)}")
+    
+    async def transferir(session):
+        fallidas = await descontar_stock(
+            lineas,
+            transferencia.sucursal_origen,
+            session,
+            tipo="transferencia_salida",
+            referencia=transferencia.sucursal_destino,
+            motivo=transferencia.motivo,
+            autorizado_por=transferencia.autorizado_por
+        )
+        if fallidas:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Stock insuficiente en sucursal origen", "lineas_fallidas": fallidas}
+            )
+        await acreditar_stock(
+            lineas,
+            transferencia.sucursal_destino,
+            session,
+            referencia=transferencia.sucursal_origen,
+            motivo=transferencia.motivo,
+            autorizado_por=transferencia.autorizado_por
+        )
     
-    await collection.update_one(
-        {"producto_id": producto_id, "sucursal_id": transferencia.sucursal_destino},
-        {
-            "$inc": {"stock_actual": transferencia.cantidad},
-            "$set": {"ultima_actualizacion": datetime.utcnow()}
-        }
-    )
+    await ejecutar_en_transaccion(transferir)
     
     return {
         "message": "Transferencia realizada exitosamente",
+        "productos_transferidos": len(lineas),
+        "unidades_transferidas": sum(linea["cantidad"] for linea in lineas.values()),
         "transferencia": transferencia.model_dump()
     }
 
@@ -201,7 +367,6 @@ async def transferir_stock(transferencia: TransferenciaStock):
 async def productos_proximos_vencer(dias: int = 7):
     """Productos próximos a vencer"""
     collection = await get_inventario_collection()
-    productos_collection = await get_productos_collection()
     
     fecha_limite = datetime.utcnow() + timedelta(days=dias)
     
@@ -210,18 +375,17 @@ async def productos_proximos_vencer(dias: int = 7):
             "$lte": fecha_limite, 
             "$gte": datetime.utcnow()
         }
-    }).to_list(1000)
+    }, SIN_HISTORIAL).to_list(1000)
+    
+    # Resolver todos los productos referenciados en una sola consulta
+    productos = await resolver_productos(
+        (item["producto_id"] for item in inventario_perecedero),
+        {"nombre": 1, "codigo": 1}
+    )
     
     productos_vencimiento = []
     for item in inventario_perecedero:
-        # Buscar producto por ID
-        try:
-            if ObjectId.is_valid(item["producto_id"]):
-                producto = await productos_collection.find_one({"_id": ObjectId(item["producto_id"])})
-            else:
-                producto = await productos_collection.find_one({"codigo": item["producto_id"]})
-        except:
-            producto = await productos_collection.find_one({"codigo": item["producto_id"]})
+        producto = productos.get(item["producto_id"])
         
         if producto:
             fecha_venc = item.get("fecha_vencimiento")
@@ -247,54 +411,98 @@ async def productos_proximos_vencer(dias: int = 7):
 async def ajustar_stock(ajuste: AjusteStock):
     """Ajustar inventario por pérdidas/mermas"""
     collection = await get_inventario_collection()
-    productos_collection = await get_productos_collection()
     
-    producto = await productos_collection.find_one({"codigo": ajuste.producto_id})
+    producto = await obtener_producto_por_codigo(ajuste.producto_id)
     if not producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
     producto_id = str(producto["_id"])
     
-    # Verificar que existe el registro
-    inventario = await collection.find_one({
-        "producto_id": producto_id,
-        "sucursal_id": ajuste.sucursal_id
-    })
-    
-    if not inventario:
-        raise HTTPException(status_code=404, detail="Registro de inventario no encontrado")
-    
-    nuevo_stock = inventario["stock_actual"] + ajuste.cantidad_ajuste
-    
-    if nuevo_stock < 0:
-        raise HTTPException(status_code=400, detail="El ajuste resultaría en stock negativo")
-    
-    # Registrar el ajuste
-    ajuste_registro = {
-        "fecha": datetime.utcnow(),
-        "cantidad_anterior": inventario["stock_actual"],
-        "ajuste": ajuste.cantidad_ajuste,
-        "cantidad_nueva": nuevo_stock,
-        "motivo": ajuste.motivo,
-        "tipo": ajuste.tipo_ajuste,
-        "autorizado_por": ajuste.autorizado_por
-    }
-    
-    # Actualizar inventario
-    await collection.update_one(
-        {"producto_id": producto_id, "sucursal_id": ajuste.sucursal_id},
-        {
-            "$set": {
-                "stock_actual": nuevo_stock,
-                "ultima_actualizacion": datetime.utcnow()
+    async def ajustar(session):
+        # Ajuste atómico con guarda: el stock resultante no puede ser negativo
+        inventario = await collection.find_one_and_update(
+            {
+                "producto_id": producto_id,
+                "sucursal_id": ajuste.sucursal_id,
+                "$expr": {"$gte": [{"$add": ["$stock_actual", ajuste.cantidad_ajuste]}, 0]}
             },
-            "$push": {"ajustes": ajuste_registro}
-        }
-    )
+            {
+                "$inc": {"stock_actual": ajuste.cantidad_ajuste},
+                "$set": {"ultima_actualizacion": datetime.utcnow()}
+            },
+            projection={"stock_actual": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if inventario is None:
+            existe = await collection.find_one(
+                {"producto_id": producto_id, "sucursal_id": ajuste.sucursal_id},
+                {"_id": 1},
+                session=session
+            )
+            if not existe:
+                raise HTTPException(status_code=404, detail="Registro de inventario no encontrado")
+            raise HTTPException(status_code=400, detail="El ajuste resultaría en stock negativo")
+        
+        # Registrar el ajuste en el historial de movimientos
+        registro = movimiento(
+            "ajuste",
+            ajuste.cantidad_ajuste,
+            motivo=ajuste.motivo,
+            tipo_ajuste=ajuste.tipo_ajuste,
+            cantidad_anterior=inventario["stock_actual"],
+            cantidad_nueva=inventario["stock_actual"] + ajuste.cantidad_ajuste,
+            autorizado_por=ajuste.autorizado_por
+        )
+        await registrar_movimientos([(producto_id, ajuste.sucursal_id, registro)], session=session)
+        return registro
+    
+    registro = await ejecutar_en_transaccion(ajustar)
     
     return {
         "message": "Ajuste de stock realizado exitosamente",
-        "stock_anterior": inventario["stock_actual"],
-        "stock_nuevo": nuevo_stock,
-        "ajuste": ajuste_registro
+        "stock_anterior": registro["cantidad_anterior"],
+        "stock_nuevo": registro["cantidad_nueva"],
+        "ajuste": registro
     }
+
+@router.get("/historico", response_model=StockHistorico)
+async def get_stock_historico(sucursal_id: str, producto_id: str, fecha: datetime):
+    """Stock de un producto en una sucursal en una fecha pasada"""
+    # Se acepta el _id del producto o su código
+    producto = (await obtener_productos([producto_id])).get(producto_id)
+    if producto:
+        producto_id = str(producto["_id"])
+    
+    # Las fechas se guardan en UTC sin zona horaria
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    historico = await stock_en_fecha(producto_id, sucursal_id, fecha)
+    if historico is None:
+        raise HTTPException(status_code=404, detail="Registro de inventario no encontrado")
+    
+    return StockHistorico(producto_id=producto_id, sucursal_id=sucursal_id, fecha=fecha, **historico)
+
+@router.get("/movimientos/sucursal/{sucursal_id}/producto/{producto_id}", response_model=Pagina[BucketMovimientos])
+async def get_movimientos(
+    sucursal_id: str,
+    producto_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(12, ge=1, le=LIMITE_MAXIMO)
+):
+    """Historial de movimientos de un producto en una sucursal, por buckets"""
+    collection = await get_movimientos_collection()
+    
+    # Se acepta el _id del producto o su código
+    producto = (await obtener_productos([producto_id])).get(producto_id)
+    if producto:
+        producto_id = str(producto["_id"])
+    
+    buckets, next_cursor = await paginar(
+        collection,
+        {"producto_id": producto_id, "sucursal_id": sucursal_id},
+        cursor,
+        limit
+    )
+    return {"items": convertir_bson(buckets), "next_cursor": next_cursor}
@@ -1,33 +1,45 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from typing import Optional
 from models.productos import Producto, ProductoCreate, ProductoUpdate
+from models.paginacion import Pagina
 from database import get_productos_collection
+from utils.paginacion import paginar, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from utils.cache_catalogo import cache_catalogo
+from utils.cache_http import version_coleccion, incrementar_version, calcular_etag, no_modificado, con_cache
+from utils.serializers import SerializadorModelo, convertir_bson, parametro_campos
 import uuid
 from bson import ObjectId
 
 router = APIRouter()
 
-def convert_objectid(doc):
-    """Convierte ObjectId a string para serialización"""
-    if doc and "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    return doc
+serializador = SerializadorModelo(Producto)
 
-@router.get("/", response_model=List[Producto])
-async def get_productos():
+@router.get("/", response_model=Pagina[Producto])
+async def get_productos(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    fields: Optional[str] = parametro_campos()
+):
     """Obtener todos los productos"""
+    etag = calcular_etag(request, await version_coleccion("productos"))
+    respuesta_304 = no_modificado(request, etag, "productos")
+    if respuesta_304:
+        return respuesta_304
+    
     collection = await get_productos_collection()
-    productos = await collection.find().to_list(1000)
-    return [convert_objectid(producto) for producto in productos]
+    productos, next_cursor = await paginar(collection, {}, cursor, limit, serializador.proyeccion_campos(fields))
+    return con_cache(serializador.pagina(productos, next_cursor, fields), response, etag, "productos")
 
 @router.get("/{producto_id}", response_model=Producto)
-async def get_producto(producto_id: str):
+async def get_producto(producto_id: str, fields: Optional[str] = parametro_campos()):
     """Obtener un producto por ID"""
     collection = await get_productos_collection()
-    producto = await collection.find_one({"_id": ObjectId(producto_id)})
+    producto = await collection.find_one({"_id": ObjectId(producto_id)}, serializador.proyeccion_campos(fields))
     if producto is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
-    return convert_objectid(producto)
+    return serializador.documento(producto, fields)
 
 @router.post("/", response_model=Producto, status_code=status.HTTP_201_CREATED)
 async def create_producto(producto: ProductoCreate):
@@ -41,10 +53,12 @@ async def create_producto(producto: ProductoCreate):
     producto_dict["_id"] = producto_id
     
     result = await collection.insert_one(producto_dict)
+    cache_catalogo.invalidar(producto_id)
+    await incrementar_version("productos")
     
     if result.inserted_id:
         created_producto = await collection.find_one({"_id": producto_id})
-        return convert_objectid(created_producto)
+        return convertir_bson(created_producto)
     
     raise HTTPException(status_code=400, detail="Error al crear el producto")
 
@@ -63,12 +77,14 @@ async def update_producto(producto_id: str, producto: ProductoUpdate):
         {"_id": ObjectId(producto_id)}, 
         {"$set": update_data}
     )
+    cache_catalogo.invalidar(producto_id)
+    await incrementar_version("productos")
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
     updated_producto = await collection.find_one({"_id": ObjectId(producto_id)})
-    return convert_objectid(updated_producto)
+    return convertir_bson(updated_producto)
 
 @router.delete("/{producto_id}")
 async def delete_producto(producto_id: str):
@@ -76,15 +92,31 @@ async def delete_producto(producto_id: str):
     collection = await get_productos_collection()
     
     result = await collection.delete_one({"_id": ObjectId(producto_id)})
+    cache_catalogo.invalidar(producto_id)
+    await incrementar_version("productos")
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
     return {"message": "Producto eliminado exitosamente"}
 
-@router.get("/categoria/{categoria}", response_model=List[Producto])
-async def get_productos_por_categoria(categoria: str):
+@router.get("/categoria/{categoria}", response_model=Pagina[Producto])
+async def get_productos_por_categoria(
+    categoria: str,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    fields: Optional[str] = parametro_campos()
+):
     """Obtener productos por categoría"""
+    etag = calcular_etag(request, await version_coleccion("productos"))
+    respuesta_304 = no_modificado(request, etag, "productos_categoria")
+    if respuesta_304:
+        return respuesta_304
+    
     collection = await get_productos_collection()
-    productos = await collection.find({"categoria": categoria}).to_list(1000)
-    return [convert_objectid(producto) for producto in productos]
+    productos, next_cursor = await paginar(
+        collection, {"categoria": categoria}, cursor, limit, serializador.proyeccion_campos(fields)
+    )
+    return con_cache(serializador.pagina(productos, next_cursor, fields), response, etag, "productos_categoria")
@@ -1,17 +1,19 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import Optional
 from models.transacciones import Transaccion, TransaccionCreate, TransaccionUpdate
+from models.paginacion import Pagina
 from database import get_transacciones_collection
+from utils.paginacion import paginar, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from utils.serializers import convertir_bson
 import uuid
 from datetime import datetime
 from bson import ObjectId
 
 router = APIRouter()
 
-def convert_objectid(doc):
-    """Convierte ObjectId a string y ajusta estructura de datos"""
-    if doc and "_id" in doc:
-        doc["_id"] = str(doc["_id"])
+def adaptar_transaccion(doc):
+    """Convierte tipos BSON y ajusta estructura de datos al modelo Transaccion"""
+    convertir_bson(doc)
     
     if doc and "productos" in doc:
         for producto in doc["productos"]:
@@ -39,12 +41,15 @@ def convert_objectid(doc):
     
     return doc
 
-@router.get("/", response_model=List[Transaccion])
-async def get_transacciones():
+@router.get("/", response_model=Pagina[Transaccion])
+async def get_transacciones(
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO)
+):
     """Obtener todas las transacciones"""
     collection = await get_transacciones_collection()
-    transacciones = await collection.find().to_list(1000)
-    return [convert_objectid(t) for t in transacciones]
+    transacciones, next_cursor = await paginar(collection, {}, cursor, limit)
+    return {"items": [adaptar_transaccion(t) for t in transacciones], "next_cursor": next_cursor}
 
 @router.get("/{transaccion_id}", response_model=Transaccion)
 async def get_transaccion(transaccion_id: str):
@@ -53,21 +58,29 @@ async def get_transaccion(transaccion_id: str):
     transaccion = await collection.find_one({"_id": ObjectId(transaccion_id)})
     if transaccion is None:
         raise HTTPException(status_code=404, detail="Transacción no encontrada")
-    return convert_objectid(transaccion)
+    return adaptar_transaccion(transaccion)
 
-@router.get("/cliente/{cliente_id}", response_model=List[Transaccion])
-async def get_transacciones_por_cliente(cliente_id: str):
+@router.get("/cliente/{cliente_id}", response_model=Pagina[Transaccion])
+async def get_transacciones_por_cliente(
+    cliente_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO)
+):
     """Obtener transacciones por cliente"""
     collection = await get_transacciones_collection()
-    transacciones = await collection.find({"cliente_id": cliente_id}).to_list(1000)
-    return [convert_objectid(t) for t in transacciones]
+    transacciones, next_cursor = await paginar(collection, {"cliente_id": cliente_id}, cursor, limit)
+    return {"items": [adaptar_transaccion(t) for t in transacciones], "next_cursor": next_cursor}
 
-@router.get("/sucursal/{sucursal_id}", response_model=List[Transaccion])
-async def get_transacciones_por_sucursal(sucursal_id: str):
+@router.get("/sucursal/{sucursal_id}", response_model=Pagina[Transaccion])
+async def get_transacciones_por_sucursal(
+    sucursal_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO)
+):
     """Obtener transacciones por sucursal"""
     collection = await get_transacciones_collection()
-    transacciones = await collection.find({"sucursal_id": sucursal_id}).to_list(1000)
-    return [convert_objectid(t) for t in transacciones]
+    transacciones, next_cursor = await paginar(collection, {"sucursal_id": sucursal_id}, cursor, limit)
+    return {"items": [adaptar_transaccion(t) for t in transacciones], "next_cursor": next_cursor}
 
 @router.post("/", response_model=Transaccion, status_code=status.HTTP_201_CREATED)
 async def create_transaccion(transaccion: TransaccionCreate):
@@ -85,7 +98,7 @@ async def create_transaccion(transaccion: TransaccionCreate):
     
     if result.inserted_id:
         created_transaccion = await collection.find_one({"_id": result.inserted_id})
-        return convert_objectid(created_transaccion)
+        return adaptar_transaccion(created_transaccion)
     
     raise HTTPException(status_code=400, detail="Error al crear la transacción")
 
@@ -108,7 +121,7 @@ async def update_transaccion(transaccion_id: str, transaccion: TransaccionUpdate
         raise HTTPException(status_code=404, detail="Transacción no encontrada")
     
     updated_transaccion = await collection.find_one({"_id": ObjectId(transaccion_id)})
-    return convert_objectid(updated_transaccion)
+    return adaptar_transaccion(updated_transaccion)
 
 @router.delete("/{transaccion_id}")
 async def delete_transaccion(transaccion_id: str):
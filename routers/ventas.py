@@ -3,11 +3,19 @@ from typing import List
 from models.ventas import (
     TransaccionVenta, IniciarTransaccionRequest, AgregarProductoRequest,
     AplicarPromocionRequest, FinalizarVentaRequest, ProductoCarrito,
-    PromocionAplicada, EstadoTransaccion
+    PromocionAplicada, EstadoTransaccion, CheckoutRequest
 )
-from database import get_transacciones_collection, get_productos_collection, get_inventario_collection
+from database import get_transacciones_collection, get_inventario_collection, ejecutar_en_transaccion
+from utils.cache_catalogo import obtener_producto_por_codigo, obtener_productos
+from utils.reservas import vencimiento_reserva
+from utils.resumen_ventas import valor_base
+from utils.post_venta import cola_post_venta, encolar, tareas_venta
+from utils.stock import lineas_inventario, descontar_stock, reservar_stock, liberar_reservas
+from utils.recomendador import recomendador
+from utils.tiempo_real import panel_tiempo_real
 from datetime import datetime
 import uuid
+from pymongo import ReturnDocument
 
 router = APIRouter()
 
@@ -31,69 +39,93 @@ async def iniciar_transaccion(request: IniciarTransaccionRequest):
     
     raise HTTPException(status_code=400, detail="Error al iniciar la transacción")
 
+# Simulación de validación de promoción
+PROMOCIONES_VALIDAS = {
+    "DESC10": {"tipo": "porcentaje", "descuento": 0.10, "descripcion": "10% de descuento"},
+    "DESC20": {"tipo": "porcentaje", "descuento": 0.20, "descripcion": "20% de descuento"},
+    "FIJO50": {"tipo": "fijo", "descuento": 50.0, "descripcion": "$50 de descuento"}
+}
+
+def _calcular_descuento(promo_data: dict, subtotal: float) -> float:
+    """Descuento de una promoción sobre el subtotal del carrito"""
+    if promo_data["tipo"] == "porcentaje":
+        return subtotal * promo_data["descuento"]
+    return min(promo_data["descuento"], subtotal)
+
+async def _error_transaccion_inactiva(collection, transaccion_id: str):
+    """Distinguir entre transacción inexistente y no activa tras una escritura sin match"""
+    if await collection.find_one({"transaccion_id": transaccion_id}, {"_id": 1}) is None:
+        raise HTTPException(status_code=404, detail="Transacción no encontrada")
+    raise HTTPException(status_code=400, detail="La transacción no está activa")
+
 @router.post("/agregar-producto/{transaccion_id}")
 async def agregar_producto(transaccion_id: str, request: AgregarProductoRequest):
     """Agregar producto al carrito"""
     transacciones_collection = await get_transacciones_collection()
-    productos_collection = await get_productos_collection()
     inventario_collection = await get_inventario_collection()
     
-    # Verificar que la transacción existe y está activa
-    transaccion = await transacciones_collection.find_one({"transaccion_id": transaccion_id})
+    # Verificar que la transacción existe y está activa (solo la cabecera, no el carrito)
+    transaccion = await transacciones_collection.find_one(
+        {"transaccion_id": transaccion_id},
+        {"estado": 1, "sucursal_id": 1}
+    )
     if not transaccion:
         raise HTTPException(status_code=404, detail="Transacción no encontrada")
     
     if transaccion["estado"] != EstadoTransaccion.INICIADA:
         raise HTTPException(status_code=400, detail="La transacción no está activa")
     
-    producto = await productos_collection.find_one({"codigo": request.producto_id})
+    producto = await obtener_producto_por_codigo(request.producto_id)
     if not producto:
         raise HTTPException(status_code=404, detail=f"Producto con código {request.producto_id} no encontrado")
     
     producto_id = str(producto["_id"])
     
-    inventario = await inventario_collection.find_one({
-        "producto_id": producto_id,
-        "sucursal_id": transaccion["sucursal_id"]
-    })
-    
-    if not inventario:
-        raise HTTPException(status_code=400, detail="Producto no disponible en esta sucursal")
-    
-    if inventario["stock_actual"] < request.cantidad:
-        raise HTTPException(status_code=400, detail=f"Stock insuficiente. Disponible: {inventario['stock_actual']}")
+    # Reservar el stock de forma atómica para que carritos simultáneos no sobrevendan
+    if not await reservar_stock(producto_id, transaccion["sucursal_id"], request.cantidad):
+        inventario = await inventario_collection.find_one(
+            {"producto_id": producto_id, "sucursal_id": transaccion["sucursal_id"]},
+            {"stock_actual": 1, "stock_reservado": 1}
+        )
+        if not inventario:
+            raise HTTPException(status_code=400, detail="Producto no disponible en esta sucursal")
+        disponible = inventario["stock_actual"] - inventario.get("stock_reservado", 0)
+        raise HTTPException(status_code=400, detail=f"Stock insuficiente. Disponible: {max(disponible, 0)}")
     
     # Crear producto para el carrito
+    precio = valor_base(producto["precio"])
     producto_carrito = ProductoCarrito(
         producto_id=request.producto_id,  # Usar el código original
         cantidad=request.cantidad,
-        precio_unitario=producto["precio"],
-        subtotal=producto["precio"] * request.cantidad
+        precio_unitario=precio,
+        subtotal=precio * request.cantidad,
+        reservado=True
     )
     
-    # Actualizar transacción
-    productos_actuales = transaccion.get("productos", [])
-    productos_actuales.append(producto_carrito.model_dump())
-    
-    nuevo_subtotal = sum(p["subtotal"] for p in productos_actuales)
-    nuevo_total = nuevo_subtotal - transaccion.get("descuento_total", 0)
-    
-    await transacciones_collection.update_one(
-        {"transaccion_id": transaccion_id},
+    # Agregar la línea con operadores atómicos: dos escaneos simultáneos no
+    # se pisan y el costo no depende del tamaño del carrito. Los descuentos
+    # ya aplicados no cambian, así que el total crece igual que el subtotal.
+    actualizada = await transacciones_collection.find_one_and_update(
+        {"transaccion_id": transaccion_id, "estado": EstadoTransaccion.INICIADA},
         {
-            "$set": {
-                "productos": productos_actuales,
-                "subtotal": nuevo_subtotal,
-                "total": nuevo_total
-            }
-        }
+            "$push": {"productos": producto_carrito.model_dump()},
+            "$inc": {"subtotal": producto_carrito.subtotal, "total": producto_carrito.subtotal},
+            # Cada escaneo renueva la reserva de todo el carrito
+            "$set": {"reserva_expira": vencimiento_reserva()}
+        },
+        projection={"_id": 0, "subtotal": 1, "total": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if actualizada is None:
+        # La venta se cerró entre la verificación y la escritura: devolver la reserva
+        await liberar_reservas({producto_id: request.cantidad}, transaccion["sucursal_id"])
+        await _error_transaccion_inactiva(transacciones_collection, transaccion_id)
     
     return {
         "message": "Producto agregado al carrito", 
         "producto": producto["nombre"],
-        "subtotal": nuevo_subtotal, 
-        "total": nuevo_total
+        "subtotal": actualizada["subtotal"], 
+        "total": actualizada["total"]
     }
 
 @router.post("/aplicar-promocion/{transaccion_id}")
@@ -101,92 +133,167 @@ async def aplicar_promocion(transaccion_id: str, request: AplicarPromocionReques
     """Validar y aplicar descuentos"""
     collection = await get_transacciones_collection()
     
-    transaccion = await collection.find_one({"transaccion_id": transaccion_id})
-    if not transaccion:
-        raise HTTPException(status_code=404, detail="Transacción no encontrada")
-    
-    # Simulación de validación de promoción
-    promociones_validas = {
-        "DESC10": {"tipo": "porcentaje", "descuento": 0.10, "descripcion": "10% de descuento"},
-        "DESC20": {"tipo": "porcentaje", "descuento": 0.20, "descripcion": "20% de descuento"},
-        "FIJO50": {"tipo": "fijo", "descuento": 50.0, "descripcion": "$50 de descuento"}
-    }
-    
-    if request.codigo_promocion not in promociones_validas:
+    if request.codigo_promocion not in PROMOCIONES_VALIDAS:
         raise HTTPException(status_code=400, detail="Código de promoción inválido")
     
-    promo_data = promociones_validas[request.codigo_promocion]
+    promo_data = PROMOCIONES_VALIDAS[request.codigo_promocion]
     
-    # Calcular descuento
-    subtotal = transaccion.get("subtotal", 0)
+    # Calcular descuento sobre el subtotal guardado, en el servidor
+    subtotal = {"$ifNull": ["$subtotal", 0]}
     if promo_data["tipo"] == "porcentaje":
-        descuento = subtotal * promo_data["descuento"]
+        descuento = {"$multiply": [subtotal, promo_data["descuento"]]}
     else:
-        descuento = min(promo_data["descuento"], subtotal)
+        descuento = {"$min": [promo_data["descuento"], subtotal]}
     
-    promocion = PromocionAplicada(
-        promocion_id=request.codigo_promocion,
-        tipo=promo_data["tipo"],
-        descuento=descuento,
-        descripcion=promo_data["descripcion"]
-    )
-    
-    promociones_actuales = transaccion.get("promociones", [])
-    promociones_actuales.append(promocion.model_dump())
-    
-    descuento_total = sum(p["descuento"] for p in promociones_actuales)
-    nuevo_total = subtotal - descuento_total
+    promocion = {
+        "promocion_id": {"$literal": request.codigo_promocion},
+        "tipo": {"$literal": promo_data["tipo"]},
+        "descuento": descuento,
+        "descripcion": {"$literal": promo_data["descripcion"]}
+    }
     
-    await collection.update_one(
-        {"transaccion_id": transaccion_id},
-        {
-            "$set": {
-                "promociones": promociones_actuales,
-                "descuento_total": descuento_total,
-                "total": max(0, nuevo_total)
-            }
-        }
+    actualizada = await collection.find_one_and_update(
+        {"transaccion_id": transaccion_id, "estado": EstadoTransaccion.INICIADA},
+        [
+            {"$set": {"promociones": {"$concatArrays": [{"$ifNull": ["$promociones", []]}, [promocion]]}}},
+            {"$set": {"descuento_total": {"$sum": "$promociones.descuento"}}},
+            {"$set": {"total": {"$max": [0, {"$subtract": [subtotal, "$descuento_total"]}]}}}
+        ],
+        projection={"_id": 0, "total": 1, "promociones": {"$slice": -1}},
+        return_document=ReturnDocument.AFTER
     )
+    if actualizada is None:
+        await _error_transaccion_inactiva(collection, transaccion_id)
     
-    return {"message": "Promoción aplicada", "descuento": descuento, "total": max(0, nuevo_total)}
+    return {
+        "message": "Promoción aplicada",
+        "descuento": actualizada["promociones"][0]["descuento"],
+        "total": actualizada["total"]
+    }
 
 @router.post("/finalizar/{transaccion_id}")
 async def finalizar_venta(transaccion_id: str, request: FinalizarVentaRequest):
     """Procesar pago y finalizar venta"""
     transacciones_collection = await get_transacciones_collection()
-    inventario_collection = await get_inventario_collection()
-    
-    transaccion = await transacciones_collection.find_one({"transaccion_id": transaccion_id})
-    if not transaccion:
-        raise HTTPException(status_code=404, detail="Transacción no encontrada")
-    
-    if transaccion["estado"] != EstadoTransaccion.INICIADA:
-        raise HTTPException(status_code=400, detail="La transacción ya fue procesada")
-    
-    # Actualizar inventario
-    for producto in transaccion.get("productos", []):
-        await inventario_collection.update_one(
+    finalizada = {}
+    
+    async def finalizar(session):
+        fecha_finalizacion = datetime.utcnow()
+        
+        # El carrito se lee con la misma escritura que lo cierra: un agregar-producto
+        # simultáneo queda incluido en la venta o falla por el filtro de estado
+        transaccion = await transacciones_collection.find_one_and_update(
+            {"transaccion_id": transaccion_id, "estado": EstadoTransaccion.INICIADA},
             {
-                "producto_id": producto["producto_id"],
-                "sucursal_id": transaccion["sucursal_id"]
+                "$set": {
+                    "estado": EstadoTransaccion.FINALIZADA,
+                    "fecha_finalizacion": fecha_finalizacion,
+                    "metodo_pago": request.metodo_pago,
+                    "monto_recibido": request.monto_recibido
+                }
             },
-            {
-                "$inc": {"stock_actual": -producto["cantidad"]},
-                "$set": {"ultima_actualizacion": datetime.utcnow()}
-            }
+            session=session,
+            return_document=ReturnDocument.AFTER
         )
-    
-    # Finalizar transacción
-    await transacciones_collection.update_one(
-        {"transaccion_id": transaccion_id},
-        {
-            "$set": {
-                "estado": EstadoTransaccion.FINALIZADA,
-                "fecha_finalizacion": datetime.utcnow(),
-                "metodo_pago": request.metodo_pago,
-                "monto_recibido": request.monto_recibido
-            }
-        }
-    )
+        if transaccion is None:
+            await _error_transaccion_inactiva(transacciones_collection, transaccion_id)
+        
+        # Actualizar inventario
+        lineas = await lineas_inventario(transaccion.get("productos", []))
+        if lineas:
+            fallidas = await descontar_stock(lineas, transaccion["sucursal_id"], session, referencia=transaccion_id)
+            if fallidas:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "Stock insuficiente para finalizar la venta", "lineas_fallidas": fallidas}
+                )
+        
+        # Resumen, puntos y alertas de stock se procesan fuera de la petición
+        await encolar(tareas_venta(transaccion, fecha_finalizacion, lineas), session=session)
+        finalizada.update(transaccion=transaccion, fecha=fecha_finalizacion)
+    
+    await ejecutar_en_transaccion(finalizar)
+    cola_post_venta.notificar()
+    transaccion = finalizada["transaccion"]
+    recomendador.registrar_canasta(p["producto_id"] for p in transaccion.get("productos", []))
+    panel_tiempo_real.venta_local(transaccion, finalizada["fecha"])
     
     return {"message": "Venta finalizada exitosamente", "transaccion_id": transaccion_id}
+
+@router.post("/checkout", response_model=TransaccionVenta, status_code=status.HTTP_201_CREATED)
+async def checkout(request: CheckoutRequest):
+    """Registrar una venta completa en una sola llamada"""
+    transacciones_collection = await get_transacciones_collection()
+    
+    if not request.productos:
+        raise HTTPException(status_code=400, detail="La venta no tiene productos")
+    
+    invalidas = [codigo for codigo in request.codigos_promocion if codigo not in PROMOCIONES_VALIDAS]
+    if invalidas:
+        raise HTTPException(status_code=400, detail=f"Código de promoción inválido: {', '.join(invalidas)}")
+    
+    # Precios desde el catálogo, con una sola consulta para lo que no está en cache
+    catalogo = await obtener_productos(item.producto_id for item in request.productos)
+    no_encontrados = [item.producto_id for item in request.productos if item.producto_id not in catalogo]
+    if no_encontrados:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {', '.join(no_encontrados)}")
+    
+    productos_carrito = []
+    for item in request.productos:
+        precio = valor_base(catalogo[item.producto_id]["precio"])
+        productos_carrito.append(ProductoCarrito(
+            producto_id=item.producto_id,
+            cantidad=item.cantidad,
+            precio_unitario=precio,
+            subtotal=precio * item.cantidad
+        ))
+    subtotal = sum(p.subtotal for p in productos_carrito)
+    
+    # Mismas reglas que aplicar-promocion: cada descuento se calcula sobre el subtotal
+    promociones = [
+        PromocionAplicada(
+            promocion_id=codigo,
+            tipo=PROMOCIONES_VALIDAS[codigo]["tipo"],
+            descuento=_calcular_descuento(PROMOCIONES_VALIDAS[codigo], subtotal),
+            descripcion=PROMOCIONES_VALIDAS[codigo]["descripcion"]
+        )
+        for codigo in request.codigos_promocion
+    ]
+    descuento_total = sum(p.descuento for p in promociones)
+    
+    fecha_finalizacion = datetime.utcnow()
+    transaccion = TransaccionVenta(
+        transaccion_id=f"T{uuid.uuid4().hex[:8].upper()}",
+        cliente_id=request.cliente_id,
+        sucursal_id=request.sucursal_id,
+        productos=productos_carrito,
+        promociones=promociones,
+        subtotal=subtotal,
+        descuento_total=descuento_total,
+        total=max(0, subtotal - descuento_total),
+        estado=EstadoTransaccion.FINALIZADA,
+        fecha_inicio=fecha_finalizacion,
+        fecha_finalizacion=fecha_finalizacion
+    )
+    documento = transaccion.model_dump()
+    documento["metodo_pago"] = request.metodo_pago
+    documento["monto_recibido"] = request.monto_recibido
+    
+    lineas = await lineas_inventario(documento["productos"])
+    
+    async def registrar(session):
+        fallidas = await descontar_stock(lineas, request.sucursal_id, session, referencia=transaccion.transaccion_id)
+        if fallidas:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Stock insuficiente para completar la venta", "lineas_fallidas": fallidas}
+            )
+        await transacciones_collection.insert_one(dict(documento), session=session)
+        await encolar(tareas_venta(documento, fecha_finalizacion, lineas), session=session)
+    
+    await ejecutar_en_transaccion(registrar)
+    cola_post_venta.notificar()
+    recomendador.registrar_canasta(p["producto_id"] for p in documento["productos"])
+    panel_tiempo_real.venta_local(documento, fecha_finalizacion)
+    
+    return transaccion
@@ -0,0 +1,289 @@
+"""
+Benchmark de carga de la API con los escenarios de pruebas.py.
+
+Cada escenario se repite con varios clientes concurrentes durante un tiempo
+fijo, con httpx asíncrono contra la app en el mismo proceso (ASGITransport,
+sin red) o contra un servidor uvicorn con --url. Por endpoint se reportan
+peticiones/s y latencias p50/p95/p99, y el resultado se guarda en JSON con
+el commit actual para comparar corridas.
+
+Los códigos de producto, sucursales y clientes se toman de la base indicada
+en MONGODB_URL / DATABASE_NAME. Finalizar, checkout y las transferencias
+usan transacciones multi-documento, que solo existen en un replica set (o
+mongos): un mongod suelto responde error en venta_completa y checkout. Para
+un replica set local de un nodo con datos sintéticos:
+
+    mongod --replSet rs0 --dbpath /tmp/megamart-bench --port 27017
+    mongosh --eval 'rs.initiate()'
+    export MONGODB_URL="mongodb://localhost:27017/?replicaSet=rs0"
+    python scripts/seed_data.py --generar --productos 2000 --dias 90
+    python scripts/benchmark.py --duracion 20
+
+Uso:
+    python scripts/benchmark.py --escenarios checkout analytics --concurrencia 50
+    python scripts/benchmark.py --url http://localhost:8000 --comparar bench_results/anterior.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017/?replicaSet=rs0")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "sistema_inventario")
+# La app en proceso se conecta a la misma base
+os.environ.setdefault("MONGODB_URL", MONGODB_URL)
+os.environ.setdefault("DATABASE_NAME", DATABASE_NAME)
+
+class Mediciones:
+    """Latencias y estados por endpoint"""
+
+    def __init__(self):
+        self.latencias = defaultdict(list)
+        self.errores = defaultdict(int)
+
+    async def medir(self, cliente: httpx.AsyncClient, etiqueta: str, metodo: str, url: str, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            response = await cliente.request(metodo, url, **kwargs)
+        except httpx.HTTPError:
+            self.errores[etiqueta] += 1
+            self.latencias[etiqueta].append(time.perf_counter() - inicio)
+            return None
+        self.latencias[etiqueta].append(time.perf_counter() - inicio)
+        # 409 por stock insuficiente es una respuesta esperada bajo carga
+        if response.status_code >= 400 and response.status_code != 409:
+            self.errores[etiqueta] += 1
+        return response
+
+    def resumen(self, segundos: float) -> dict:
+        resultado = {}
+        for etiqueta, latencias in sorted(self.latencias.items()):
+            ms = np.array(latencias) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            resultado[etiqueta] = {
+                "peticiones": len(latencias),
+                "errores": self.errores[etiqueta],
+                "rps": round(len(latencias) / segundos, 2),
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+                "max_ms": round(float(ms.max()), 2)
+            }
+        return resultado
+
+# ============================================================================
+# ESCENARIOS (los mismos flujos de pruebas.py)
+# ============================================================================
+
+async def venta_completa(cliente, medidas: Mediciones, datos: dict):
+    response = await medidas.medir(cliente, "POST /api/ventas/iniciar-transaccion", "POST", "/api/ventas/iniciar-transaccion", json={
+        "cliente_id": random.choice(datos["clientes"]),
+        "sucursal_id": random.choice(datos["sucursales"])
+    })
+    if response is None or response.status_code != 201:
+        return
+    transaccion_id = response.json()["transaccion_id"]
+    for codigo in random.sample(datos["codigos"], k=min(3, len(datos["codigos"]))):
+        await medidas.medir(
+            cliente, "POST /api/ventas/agregar-producto/{id}", "POST",
+            f"/api/ventas/agregar-producto/{transaccion_id}", json={"producto_id": codigo, "cantidad": 1}
+        )
+    await medidas.medir(
+        cliente, "POST /api/ventas/aplicar-promocion/{id}", "POST",
+        f"/api/ventas/aplicar-promocion/{transaccion_id}", json={"codigo_promocion": "DESC10"}
+    )
+    await medidas.medir(
+        cliente, "POST /api/ventas/finalizar/{id}", "POST",
+        f"/api/ventas/finalizar/{transaccion_id}", json={"metodo_pago": "tarjeta_credito", "monto_recibido": 100000}
+    )
+
+async def checkout(cliente, medidas: Mediciones, datos: dict):
+    await medidas.medir(cliente, "POST /api/ventas/checkout", "POST", "/api/ventas/checkout", json={
+        "cliente_id": random.choice(datos["clientes"]),
+        "sucursal_id": random.choice(datos["sucursales"]),
+        "productos": [
+            {"producto_id": codigo, "cantidad": random.randint(1, 3)}
+            for codigo in random.sample(datos["codigos"], k=min(3, len(datos["codigos"])))
+        ],
+        "codigos_promocion": ["DESC10"],
+        "metodo_pago": "tarjeta_credito",
+        "monto_recibido": 100000
+    })
+
+async def inventario(cliente, medidas: Mediciones, datos: dict):
+    await medidas.medir(
+        cliente, "GET /api/v1/inventario/disponibilidad/{codigo}", "GET",
+        f"/api/v1/inventario/disponibilidad/{random.choice(datos['codigos'])}"
+    )
+    await medidas.medir(
+        cliente, "GET /api/v1/inventario/sucursal/{id}", "GET",
+        f"/api/v1/inventario/sucursal/{random.choice(datos['sucursales'])}"
+    )
+    await medidas.medir(
+        cliente, "GET /api/v1/inventario/perecederos/vencimientos", "GET",
+        "/api/v1/inventario/perecederos/vencimientos", params={"dias": 7}
+    )
+
+async def analytics(cliente, medidas: Mediciones, datos: dict):
+    await medidas.medir(cliente, "GET /api/analytics/ventas/tiempo-real", "GET", "/api/analytics/ventas/tiempo-real")
+    await medidas.medir(cliente, "GET /api/analytics/productos/trending", "GET", "/api/analytics/productos/trending")
+    await medidas.medir(
+        cliente, "GET /api/analytics/prediccion-demanda/{id}", "GET",
+        f"/api/analytics/prediccion-demanda/{random.choice(datos['codigos'])}"
+    )
+    await medidas.medir(
+        cliente, "GET /api/analytics/cliente/{id}/recomendaciones", "GET",
+        f"/api/analytics/cliente/{random.choice(datos['clientes'])}/recomendaciones"
+    )
+
+async def catalogo(cliente, medidas: Mediciones, datos: dict):
+    # El dashboard revalida con el ETag de la respuesta anterior
+    response = await medidas.medir(cliente, "GET /api/v1/productos/", "GET", "/api/v1/productos/", params={"limit": 100})
+    if response is not None and response.headers.get("etag"):
+        await medidas.medir(
+            cliente, "GET /api/v1/productos/ (If-None-Match)", "GET", "/api/v1/productos/",
+            params={"limit": 100}, headers={"If-None-Match": response.headers["etag"]}
+        )
+
+ESCENARIOS = {
+    "venta_completa": venta_completa,
+    "checkout": checkout,
+    "inventario": inventario,
+    "analytics": analytics,
+    "catalogo": catalogo,
+}
+
+# ============================================================================
+# EJECUCIÓN
+# ============================================================================
+
+async def cargar_datos() -> dict:
+    """Códigos de producto, sucursales y clientes reales para las peticiones"""
+    client = AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=5000)
+    try:
+        # Sin replica set las ventas fallan todas: mejor detenerse antes de medir
+        hello = await client.admin.command("hello")
+        if not hello.get("setName") and hello.get("msg") != "isdbgrid":
+            raise SystemExit(
+                "❌ MongoDB no es un replica set y las ventas necesitan transacciones; "
+                "inicia mongod con --replSet rs0, ejecuta rs.initiate() y usa ?replicaSet=rs0 en MONGODB_URL"
+            )
+        database = client[DATABASE_NAME]
+        productos = await database.productos.find({"codigo": {"$exists": True}}, {"codigo": 1}).limit(500).to_list(500)
+        clientes = await database.clientes.find({}, {"_id": 1}).limit(500).to_list(500)
+        sucursales = await database.inventario.distinct("sucursal_id")
+    finally:
+        client.close()
+    datos = {
+        "codigos": [p["codigo"] for p in productos],
+        "clientes": [str(c["_id"]) for c in clientes],
+        "sucursales": sucursales
+    }
+    if not all(datos.values()):
+        raise SystemExit("❌ La base no tiene productos, clientes o inventario; ejecuta scripts/seed_data.py primero")
+    return datos
+
+async def ejecutar_escenario(cliente, nombre: str, datos: dict, concurrencia: int, duracion: float) -> dict:
+    medidas = Mediciones()
+    escenario = ESCENARIOS[nombre]
+    fin = time.perf_counter() + duracion
+
+    async def usuario():
+        while time.perf_counter() < fin:
+            await escenario(cliente, medidas, datos)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(usuario() for _ in range(concurrencia)))
+    return medidas.resumen(time.perf_counter() - inicio)
+
+def commit_actual() -> dict:
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=raiz, text=True).strip()
+        sucio = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=raiz, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, sucio = "desconocido", False
+    return {"commit": commit, "cambios_sin_commit": sucio}
+
+def imprimir_resultados(resultados: dict, anterior: dict = None):
+    for escenario, endpoints in resultados.items():
+        print(f"\n📊 {escenario}")
+        print(f"   {'endpoint':<52} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5}")
+        for etiqueta, stats in endpoints.items():
+            linea = (
+                f"   {etiqueta:<52} {stats['rps']:>8} {stats['p50_ms']:>8} "
+                f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['errores']:>5}"
+            )
+            previo = (anterior or {}).get(escenario, {}).get(etiqueta)
+            if previo and previo["p95_ms"]:
+                linea += f"   p95 {(stats['p95_ms'] - previo['p95_ms']) / previo['p95_ms'] * 100:+.1f}%"
+            print(linea)
+
+async def main(args):
+    datos = await cargar_datos()
+    print(f"🧪 {len(datos['codigos'])} productos, {len(datos['clientes'])} clientes, {len(datos['sucursales'])} sucursales")
+
+    if args.url:
+        cliente = httpx.AsyncClient(base_url=args.url, timeout=30)
+        lifespan = None
+    else:
+        from main import app
+        cliente = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=30)
+        # ASGITransport no ejecuta el lifespan: se abre a mano para conectar a MongoDB
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+
+    resultados = {}
+    try:
+        async with cliente:
+            for nombre in args.escenarios:
+                print(f"🚀 {nombre}: {args.concurrencia} clientes durante {args.duracion}s")
+                resultados[nombre] = await ejecutar_escenario(cliente, nombre, datos, args.concurrencia, args.duracion)
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            anterior = json.load(archivo)["resultados"]
+    imprimir_resultados(resultados, anterior)
+
+    salida = {
+        **commit_actual(),
+        "fecha": datetime.utcnow().isoformat(),
+        "modo": args.url or "asgi",
+        "concurrencia": args.concurrencia,
+        "duracion_s": args.duracion,
+        "resultados": resultados
+    }
+    os.makedirs(args.salida, exist_ok=True)
+    ruta = os.path.join(args.salida, f"{datetime.utcnow():%Y%m%d_%H%M%S}_{salida['commit']}.json")
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        json.dump(salida, archivo, indent=2, ensure_ascii=False)
+    print(f"\n💾 Resultados guardados en {ruta}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de carga de la API")
+    parser.add_argument("--url", help="Servidor a probar; sin --url la app corre en el mismo proceso")
+    parser.add_argument("--escenarios", nargs="+", choices=list(ESCENARIOS), default=list(ESCENARIOS))
+    parser.add_argument("--concurrencia", type=int, default=20, help="Clientes simultáneos por escenario")
+    parser.add_argument("--duracion", type=float, default=15, help="Segundos por escenario")
+    parser.add_argument("--salida", default="bench_results", help="Directorio de los JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para mostrar la variación del p95")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.semilla)
+    asyncio.run(main(args))
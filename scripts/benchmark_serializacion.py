@@ -0,0 +1,132 @@
+"""
+Script para medir el costo de serialización por documento en respuestas de
+listas grandes, con documentos sintéticos (no necesita MongoDB).
+
+Compara tres caminos para una página de clientes y otra de inventario:
+    antes       convert_objectid recursivo + validación del response_model + json
+    validado    convertir_bson + validación del response_model + orjson
+    confiable   SerializadorModelo sin re-validación + orjson
+
+Uso:
+    python scripts/benchmark_serializacion.py --documentos 500 --repeticiones 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.clientes import Cliente
+from models.inventario import Inventario
+from models.paginacion import Pagina
+from utils.serializers import SerializadorModelo, convertir_bson, dumps
+
+def convert_objectid_anterior(doc):
+    """Versión recursiva que tenía routers/clientes.py"""
+    if doc is None:
+        return None
+    if isinstance(doc, list):
+        return [convert_objectid_anterior(item) for item in doc]
+    if isinstance(doc, dict):
+        converted = {}
+        for key, value in doc.items():
+            if isinstance(value, ObjectId):
+                converted[key] = str(value)
+            elif isinstance(value, (dict, list)):
+                converted[key] = convert_objectid_anterior(value)
+            else:
+                converted[key] = value
+        return converted
+    return doc
+
+def generar_clientes(n: int):
+    ahora = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "nombre": f"Cliente {i}",
+            "email": f"cliente{i}@example.com",
+            "programa_fidelidad": {"puntos": i * 7 % 6000, "nivel": "Plata"},
+            "historial": [
+                {"transaccion_id": f"T{i:05d}{j}", "fecha": (ahora - timedelta(days=j)).strftime("%Y-%m-%d")}
+                for j in range(10)
+            ]
+        }
+        for i in range(n)
+    ]
+
+def generar_inventario(n: int):
+    ahora = datetime.utcnow()
+    # El modelo responde stock_actual con el alias "stock"; la proyección lo renombra en MongoDB
+    return [
+        {
+            "_id": ObjectId(),
+            "sucursal_id": f"S0{i % 5}",
+            "producto_id": str(ObjectId()),
+            "stock": 100 + i,
+            "stock_minimo": 10,
+            "stock_reservado": i % 3,
+            "lotes": [
+                {
+                    "numero_lote": f"L{i}{j}",
+                    "cantidad": 20,
+                    "fecha_vencimiento": ahora + timedelta(days=30 * j),
+                    "precio_compra": 15.5
+                }
+                for j in range(3)
+            ],
+            "ultima_actualizacion": ahora
+        }
+        for i in range(n)
+    ]
+
+def medir(funcion, generar, repeticiones: int) -> float:
+    """Segundos totales de funcion sobre copias frescas de los documentos"""
+    total = 0.0
+    for _ in range(repeticiones):
+        documentos = generar()
+        inicio = time.perf_counter()
+        funcion(documentos)
+        total += time.perf_counter() - inicio
+    return total
+
+def comparar(nombre, modelo, generar, n: int, repeticiones: int):
+    adaptador = TypeAdapter(Pagina[modelo])
+    serializador = SerializadorModelo(modelo)
+
+    def antes(documentos):
+        pagina = adaptador.validate_python({"items": convert_objectid_anterior(documentos), "next_cursor": None})
+        json.dumps(adaptador.dump_python(pagina, mode="json", by_alias=True)).encode()
+
+    def validado(documentos):
+        pagina = adaptador.validate_python({"items": convertir_bson(documentos), "next_cursor": None})
+        dumps(adaptador.dump_python(pagina, by_alias=True))
+
+    def confiable(documentos):
+        serializador.pagina(documentos, None).body
+
+    print(f"\n📦 {nombre}: {n} documentos x {repeticiones} repeticiones")
+    base = None
+    for etiqueta, funcion in (("antes", antes), ("validado", validado), ("confiable", confiable)):
+        segundos = medir(funcion, lambda: generar(n), repeticiones)
+        por_documento = segundos / (n * repeticiones) * 1e6
+        base = base or por_documento
+        print(f"   • {etiqueta:<10} {por_documento:8.2f} µs/doc   x{base / por_documento:5.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Costo de serialización por documento")
+    parser.add_argument("--documentos", type=int, default=500, help="Documentos por página")
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args()
+
+    comparar("clientes", Cliente, generar_clientes, args.documentos, args.repeticiones)
+    comparar("inventario", Inventario, generar_inventario, args.documentos, args.repeticiones)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Script para verificar utils/prediccion.py contra series sintéticas con una
+demanda conocida (no necesita MongoDB).
+
+Cada caso compara la demanda estimada a 7 y 30 días con la esperada y la
+etiqueta de tendencia; termina con código 1 si alguno falla.
+
+Uso:
+    python scripts/verificar_prediccion.py
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.prediccion import calcular_predicciones
+
+DIAS = 90
+# Diferencia aceptada respecto de la demanda esperada
+TOLERANCIA = 0.05
+
+def casos(fechas):
+    """(nombre, serie diaria, demanda esperada de los días futuros, tendencia)"""
+    ultimo = fechas[-1]
+    futuros = [ultimo + timedelta(days=h) for h in range(1, 31)]
+
+    def fin_de_semana(fecha):
+        return 10.0 if fecha.weekday() >= 5 else 0.0
+
+    def un_dia_por_semana(fecha):
+        return 10.0 if fecha.weekday() == fechas[0].weekday() else 0.0
+
+    return [
+        ("constante", lambda d, fecha: 10.0, lambda h, fecha: 10.0, "estable"),
+        ("lineal", lambda d, fecha: (d + 1) / 3, lambda h, fecha: (DIAS + h) / 3, "creciente"),
+        ("solo fin de semana", lambda d, fecha: fin_de_semana(fecha), lambda h, fecha: fin_de_semana(fecha), "estable"),
+        ("un día por semana", lambda d, fecha: un_dia_por_semana(fecha), lambda h, fecha: un_dia_por_semana(fecha), "estable"),
+    ], futuros
+
+def main():
+    fechas = [datetime(2026, 1, 5) + timedelta(days=d) for d in range(DIAS)]
+    definiciones, futuros = casos(fechas)
+    nombres = [nombre for nombre, *_ in definiciones]
+    matriz = np.array([[historia(d, fecha) for d, fecha in enumerate(fechas)] for _, historia, _, _ in definiciones])
+    predicciones = calcular_predicciones(nombres, fechas, matriz)
+
+    fallos = 0
+    for nombre, _, futuro, tendencia in definiciones:
+        prediccion = predicciones[nombre]
+        for horizonte in (7, 30):
+            esperado = sum(futuro(h, fecha) for h, fecha in enumerate(futuros[:horizonte], start=1))
+            estimado = prediccion[f"demanda_estimada_{horizonte}_dias"]
+            correcto = abs(estimado - esperado) <= max(1, TOLERANCIA * esperado)
+            fallos += not correcto
+            print(f"{'✅' if correcto else '❌'} {nombre:<20} {horizonte:>2} días: {estimado} (esperado {esperado:.0f})")
+        correcta = prediccion["tendencia"] == tendencia
+        fallos += not correcta
+        print(f"{'✅' if correcta else '❌'} {nombre:<20} tendencia: {prediccion['tendencia']} (esperada {tendencia})")
+
+    if fallos:
+        print(f"\n❌ {fallos} verificaciones fallidas")
+        sys.exit(1)
+    print("\n✅ Predicciones dentro de lo esperado")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Cache en memoria del catálogo de productos.
+
+El catálogo cambia poco y se consulta en cada escaneo del POS, así que los
+productos se guardan por proceso con TTL y expulsión LRU. Cada entrada se
+indexa por _id y por código; el router de productos invalida las entradas
+al crear, actualizar o eliminar.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from database import get_productos_collection
+from utils.resolver import resolver_productos
+
+class CacheCatalogo:
+    def __init__(self, capacidad: int = 5000, ttl: float = 300):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        # _id -> (expira, producto), en orden de uso para la expulsión LRU
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        self._por_codigo = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _clave_id(self, clave: str) -> Optional[str]:
+        if clave in self._entradas:
+            return clave
+        return self._por_codigo.get(clave)
+
+    def obtener(self, clave: str) -> Optional[dict]:
+        """Buscar por _id o por código; None si no está o expiró"""
+        producto_id = self._clave_id(clave)
+        if producto_id is not None:
+            expira, producto = self._entradas[producto_id]
+            if expira > time.monotonic():
+                self._entradas.move_to_end(producto_id)
+                self.hits += 1
+                return dict(producto)
+            self._eliminar(producto_id)
+        self.misses += 1
+        return None
+
+    def guardar(self, producto: dict):
+        producto_id = str(producto["_id"])
+        self._eliminar(producto_id)
+        self._entradas[producto_id] = (time.monotonic() + self.ttl, dict(producto))
+        if producto.get("codigo"):
+            self._por_codigo[producto["codigo"]] = producto_id
+        while len(self._entradas) > self.capacidad:
+            self._eliminar(next(iter(self._entradas)))
+
+    def invalidar(self, clave: str):
+        """Descartar el producto por _id o por código"""
+        producto_id = self._clave_id(str(clave))
+        if producto_id is not None:
+            self._eliminar(producto_id)
+
+    def limpiar(self):
+        self._entradas.clear()
+        self._por_codigo.clear()
+
+    def _eliminar(self, producto_id: str):
+        entrada = self._entradas.pop(producto_id, None)
+        if entrada:
+            codigo = entrada[1].get("codigo")
+            if codigo and self._por_codigo.get(codigo) == producto_id:
+                del self._por_codigo[codigo]
+
+    def estadisticas(self) -> dict:
+        consultas = self.hits + self.misses
+        return {
+            "entradas": len(self._entradas),
+            "capacidad": self.capacidad,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / consultas if consultas else 0.0
+        }
+
+cache_catalogo = CacheCatalogo(
+    capacidad=int(os.getenv("CACHE_CATALOGO_CAPACIDAD", "5000")),
+    ttl=float(os.getenv("CACHE_CATALOGO_TTL", "300"))
+)
+
+async def obtener_producto_por_codigo(codigo: str) -> Optional[dict]:
+    """Producto por código, usando el cache antes de consultar MongoDB"""
+    producto = cache_catalogo.obtener(codigo)
+    if producto is None:
+        collection = await get_productos_collection()
+        producto = await collection.find_one({"codigo": codigo})
+        if producto:
+            cache_catalogo.guardar(producto)
+    return producto
+
+async def obtener_productos(claves: Iterable[str]) -> Dict[str, dict]:
+    """{clave: producto} por _id o código; los faltantes en cache se piden en una sola consulta"""
+    encontrados = {}
+    faltantes = []
+    for clave in set(claves):
+        producto = cache_catalogo.obtener(clave)
+        if producto is None:
+            faltantes.append(clave)
+        else:
+            encontrados[clave] = producto
+    
+    if faltantes:
+        for clave, producto in (await resolver_productos(faltantes)).items():
+            cache_catalogo.guardar(producto)
+            encontrados[clave] = producto
+    return encontrados
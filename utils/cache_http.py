@@ -0,0 +1,80 @@
+"""
+Cache HTTP con ETag / If-None-Match y Cache-Control para lecturas que el
+dashboard consulta en bucle.
+
+El ETag se calcula antes de leer los documentos, a partir de una marca
+barata de la colección: un contador de versión para productos (se incrementa
+en cada escritura) y la última actualización más el conteo para el
+inventario de una sucursal. Si coincide con If-None-Match se responde 304
+sin consultar ni serializar la página.
+"""
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import Request, Response
+from pymongo import DESCENDING, ReturnDocument
+
+from database import get_versiones_collection, get_inventario_collection
+
+# Cache-Control por defecto de cada ruta; se sobreescribe con CACHE_CONTROL_<RUTA>
+CACHE_CONTROL = {
+    "productos": "private, max-age=30, must-revalidate",
+    "productos_categoria": "private, max-age=30, must-revalidate",
+    "inventario_sucursal": "private, no-cache",
+}
+
+def cache_control(ruta: str) -> str:
+    return os.getenv(f"CACHE_CONTROL_{ruta.upper()}", CACHE_CONTROL.get(ruta, "no-cache"))
+
+async def version_coleccion(nombre: str) -> int:
+    collection = await get_versiones_collection()
+    documento = await collection.find_one({"_id": nombre})
+    return documento["version"] if documento else 0
+
+async def incrementar_version(nombre: str, session=None) -> int:
+    """Registrar una escritura en la colección; invalida los ETag emitidos"""
+    collection = await get_versiones_collection()
+    documento = await collection.find_one_and_update(
+        {"_id": nombre},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    return documento["version"]
+
+async def marca_inventario_sucursal(sucursal_id: str) -> str:
+    """Última actualización y cantidad de registros, cubiertas por el índice sucursal_actualizacion"""
+    collection = await get_inventario_collection()
+    ultimo = await collection.find_one(
+        {"sucursal_id": sucursal_id},
+        {"_id": 0, "ultima_actualizacion": 1},
+        sort=[("ultima_actualizacion", DESCENDING)]
+    )
+    total = await collection.count_documents({"sucursal_id": sucursal_id})
+    fecha = ultimo.get("ultima_actualizacion") if ultimo else None
+    return f"{fecha.isoformat() if fecha else '-'}:{total}"
+
+def calcular_etag(request: Request, marca) -> str:
+    """ETag fuerte: la marca de la colección más la ruta y los parámetros de la consulta"""
+    parametros = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    digest = hashlib.sha1(f"{marca}|{request.url.path}?{parametros}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+def no_modificado(request: Request, etag: str, ruta: str) -> Optional[Response]:
+    """Respuesta 304 si el cliente ya tiene esta versión, None si hay que responder completo"""
+    encabezado = request.headers.get("if-none-match")
+    if not encabezado:
+        return None
+    candidatos = {valor.strip().removeprefix("W/") for valor in encabezado.split(",")}
+    if "*" in candidatos or etag in candidatos:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control(ruta)})
+    return None
+
+def con_cache(resultado, response: Response, etag: str, ruta: str):
+    """Agregar ETag y Cache-Control a la respuesta del endpoint"""
+    destino = resultado if isinstance(resultado, Response) else response
+    destino.headers["ETag"] = etag
+    destino.headers["Cache-Control"] = cache_control(ruta)
+    return resultado
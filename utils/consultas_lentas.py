@@ -0,0 +1,211 @@
+"""
+Registro de consultas lentas a MongoDB.
+
+Un CommandListener registrado en el AsyncIOMotorClient guarda los comandos
+que superan UMBRAL_CONSULTA_LENTA_MS con su colección, la forma del filtro
+(los valores literales se reemplazan por su tipo, así ni el log ni
+/debug/slow-queries exponen emails o ids), duración y la ruta HTTP que los originó (un contextvar que fija el middleware de
+main.py; Motor copia el contexto al hilo donde corre pymongo).
+
+Para las lecturas se puede pedir en segundo plano un
+explain("executionStats") que marca los COLLSCAN. Los registros se escriben
+en un log rotativo y los más recientes se consultan en /debug/slow-queries.
+"""
+import asyncio
+import json
+import logging
+import threading
+import os
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+from pymongo import monitoring
+
+UMBRAL_CONSULTA_LENTA_MS = float(os.getenv("UMBRAL_CONSULTA_LENTA_MS", "100"))
+EXPLAIN_CONSULTAS_LENTAS = os.getenv("EXPLAIN_CONSULTAS_LENTAS", "true").lower() == "true"
+CONSULTAS_LENTAS_LOG = os.getenv("CONSULTAS_LENTAS_LOG", "logs/consultas_lentas.log")
+MAX_REGISTROS_MEMORIA = 200
+# Formas de consulta ya explicadas que se recuerdan (LRU)
+MAX_FORMAS_EXPLICADAS = 1000
+
+ruta_actual: ContextVar[Optional[str]] = ContextVar("ruta_actual", default=None)
+
+# Comandos de lectura que se pueden explicar sin efectos
+COMANDOS_EXPLICABLES = {"find", "aggregate", "count", "distinct"}
+# Campos de sesión y transporte que explain no acepta
+CAMPOS_SESION = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern"}
+
+def _crear_logger() -> logging.Logger:
+    logger = logging.getLogger("consultas_lentas")
+    if not logger.handlers:
+        directorio = os.path.dirname(CONSULTAS_LENTAS_LOG)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        handler = RotatingFileHandler(CONSULTAS_LENTAS_LOG, maxBytes=5 * 1024 * 1024, backupCount=5, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+def filtro_comando(nombre: str, comando: dict):
+    """Parte del comando que describe qué documentos se buscan"""
+    if nombre == "find":
+        return comando.get("filter", {})
+    if nombre == "aggregate":
+        return comando.get("pipeline", [])
+    if nombre in ("count", "distinct"):
+        return comando.get("query", {})
+    if nombre == "update":
+        return [u.get("q") for u in comando.get("updates", [])][:10]
+    if nombre == "delete":
+        return [d.get("q") for d in comando.get("deletes", [])][:10]
+    if nombre == "findAndModify":
+        return comando.get("query", {})
+    return None
+
+def forma_consulta(valor):
+    """Campos y operadores de un filtro o pipeline; cada valor literal queda como <tipo>"""
+    if isinstance(valor, dict):
+        return {clave: forma_consulta(item) for clave, item in sorted(valor.items())}
+    if isinstance(valor, list):
+        # $in con 3 o con 300 valores es la misma forma; $and/$or conservan sus ramas
+        formas = []
+        for item in valor:
+            forma = forma_consulta(item)
+            if forma not in formas:
+                formas.append(forma)
+        return formas
+    if valor is None or isinstance(valor, str) and valor.startswith("$"):
+        # Referencia a un campo en una expresión de agregación (o comando sin filtro)
+        return valor
+    return f"<{type(valor).__name__}>"
+
+def etapas_plan(plan: dict):
+    """Todas las etapas de un plan de ejecución, recorriendo sus hijos"""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for clave in ("inputStage", "queryPlan"):
+        yield from etapas_plan(plan.get(clave))
+    for hijo in plan.get("inputStages", []):
+        yield from etapas_plan(hijo)
+
+def resumen_explain(explain: dict) -> dict:
+    """Etapas del plan ganador y estadísticas de ejecución"""
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        # aggregate: el plan de la consulta inicial viene en la primera etapa $cursor
+        for etapa in explain.get("stages", []):
+            if "$cursor" in etapa:
+                explain = etapa["$cursor"]
+                planner = explain.get("queryPlanner")
+                break
+    etapas = list(etapas_plan((planner or {}).get("winningPlan", {})))
+    estadisticas = explain.get("executionStats", {})
+    return {
+        "etapas": etapas,
+        "collscan": "COLLSCAN" in etapas,
+        "docs_examinados": estadisticas.get("totalDocsExamined"),
+        "keys_examinadas": estadisticas.get("totalKeysExamined"),
+        "documentos_devueltos": estadisticas.get("nReturned"),
+        "tiempo_ms": estadisticas.get("executionTimeMillis")
+    }
+
+class ListenerConsultasLentas(monitoring.CommandListener):
+    def __init__(self):
+        self.registros = deque(maxlen=MAX_REGISTROS_MEMORIA)
+        # (connection_id, request_id) -> (comando, ruta)
+        self._en_curso = {}
+        self._logger = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._database = None
+        # Formas de consulta ya explicadas, para no repetir el explain en cada ejecución
+        self._explicadas: OrderedDict = OrderedDict()
+        self._lock_explicadas = threading.Lock()
+
+    def configurar(self, database, loop: asyncio.AbstractEventLoop):
+        """Habilitar el explain en segundo plano sobre la base de la API"""
+        self._database = database
+        self._loop = loop
+
+    def started(self, event):
+        if event.command_name == "explain":
+            return
+        self._en_curso[(event.connection_id, event.request_id)] = (event.command, ruta_actual.get())
+
+    def succeeded(self, event):
+        self._terminar(event, "ok")
+
+    def failed(self, event):
+        self._terminar(event, "error")
+
+    def _terminar(self, event, resultado: str):
+        inicio = self._en_curso.pop((event.connection_id, event.request_id), None)
+        duracion_ms = event.duration_micros / 1000
+        if inicio is None or duracion_ms < UMBRAL_CONSULTA_LENTA_MS:
+            return
+        comando, ruta = inicio
+        nombre = event.command_name
+        valor = comando.get(nombre)
+        registro = {
+            "fecha": datetime.utcnow().isoformat(),
+            "coleccion": comando.get("collection") if nombre == "getMore" else (valor if isinstance(valor, str) else None),
+            "comando": nombre,
+            "base": event.database_name,
+            "duracion_ms": round(duracion_ms, 2),
+            "resultado": resultado,
+            "ruta": ruta,
+            "filtro": forma_consulta(filtro_comando(nombre, comando)),
+            "explain": None
+        }
+        self.registros.append(registro)
+        self._escribir(registro)
+
+        explicable = (
+            EXPLAIN_CONSULTAS_LENTAS and nombre in COMANDOS_EXPLICABLES
+            and self._loop is not None and event.database_name == self._database.name
+        )
+        if explicable:
+            forma = (registro["coleccion"], nombre, json.dumps(registro["filtro"], sort_keys=True))
+            pipeline = comando.get("pipeline", []) if nombre == "aggregate" else []
+            escribe = any("$merge" in etapa or "$out" in etapa for etapa in pipeline if isinstance(etapa, dict))
+            # Los listeners corren en los hilos de Motor
+            with self._lock_explicadas:
+                nueva = forma not in self._explicadas
+                if not nueva:
+                    self._explicadas.move_to_end(forma)
+                elif not escribe:
+                    self._explicadas[forma] = True
+                    if len(self._explicadas) > MAX_FORMAS_EXPLICADAS:
+                        self._explicadas.popitem(last=False)
+            if nueva and not escribe:
+                asyncio.run_coroutine_threadsafe(self._explicar(comando, registro), self._loop)
+
+    async def _explicar(self, comando: dict, registro: dict):
+        limpio = {k: v for k, v in comando.items() if not k.startswith("$") and k not in CAMPOS_SESION}
+        try:
+            explain = await self._database.command({"explain": limpio, "verbosity": "executionStats"})
+            registro["explain"] = resumen_explain(explain)
+        except Exception as e:
+            registro["explain"] = {"error": str(e)}
+        self._escribir({"explain_de": registro["fecha"], "coleccion": registro["coleccion"], **registro["explain"]})
+        if registro["explain"].get("collscan"):
+            print(f"⚠️ COLLSCAN en {registro['coleccion']} ({registro['duracion_ms']} ms) desde {registro['ruta']}")
+
+    def _escribir(self, datos: dict):
+        if self._logger is None:
+            self._logger = _crear_logger()
+        self._logger.info(json.dumps(datos, default=str, ensure_ascii=False)[:5000])
+
+    def recientes(self, limite: int = 50, solo_collscan: bool = False):
+        registros = list(self.registros)[::-1]
+        if solo_collscan:
+            registros = [r for r in registros if (r["explain"] or {}).get("collscan")]
+        return registros[:limite]
+
+listener_consultas_lentas = ListenerConsultasLentas()
@@ -0,0 +1,103 @@
+"""
+Puntos del programa de fidelidad.
+
+Los puntos se suman y el nivel se recalcula en el servidor con un update de
+pipeline, así dos ventas del mismo cliente que se finalizan a la vez no se
+pisan (no hay lectura previa en Python) y cada cliente cuesta una sola
+operación, ya sea con find_one_and_update o dentro de un bulk_write.
+
+Las ventas con cliente suman un punto por cada PESOS_POR_PUNTO del total y
+se agregan a su historial; esa operación es idempotente por transaccion_id,
+así que la cola post-venta puede reintentarla sin duplicar puntos.
+"""
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from database import get_clientes_collection
+
+# Puntos mínimos de cada nivel, de mayor a menor
+NIVELES = (("Platino", 5000), ("Oro", 3000), ("Plata", 1000))
+NIVEL_INICIAL = "Bronce"
+PESOS_POR_PUNTO = float(os.getenv("PESOS_POR_PUNTO", "1000"))
+# Transacciones que se conservan en el historial embebido del cliente
+HISTORIAL_MAXIMO = int(os.getenv("HISTORIAL_MAXIMO", "100"))
+
+def pipeline_puntos(puntos: int) -> List[dict]:
+    """Update de pipeline que suma los puntos y recalcula el nivel con el total nuevo"""
+    programa = {"$ifNull": ["$programa_fidelidad", {}]}
+    return [
+        {"$set": {"programa_fidelidad": {"$mergeObjects": [
+            programa,
+            {"puntos": {"$add": [{"$ifNull": ["$programa_fidelidad.puntos", 0]}, puntos]}}
+        ]}}},
+        {"$set": {"programa_fidelidad": {"$mergeObjects": [
+            "$programa_fidelidad",
+            {"nivel": {"$switch": {
+                "branches": [
+                    {"case": {"$gte": ["$programa_fidelidad.puntos", minimo]}, "then": nivel}
+                    for nivel, minimo in NIVELES
+                ],
+                "default": NIVEL_INICIAL
+            }}}
+        ]}}}
+    ]
+
+def puntos_por_venta(total: float) -> int:
+    return int(total // PESOS_POR_PUNTO) if total > 0 else 0
+
+def operacion_venta_cliente(cliente_id: str, transaccion_id: str, total: float, fecha: datetime) -> UpdateOne:
+    """Sumar los puntos de una venta y agregarla al historial, solo si aún no está registrada"""
+    historial = {"$ifNull": ["$historial", []]}
+    return UpdateOne(
+        {"_id": cliente_id, "historial.transaccion_id": {"$ne": transaccion_id}},
+        pipeline_puntos(puntos_por_venta(total)) + [
+            {"$set": {"historial": {"$slice": [
+                {"$concatArrays": [historial, [{"transaccion_id": transaccion_id, "fecha": fecha.strftime("%Y-%m-%d")}]]},
+                -HISTORIAL_MAXIMO
+            ]}}}
+        ]
+    )
+
+async def acumular_puntos(cliente_id: str, puntos: int, session=None):
+    """Sumar puntos a un cliente y devolver el documento actualizado (None si no existe)"""
+    collection = await get_clientes_collection()
+    return await collection.find_one_and_update(
+        {"_id": cliente_id},
+        pipeline_puntos(puntos),
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+def agrupar_puntos(acumulaciones: Iterable[Tuple[str, int]]) -> Dict[str, int]:
+    """Un cliente con varias ventas en el lote recibe una sola operación"""
+    por_cliente = {}
+    for cliente_id, puntos in acumulaciones:
+        por_cliente[cliente_id] = por_cliente.get(cliente_id, 0) + puntos
+    return por_cliente
+
+async def acumular_puntos_lote(acumulaciones: Iterable[Tuple[str, int]], session=None) -> dict:
+    """Aplicar los puntos (cliente_id, puntos) de muchas ventas en un solo bulk_write"""
+    por_cliente = agrupar_puntos(acumulaciones)
+    if not por_cliente:
+        return {"clientes": 0, "actualizados": 0, "no_encontrados": []}
+
+    collection = await get_clientes_collection()
+    resultado = await collection.bulk_write(
+        [UpdateOne({"_id": cliente_id}, pipeline_puntos(puntos)) for cliente_id, puntos in por_cliente.items()],
+        ordered=False,
+        session=session
+    )
+    no_encontrados = []
+    if resultado.matched_count < len(por_cliente):
+        existentes = {
+            c["_id"] async for c in collection.find({"_id": {"$in": list(por_cliente)}}, {"_id": 1}, session=session)
+        }
+        no_encontrados = [cliente_id for cliente_id in por_cliente if cliente_id not in existentes]
+    return {
+        "clientes": len(por_cliente),
+        "actualizados": resultado.matched_count,
+        "no_encontrados": no_encontrados
+    }
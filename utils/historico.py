@@ -0,0 +1,93 @@
+"""
+Stock histórico a partir de snapshots periódicos y el libro de movimientos.
+
+tomar_snapshots copia stock_actual de todo el inventario en el servidor
+($merge), y stock_en_fecha reconstruye el stock en un instante partiendo
+del snapshot más cercano y aplicando solo los movimientos entre ambos
+momentos, así que el costo queda acotado por el intervalo entre snapshots.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import get_inventario_collection, get_snapshots_collection, get_movimientos_collection
+
+SNAPSHOT_INVENTARIO_HORAS = float(os.getenv("SNAPSHOT_INVENTARIO_HORAS", "24"))
+
+async def tomar_snapshots(forzar: bool = False) -> bool:
+    """Guardar un snapshot de todo el inventario si ya pasó el intervalo"""
+    snapshots = await get_snapshots_collection()
+    
+    # Con varios workers solo el primero que llega toma el snapshot del período
+    ultimo = await snapshots.find_one({}, {"fecha": 1}, sort=[("fecha", -1)])
+    intervalo = timedelta(hours=SNAPSHOT_INVENTARIO_HORAS)
+    if not forzar and ultimo and datetime.utcnow() - ultimo["fecha"] < intervalo * 0.9:
+        return False
+    
+    inventario = await get_inventario_collection()
+    await inventario.aggregate([
+        {"$project": {
+            "_id": 0,
+            "producto_id": 1,
+            "sucursal_id": 1,
+            "stock_actual": 1,
+            "fecha": "$$NOW"
+        }},
+        {"$merge": {"into": snapshots.name, "whenNotMatched": "insert"}}
+    ]).to_list(None)
+    print("📸 Snapshot de inventario registrado")
+    return True
+
+async def _suma_movimientos(producto_id: str, sucursal_id: str, desde: datetime, hasta: datetime):
+    """Suma de los movimientos con fecha en (desde, hasta] y cuántos son"""
+    collection = await get_movimientos_collection()
+    resultado = await collection.aggregate([
+        {"$match": {
+            "producto_id": producto_id,
+            "sucursal_id": sucursal_id,
+            "mes": {"$gte": desde.strftime("%Y-%m"), "$lte": hasta.strftime("%Y-%m")},
+            "hasta": {"$gt": desde},
+            "desde": {"$lte": hasta}
+        }},
+        {"$unwind": "$movimientos"},
+        {"$match": {"movimientos.fecha": {"$gt": desde, "$lte": hasta}}},
+        {"$group": {"_id": None, "delta": {"$sum": "$movimientos.cantidad"}, "cantidad": {"$sum": 1}}}
+    ]).to_list(1)
+    if not resultado:
+        return 0, 0
+    return resultado[0]["delta"], resultado[0]["cantidad"]
+
+async def stock_en_fecha(producto_id: str, sucursal_id: str, fecha: datetime) -> Optional[dict]:
+    """Stock de un producto en una sucursal en el instante fecha"""
+    snapshots = await get_snapshots_collection()
+    filtro = {"producto_id": producto_id, "sucursal_id": sucursal_id}
+    
+    # Hacia adelante desde el snapshot anterior más cercano
+    anterior = await snapshots.find_one({**filtro, "fecha": {"$lte": fecha}}, sort=[("fecha", -1)])
+    if anterior:
+        delta, aplicados = await _suma_movimientos(producto_id, sucursal_id, anterior["fecha"], fecha)
+        return {
+            "stock": anterior["stock_actual"] + delta,
+            "fuente": "snapshot",
+            "fecha_referencia": anterior["fecha"],
+            "movimientos_aplicados": aplicados
+        }
+    
+    # Sin snapshot previo: hacia atrás desde el siguiente snapshot o el stock actual
+    siguiente = await snapshots.find_one({**filtro, "fecha": {"$gt": fecha}}, sort=[("fecha", 1)])
+    if siguiente:
+        base, referencia, fuente = siguiente["stock_actual"], siguiente["fecha"], "snapshot"
+    else:
+        inventario = await get_inventario_collection()
+        actual = await inventario.find_one(filtro, {"stock_actual": 1})
+        if actual is None:
+            return None
+        base, referencia, fuente = actual["stock_actual"], datetime.utcnow(), "actual"
+    
+    delta, aplicados = await _suma_movimientos(producto_id, sucursal_id, fecha, referencia)
+    return {
+        "stock": base - delta,
+        "fuente": fuente,
+        "fecha_referencia": referencia,
+        "movimientos_aplicados": aplicados
+    }
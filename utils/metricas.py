@@ -0,0 +1,217 @@
+"""
+Métricas de la API en formato de texto de Prometheus para /metrics.
+
+- Latencia y conteo de peticiones por ruta (middleware en main.py).
+- Duración de los comandos de MongoDB por colección y comando, y espera al
+  obtener una conexión del pool, con listeners de pymongo registrados en el
+  AsyncIOMotorClient de database.py.
+- Hit ratio de los caches en memoria.
+- Profundidad, antigüedad y retraso de la cola de tareas post-venta.
+
+Motor ejecuta pymongo en hilos del executor, así que los listeners corren
+fuera del event loop y los registros se protegen con un lock.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, Tuple
+
+from pymongo import monitoring
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _etiquetas(nombres: Tuple[str, ...], valores: Tuple, extra: str = "") -> str:
+    pares = [f'{nombre}="{str(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        # valores de etiquetas -> [conteos por bucket..., +Inf], suma
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *etiquetas):
+        indice = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def exportar(self) -> Iterable[str]:
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} histogram"
+        with self._lock:
+            series = [(etiquetas, list(conteos), suma) for etiquetas, (conteos, suma) in self._series.items()]
+        for etiquetas, conteos, suma in series:
+            acumulado = 0
+            for limite, conteo in zip((*self.buckets, "+Inf"), conteos):
+                acumulado += conteo
+                etiquetas_bucket = _etiquetas(self.etiquetas, etiquetas, 'le="%s"' % limite)
+                yield f"{self.nombre}_bucket{etiquetas_bucket} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {suma}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {acumulado}"
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (), tipo: str = "counter"):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.tipo = tipo
+        self._valores: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, valor: float = 1, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def fijar(self, valor: float, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = valor
+
+    def exportar(self) -> Iterable[str]:
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} {self.tipo}"
+        with self._lock:
+            valores = list(self._valores.items())
+        for etiquetas, valor in valores:
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {valor}"
+
+latencia_http = Histograma(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP por ruta",
+    ("metodo", "ruta", "estado")
+)
+comandos_mongo = Histograma(
+    "mongodb_command_duration_seconds", "Duración de los comandos de MongoDB",
+    ("coleccion", "comando", "resultado")
+)
+espera_pool = Histograma(
+    "mongodb_pool_checkout_seconds", "Espera para obtener una conexión del pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+checkout_fallidos = Contador(
+    "mongodb_pool_checkout_failed_total", "Conexiones que no se pudieron obtener del pool", ("razon",)
+)
+conexiones = Contador(
+    "mongodb_pool_connections", "Conexiones del pool por estado", ("estado",), tipo="gauge"
+)
+
+tareas_pendientes = Contador(
+    "post_venta_tareas", "Tareas post-venta en el outbox por estado", ("tipo", "estado"), tipo="gauge"
+)
+antiguedad_tareas = Contador(
+    "post_venta_tarea_mas_antigua_seconds", "Antigüedad de la tarea pendiente más antigua", ("tipo",), tipo="gauge"
+)
+tareas_procesadas = Contador(
+    "post_venta_tareas_procesadas_total", "Tareas post-venta procesadas", ("tipo", "resultado")
+)
+retraso_tareas = Histograma(
+    "post_venta_retraso_seconds", "Tiempo desde la venta hasta completar la tarea", ("tipo",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+)
+
+def coleccion_comando(nombre: str, comando: dict) -> str:
+    """Colección sobre la que actúa un comando de MongoDB"""
+    if nombre == "getMore":
+        return str(comando.get("collection", ""))
+    valor = comando.get(nombre)
+    return valor if isinstance(valor, str) else ""
+
+class ListenerComandos(monitoring.CommandListener):
+    def __init__(self):
+        # (connection_id, request_id) -> colección del comando en curso
+        self._en_curso: Dict[Tuple, str] = {}
+
+    def started(self, event):
+        self._en_curso[(event.connection_id, event.request_id)] = coleccion_comando(event.command_name, event.command)
+
+    def _terminar(self, event, resultado: str):
+        coleccion = self._en_curso.pop((event.connection_id, event.request_id), "")
+        comandos_mongo.observar(event.duration_micros / 1e6, coleccion, event.command_name, resultado)
+
+    def succeeded(self, event):
+        self._terminar(event, "ok")
+
+    def failed(self, event):
+        self._terminar(event, "error")
+
+class ListenerPool(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        # El checkout se inicia y se completa en el mismo hilo
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        conexiones.sumar(1, "abiertas")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        conexiones.sumar(-1, "abiertas")
+
+    def connection_check_out_started(self, event):
+        self._local.inicio = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._local.inicio = None
+        checkout_fallidos.sumar(1, str(event.reason))
+
+    def connection_checked_out(self, event):
+        inicio = getattr(self._local, "inicio", None)
+        if inicio is not None:
+            espera_pool.observar(time.perf_counter() - inicio)
+            self._local.inicio = None
+        conexiones.sumar(1, "en_uso")
+
+    def connection_checked_in(self, event):
+        conexiones.sumar(-1, "en_uso")
+
+listener_comandos = ListenerComandos()
+listener_pool = ListenerPool()
+
+def _metricas_caches() -> Iterable[str]:
+    # Importes locales: los caches dependen de database, que registra estos listeners
+    from utils.cache_catalogo import cache_catalogo
+    from utils.prediccion import cache_predicciones
+
+    caches = {
+        "catalogo": (cache_catalogo.hits, cache_catalogo.misses),
+        "predicciones": (cache_predicciones.hits, cache_predicciones.misses),
+    }
+    for nombre, tipo, indice in (("cache_hits_total", "counter", 0), ("cache_misses_total", "counter", 1)):
+        yield f"# TYPE {nombre} {tipo}"
+        for cache, valores in caches.items():
+            yield f'{nombre}{{cache="{cache}"}} {valores[indice]}'
+    yield "# TYPE cache_hit_ratio gauge"
+    for cache, (hits, misses) in caches.items():
+        yield f'cache_hit_ratio{{cache="{cache}"}} {hits / (hits + misses) if hits + misses else 0.0}'
+
+def exportar_metricas() -> str:
+    """Todas las métricas en formato de texto de Prometheus"""
+    lineas = []
+    for metrica in (
+        latencia_http, comandos_mongo, espera_pool, checkout_fallidos, conexiones,
+        tareas_pendientes, antiguedad_tareas, tareas_procesadas, retraso_tareas
+    ):
+        lineas.extend(metrica.exportar())
+    lineas.extend(_metricas_caches())
+    return "\n".join(lineas) + "\n"
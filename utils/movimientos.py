@@ -0,0 +1,50 @@
+"""
+Historial de movimientos de inventario en buckets.
+
+Cada bucket agrupa hasta MOVIMIENTOS_POR_BUCKET movimientos de un producto
+en una sucursal durante un mes, así los documentos de inventario mantienen
+un tamaño fijo y el historial crece en documentos acotados. Cuando un
+bucket se llena, el upsert crea el siguiente del mismo mes.
+"""
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import get_movimientos_collection
+
+MOVIMIENTOS_POR_BUCKET = 200
+
+def movimiento(tipo: str, cantidad: int, referencia: Optional[str] = None, **detalle) -> dict:
+    """Crear un movimiento; cantidad es el cambio en stock_actual (con signo)"""
+    registro = {"fecha": datetime.utcnow(), "tipo": tipo, "cantidad": cantidad}
+    if referencia is not None:
+        registro["referencia"] = referencia
+    registro.update({k: v for k, v in detalle.items() if v is not None})
+    return registro
+
+def operacion_movimiento(producto_id: str, sucursal_id: str, registro: dict) -> UpdateOne:
+    fecha = registro["fecha"]
+    return UpdateOne(
+        {
+            "producto_id": producto_id,
+            "sucursal_id": sucursal_id,
+            "mes": fecha.strftime("%Y-%m"),
+            "cantidad": {"$lt": MOVIMIENTOS_POR_BUCKET}
+        },
+        {
+            "$push": {"movimientos": registro},
+            "$inc": {"cantidad": 1},
+            "$min": {"desde": fecha},
+            "$max": {"hasta": fecha}
+        },
+        upsert=True
+    )
+
+async def registrar_movimientos(movimientos: Iterable[Tuple[str, str, dict]], session=None):
+    """Registrar movimientos (producto_id, sucursal_id, movimiento) en un solo bulk_write"""
+    operaciones = [operacion_movimiento(*m) for m in movimientos]
+    if not operaciones:
+        return
+    collection = await get_movimientos_collection()
+    await collection.bulk_write(operaciones, ordered=True, session=session)
@@ -0,0 +1,56 @@
+"""
+Paginación por cursor (keyset) sobre _id.
+
+El cursor es opaco para el cliente: codifica el último _id devuelto y su
+tipo, ya que conviven _id de tipo string (productos y clientes creados por
+la API) y ObjectId (datos cargados por los scripts).
+"""
+import base64
+import json
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 500
+
+def codificar_cursor(ultimo_id) -> str:
+    """Generar el token opaco a partir del último _id de la página"""
+    if isinstance(ultimo_id, ObjectId):
+        valor = {"t": "oid", "v": str(ultimo_id)}
+    else:
+        valor = {"t": "str", "v": str(ultimo_id)}
+    return base64.urlsafe_b64encode(json.dumps(valor).encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> dict:
+    """Convertir el token en el filtro de búsqueda por rango sobre _id"""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valor = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        tipo, ultimo_id = valor["t"], valor["v"]
+        if tipo == "oid":
+            return {"_id": {"$gt": ObjectId(ultimo_id)}}
+        if tipo == "str":
+            # MongoDB ordena los string antes que los ObjectId y $gt solo
+            # compara valores del mismo tipo, así que al agotar los string
+            # la página continúa con los ObjectId
+            return {"$or": [{"_id": {"$gt": ultimo_id}}, {"_id": {"$type": "objectId"}}]}
+    except Exception:
+        pass
+    raise HTTPException(status_code=400, detail="Cursor inválido")
+
+async def paginar(collection, filtro: dict, cursor: Optional[str], limit: int, proyeccion: Optional[dict] = None):
+    """Obtener una página ordenada por _id y el cursor de la siguiente"""
+    if cursor:
+        condicion = decodificar_cursor(cursor)
+        filtro = {"$and": [filtro, condicion]} if filtro else condicion
+    
+    documentos = await collection.find(filtro, proyeccion).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(documentos) > limit:
+        documentos = documentos[:limit]
+        next_cursor = codificar_cursor(documentos[-1]["_id"])
+    
+    return documentos, next_cursor
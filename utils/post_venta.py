@@ -0,0 +1,313 @@
+"""
+Tareas post-venta fuera del camino de la respuesta.
+
+finalizar-venta y checkout solo dejan durables la venta y el stock; en la
+misma transacción insertan en el outbox tareas_post_venta el trabajo que
+puede esperar: resumen de ventas para analytics, puntos e historial del
+cliente y revisión de stock bajo. Si la transacción se aborta, las tareas
+tampoco existen; si el proceso se reinicia, siguen en el outbox.
+
+ColaPostVenta corre dentro del lifespan de main.py: toma lotes de tareas
+del mismo tipo (un bulk_write por lote en vez de uno por venta), los
+procesa con concurrencia acotada y reintenta con espera exponencial. Si
+un lote falla se parte en mitades hasta aislar las tareas que fallan, y
+solo esas gastan intentos y pueden terminar como fallidas. Una
+tarea tomada queda bloqueada POST_VENTA_BLOQUEO_SEGUNDOS; si el worker
+muere, otro la retoma al vencer el bloqueo. Las escrituras de un lote y el
+borrado de sus tareas van en una sola transacción, filtrando el borrado por
+el dueño del bloqueo: si el lote falla o el bloqueo venció y otro worker
+tomó las tareas, nada se aplica y el $inc del resumen no se cuenta dos veces.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import ConnectionFailure
+
+from database import (
+    ejecutar_en_transaccion, get_tareas_collection, get_inventario_collection, get_clientes_collection, get_alertas_stock_collection
+)
+from utils.fidelidad import operacion_venta_cliente
+from utils.metricas import tareas_pendientes, antiguedad_tareas, tareas_procesadas, retraso_tareas
+from utils.resumen_ventas import registrar_ventas, valor_base
+
+POST_VENTA_CONCURRENCIA = int(os.getenv("POST_VENTA_CONCURRENCIA", "4"))
+POST_VENTA_LOTE = int(os.getenv("POST_VENTA_LOTE", "200"))
+POST_VENTA_MAX_INTENTOS = int(os.getenv("POST_VENTA_MAX_INTENTOS", "8"))
+POST_VENTA_SONDEO_SEGUNDOS = float(os.getenv("POST_VENTA_SONDEO_SEGUNDOS", "2"))
+POST_VENTA_BLOQUEO_SEGUNDOS = int(os.getenv("POST_VENTA_BLOQUEO_SEGUNDOS", "120"))
+# Cada cuánto se recalculan profundidad y antigüedad de la cola para /metrics
+POST_VENTA_METRICAS_SEGUNDOS = 15
+
+PENDIENTE = "pendiente"
+EN_PROCESO = "en_proceso"
+FALLIDA = "fallida"
+
+class BloqueoPerdido(Exception):
+    """Otro worker retomó tareas del lote tras vencer el bloqueo"""
+
+def tarea(tipo: str, datos: dict, fecha: datetime) -> dict:
+    return {
+        "tipo": tipo,
+        "datos": datos,
+        "estado": PENDIENTE,
+        "intentos": 0,
+        "creada": fecha,
+        "disponible_desde": fecha
+    }
+
+def tareas_venta(transaccion: dict, fecha: datetime, lineas: Dict[str, dict]) -> List[dict]:
+    """Tareas de una venta finalizada; lineas es el resultado de lineas_inventario"""
+    venta = {
+        "transaccion_id": transaccion["transaccion_id"],
+        "sucursal_id": transaccion["sucursal_id"],
+        "total": valor_base(transaccion.get("total", 0)),
+        "productos": [
+            {"producto_id": p["producto_id"], "cantidad": p["cantidad"], "subtotal": valor_base(p.get("subtotal", 0))}
+            for p in transaccion.get("productos", [])
+        ]
+    }
+    tareas = [tarea("resumen_ventas", {**venta, "fecha": fecha}, fecha)]
+    if transaccion.get("cliente_id"):
+        tareas.append(tarea("fidelidad", {
+            "cliente_id": transaccion["cliente_id"],
+            "transaccion_id": venta["transaccion_id"],
+            "total": venta["total"],
+            "fecha": fecha
+        }, fecha))
+    producto_ids = [producto_id for producto_id in lineas if not producto_id.startswith("codigo:")]
+    if producto_ids:
+        tareas.append(tarea("stock_bajo", {"sucursal_id": venta["sucursal_id"], "producto_ids": producto_ids}, fecha))
+    return tareas
+
+async def encolar(tareas: List[dict], session=None):
+    """Guardar tareas en el outbox; con session quedan en la misma transacción que la venta"""
+    if not tareas:
+        return
+    collection = await get_tareas_collection()
+    await collection.insert_many(tareas, ordered=False, session=session)
+
+# ============================================================================
+# MANEJADORES: reciben los datos de un lote de tareas del mismo tipo y la
+# sesión de la transacción que borra esas tareas
+# ============================================================================
+
+async def procesar_resumen_ventas(lote: List[dict], session):
+    await registrar_ventas(((venta, venta["fecha"]) for venta in lote), session=session)
+
+async def procesar_fidelidad(lote: List[dict], session):
+    collection = await get_clientes_collection()
+    await collection.bulk_write(
+        [operacion_venta_cliente(d["cliente_id"], d["transaccion_id"], d["total"], d["fecha"]) for d in lote],
+        ordered=False,
+        session=session
+    )
+
+async def procesar_stock_bajo(lote: List[dict], session):
+    """Crear o cerrar alertas según el stock disponible de las líneas vendidas"""
+    por_sucursal: Dict[str, set] = {}
+    for datos in lote:
+        por_sucursal.setdefault(datos["sucursal_id"], set()).update(datos["producto_ids"])
+
+    inventario_collection = await get_inventario_collection()
+    registros = inventario_collection.find(
+        {"$or": [
+            {"sucursal_id": sucursal_id, "producto_id": {"$in": list(producto_ids)}}
+            for sucursal_id, producto_ids in por_sucursal.items()
+        ]},
+        {"_id": 0, "producto_id": 1, "sucursal_id": 1, "stock_actual": 1, "stock_reservado": 1, "stock_minimo": 1},
+        session=session
+    )
+    ahora = datetime.utcnow()
+    operaciones = []
+    async for item in registros:
+        clave = {"producto_id": item["producto_id"], "sucursal_id": item["sucursal_id"]}
+        disponible = item["stock_actual"] - item.get("stock_reservado", 0)
+        if disponible <= item.get("stock_minimo", 0):
+            operaciones.append(UpdateOne(
+                clave,
+                {
+                    "$set": {"stock_disponible": disponible, "stock_minimo": item.get("stock_minimo", 0), "fecha": ahora},
+                    "$setOnInsert": {"desde": ahora}
+                },
+                upsert=True
+            ))
+        else:
+            operaciones.append(DeleteOne(clave))
+    if operaciones:
+        alertas_collection = await get_alertas_stock_collection()
+        await alertas_collection.bulk_write(operaciones, ordered=False, session=session)
+
+Manejador = Callable[[List[dict], object], Awaitable[None]]
+
+MANEJADORES: Dict[str, Manejador] = {
+    "resumen_ventas": procesar_resumen_ventas,
+    "fidelidad": procesar_fidelidad,
+    "stock_bajo": procesar_stock_bajo,
+}
+
+# ============================================================================
+# COLA
+# ============================================================================
+
+def espera_reintento(intentos: int) -> timedelta:
+    return timedelta(seconds=min(600, 2 ** intentos))
+
+class ColaPostVenta:
+    def __init__(self, manejadores: Dict[str, Manejador]):
+        self.manejadores = manejadores
+        self._aviso = asyncio.Event()
+        self._semaforo = asyncio.Semaphore(POST_VENTA_CONCURRENCIA)
+        self._ultimas_metricas = 0.0
+
+    def notificar(self):
+        """Despertar al worker tras confirmar una venta, sin esperar al siguiente sondeo"""
+        self._aviso.set()
+
+    def iniciar(self) -> asyncio.Task:
+        return asyncio.create_task(self._ejecutar(), name="post_venta")
+
+    async def _ejecutar(self):
+        print(f"📬 Cola post-venta iniciada (concurrencia {POST_VENTA_CONCURRENCIA}, lotes de {POST_VENTA_LOTE})")
+        while True:
+            try:
+                procesadas = await self.procesar_disponibles()
+                await self._actualizar_metricas()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Base no disponible u otro fallo de la cola: se reintenta en el siguiente sondeo
+                print(f"❌ Error en la cola post-venta: {e}")
+                procesadas = 0
+            if procesadas < POST_VENTA_LOTE:
+                try:
+                    await asyncio.wait_for(self._aviso.wait(), POST_VENTA_SONDEO_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    pass
+                self._aviso.clear()
+
+    async def procesar_disponibles(self) -> int:
+        """Tomar un lote de cada tipo y procesarlos en paralelo; devuelve el lote más grande"""
+        lotes = [(tipo, await self._tomar_lote(tipo)) for tipo in self.manejadores]
+        lotes = [(tipo, tareas) for tipo, tareas in lotes if tareas]
+        await asyncio.gather(*(self._procesar_lote(tipo, tareas) for tipo, tareas in lotes))
+        return max((len(tareas) for _, tareas in lotes), default=0)
+
+    async def _tomar_lote(self, tipo: str) -> List[dict]:
+        """Bloquear hasta POST_VENTA_LOTE tareas disponibles; otro worker no toma las mismas"""
+        collection = await get_tareas_collection()
+        ahora = datetime.utcnow()
+        disponibles = [
+            {"tipo": tipo, "estado": PENDIENTE, "disponible_desde": {"$lte": ahora}},
+            # Tomadas por un worker que no terminó antes de vencer el bloqueo
+            {"tipo": tipo, "estado": EN_PROCESO, "disponible_desde": {"$lte": ahora}}
+        ]
+        ids = [
+            t["_id"] async for t in collection.find({"$or": disponibles}, {"_id": 1})
+            .sort("disponible_desde", 1).limit(POST_VENTA_LOTE)
+        ]
+        if not ids:
+            return []
+
+        dueno = uuid.uuid4().hex
+        await collection.update_many(
+            {"_id": {"$in": ids}, "$or": disponibles},
+            {"$set": {
+                "estado": EN_PROCESO,
+                "dueno": dueno,
+                "disponible_desde": ahora + timedelta(seconds=POST_VENTA_BLOQUEO_SEGUNDOS)
+            }}
+        )
+        return await collection.find({"_id": {"$in": ids}, "dueno": dueno}).to_list(None)
+
+    async def _procesar_lote(self, tipo: str, tareas: List[dict]):
+        async with self._semaforo:
+            await self._aplicar(tipo, tareas)
+
+    async def _aplicar(self, tipo: str, tareas: List[dict]):
+        """Aplicar un lote en una transacción; si falla, partirlo para aislar las tareas culpables"""
+        collection = await get_tareas_collection()
+        ids = [t["_id"] for t in tareas]
+        dueno = tareas[0]["dueno"]
+
+        async def procesar(session):
+            await self.manejadores[tipo]([t["datos"] for t in tareas], session)
+            borradas = await collection.delete_many({"_id": {"$in": ids}, "dueno": dueno}, session=session)
+            if borradas.deleted_count != len(ids):
+                raise BloqueoPerdido(f"{len(ids) - borradas.deleted_count} tareas {tipo} ya no son de este worker")
+
+        try:
+            await ejecutar_en_transaccion(procesar)
+        except BloqueoPerdido as e:
+            # El worker que las retomó las procesa; aquí no se aplicó nada
+            print(f"⚠️ Lote descartado: {e}")
+            return
+        except ConnectionFailure as e:
+            # Base no disponible: ninguna tarea tiene la culpa, se reintenta el lote entero
+            await self._reintentar(tipo, tareas, e)
+            return
+        except Exception as e:
+            if len(tareas) == 1:
+                await self._reintentar(tipo, tareas, e)
+                return
+            # Una tarea inválida no debe gastar los intentos de las demás:
+            # cada mitad se aplica por separado hasta quedar con las que fallan solas
+            mitad = len(tareas) // 2
+            await self._aplicar(tipo, tareas[:mitad])
+            await self._aplicar(tipo, tareas[mitad:])
+            return
+
+        ahora = datetime.utcnow()
+        for t in tareas:
+            retraso_tareas.observar((ahora - t["creada"]).total_seconds(), tipo)
+        tareas_procesadas.sumar(len(tareas), tipo, "ok")
+
+    async def _reintentar(self, tipo: str, tareas: List[dict], error: Exception):
+        collection = await get_tareas_collection()
+        ahora = datetime.utcnow()
+        operaciones = []
+        for t in tareas:
+            intentos = t["intentos"] + 1
+            agotada = intentos >= POST_VENTA_MAX_INTENTOS
+            operaciones.append(UpdateOne(
+                {"_id": t["_id"], "dueno": t["dueno"]},
+                {"$set": {
+                    "estado": FALLIDA if agotada else PENDIENTE,
+                    "intentos": intentos,
+                    "disponible_desde": ahora + espera_reintento(intentos),
+                    "error": str(error)[:500]
+                }, "$unset": {"dueno": ""}}
+            ))
+        await collection.bulk_write(operaciones, ordered=False)
+        tareas_procesadas.sumar(len(tareas), tipo, "error")
+        print(f"⚠️ Fallaron {len(tareas)} tareas {tipo}: {error}")
+
+    async def _actualizar_metricas(self):
+        """Profundidad por tipo y estado y antigüedad de la tarea más vieja, para /metrics"""
+        if asyncio.get_running_loop().time() - self._ultimas_metricas < POST_VENTA_METRICAS_SEGUNDOS:
+            return
+        self._ultimas_metricas = asyncio.get_running_loop().time()
+        collection = await get_tareas_collection()
+        ahora = datetime.utcnow()
+        conteos = {(tipo, estado): 0 for tipo in self.manejadores for estado in (PENDIENTE, EN_PROCESO, FALLIDA)}
+        antiguedad = {tipo: 0.0 for tipo in self.manejadores}
+        async for grupo in collection.aggregate([
+            {"$group": {
+                "_id": {"tipo": "$tipo", "estado": "$estado"},
+                "total": {"$sum": 1},
+                "mas_antigua": {"$min": "$creada"}
+            }}
+        ]):
+            tipo, estado = grupo["_id"]["tipo"], grupo["_id"]["estado"]
+            conteos[(tipo, estado)] = grupo["total"]
+            if estado != FALLIDA and tipo in antiguedad:
+                antiguedad[tipo] = max(antiguedad[tipo], (ahora - grupo["mas_antigua"]).total_seconds())
+        for (tipo, estado), total in conteos.items():
+            tareas_pendientes.fijar(total, tipo, estado)
+        for tipo, segundos in antiguedad.items():
+            antiguedad_tareas.fijar(segundos, tipo)
+
+cola_post_venta = ColaPostVenta(MANEJADORES)
@@ -0,0 +1,239 @@
+"""
+Predicción de demanda para todo el catálogo en lote.
+
+Las series diarias de todos los productos salen de una sola agregación sobre
+ventas_resumen y se ajustan juntas con NumPy: suavizado exponencial doble
+(Holt, con tendencia amortiguada) sobre la serie desestacionalizada por día
+de la semana. Los parámetros se eligen por producto en una grilla, con el
+menor error cuadrático de pronóstico a un paso dentro de la muestra. El
+residuo del ajuste da el intervalo y la confianza. Los
+resultados se guardan por producto con TTL y se recalculan todos a la vez
+cuando vencen.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import numpy as np
+
+from database import get_ventas_resumen_collection
+from utils.resumen_ventas import PRODUCTO_TOTAL, clave_fecha
+
+DIAS_HISTORIA = int(os.getenv("PREDICCION_DIAS_HISTORIA", "90"))
+PREDICCION_TTL_SEGUNDOS = float(os.getenv("PREDICCION_TTL_SEGUNDOS", "900"))
+
+# Grilla de parámetros: suavizado del nivel, de la tendencia y amortiguación
+# (con phi < 1 la tendencia se desvanece en horizontes largos)
+ALFAS = (0.1, 0.2, 0.3, 0.5, 0.7)
+BETAS = (0.02, 0.05, 0.1, 0.2, 0.3)
+PHIS = (0.8, 0.9, 0.95, 0.98, 1.0)
+Z_95 = 1.96
+UMBRAL_TENDENCIA = 0.05  # Cambio relativo del nivel en 7 días para dejar de ser "estable"
+
+async def series_demanda(dias: int = DIAS_HISTORIA):
+    """Matriz productos x días de unidades vendidas, desde el resumen de ventas"""
+    collection = await get_ventas_resumen_collection()
+    hoy = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    inicio = hoy - timedelta(days=dias)
+
+    filas = await collection.aggregate([
+        {"$match": {
+            "fecha": {"$gte": clave_fecha(inicio), "$lt": clave_fecha(hoy)},
+            "producto_id": {"$ne": PRODUCTO_TOTAL}
+        }},
+        {"$group": {"_id": {"producto_id": "$producto_id", "fecha": "$fecha"}, "cantidad": {"$sum": "$cantidad"}}}
+    ]).to_list(None)
+
+    productos = sorted({fila["_id"]["producto_id"] for fila in filas})
+    indice_producto = {producto_id: i for i, producto_id in enumerate(productos)}
+    fechas = [inicio + timedelta(days=d) for d in range(dias)]
+    indice_fecha = {clave_fecha(fecha): d for d, fecha in enumerate(fechas)}
+
+    matriz = np.zeros((len(productos), dias))
+    for fila in filas:
+        matriz[indice_producto[fila["_id"]["producto_id"]], indice_fecha[fila["_id"]["fecha"]]] = fila["cantidad"]
+    return productos, fechas, matriz
+
+def ajustar_modelos(matriz: np.ndarray, fechas) -> Dict[str, np.ndarray]:
+    """Ajustar Holt amortiguado con estacionalidad semanal a todas las filas a la vez"""
+    n_productos, n_dias = matriz.shape
+    dia_semana = np.array([fecha.weekday() for fecha in fechas])
+    media = matriz.mean(axis=1, keepdims=True)
+
+    # Índices estacionales por día de la semana (1 = sin efecto), sobre el
+    # cociente con la media móvil centrada de 7 días para que la tendencia no
+    # se confunda con el día de la semana
+    estacional = np.ones((n_productos, 7))
+    if n_dias >= 14:
+        movil = np.apply_along_axis(lambda fila: np.convolve(fila, np.ones(7) / 7, mode="valid"), 1, matriz)
+        cociente = np.divide(matriz[:, 3:n_dias - 3], movil, out=np.full_like(movil, np.nan), where=movil > 0)
+        dias_centrales = dia_semana[3:n_dias - 3]
+        for dia in range(7):
+            columnas = cociente[:, dias_centrales == dia]
+            validos = ~np.isnan(columnas)
+            estacional[:, dia] = np.where(
+                validos.any(axis=1), np.nansum(columnas, axis=1) / np.maximum(validos.sum(axis=1), 1), 1.0
+            )
+        # Un día sin ventas conserva índice 0: el producto no se vende ese día
+        promedio = estacional.mean(axis=1, keepdims=True)
+        estacional = np.divide(estacional, promedio, out=np.ones_like(estacional), where=promedio > 0)
+    # Los días con índice 0 no dicen nada del nivel: quedan en NaN y el
+    # suavizado los salta
+    indices = estacional[:, dia_semana]
+    serie = np.divide(matriz, indices, out=np.full(matriz.shape, np.nan), where=indices > 0)
+
+    # La primera semana todavía está calibrando el nivel
+    inicio_error = min(7, n_dias - 1)
+    primera_semana = serie[:, :7]
+    validos = ~np.isnan(primera_semana)
+    nivel_inicial = np.where(validos, primera_semana, 0).sum(axis=1) / np.maximum(validos.sum(axis=1), 1)
+
+    # Error cuadrático de todas las combinaciones de la grilla a la vez
+    # (matrices combinaciones x productos) y la mejor de cada producto
+    grilla = np.array([(a, b, p) for a in ALFAS for b in BETAS for p in PHIS])
+    sse = _suavizar(serie, nivel_inicial, *(grilla[:, k, None] for k in range(3)), inicio_error)["sse"]
+    alfa, beta, phi = grilla[sse.argmin(axis=0)].T
+
+    ajuste = _suavizar(serie, nivel_inicial, alfa, beta, phi, inicio_error, historial=True)
+    return {
+        "nivel": ajuste["nivel"],
+        "tendencia": ajuste["tendencia"],
+        "phi": phi,
+        "estacional": estacional,
+        "sigma": _desviacion(ajuste["errores"][:, inicio_error:]),
+        "media": media[:, 0],
+        "dias_con_ventas": (matriz > 0).sum(axis=1)
+    }
+
+def _desviacion(errores: np.ndarray) -> np.ndarray:
+    """Desviación por fila ignorando los días sin observación (NaN)"""
+    validos = ~np.isnan(errores)
+    n = np.maximum(validos.sum(axis=1), 1)
+    media = np.where(validos, errores, 0).sum(axis=1) / n
+    return np.sqrt(np.where(validos, (errores - media[:, None]) ** 2, 0).sum(axis=1) / n)
+
+def _suavizar(serie: np.ndarray, nivel_inicial: np.ndarray, alfa, beta, phi, inicio_error: int, historial: bool = False):
+    """Holt amortiguado vectorizado; los parámetros se difunden contra la forma de nivel_inicial.
+
+    En los días sin observación (NaN) el nivel sigue al pronóstico y el
+    error no cuenta.
+    """
+    n_dias = serie.shape[1]
+    nivel = np.broadcast_to(nivel_inicial, np.broadcast(alfa, nivel_inicial).shape).copy()
+    tendencia = np.zeros_like(nivel)
+    sse = np.zeros_like(nivel)
+    errores = np.full(serie.shape, np.nan) if historial else None
+    for t in range(n_dias):
+        pronostico = nivel + phi * tendencia
+        observado = ~np.isnan(serie[:, t])
+        error = np.where(observado, serie[:, t] - pronostico, 0)
+        if t >= inicio_error:
+            sse += error ** 2
+        if historial:
+            errores[:, t] = np.where(observado, error, np.nan)
+        nivel_anterior = nivel
+        nivel = pronostico + alfa * error
+        tendencia = beta * (nivel - nivel_anterior) + (1 - beta) * phi * tendencia
+    return {"nivel": nivel, "tendencia": tendencia, "sse": sse, "errores": errores}
+
+def pronosticar(modelo: Dict[str, np.ndarray], ultimo_dia: datetime, horizonte: int):
+    """Demanda total de los próximos horizonte días y su intervalo del 95%"""
+    pasos = np.arange(1, horizonte + 1)
+    dias_semana = np.array([(ultimo_dia + timedelta(days=int(h))).weekday() for h in pasos])
+    amortiguado = np.cumsum(modelo["phi"][:, None] ** pasos, axis=1)
+    diario = (modelo["nivel"][:, None] + modelo["tendencia"][:, None] * amortiguado) * modelo["estacional"][:, dias_semana]
+    total = np.clip(diario, 0, None).sum(axis=1)
+    margen = Z_95 * modelo["sigma"] * modelo["estacional"].mean(axis=1) * np.sqrt(horizonte)
+    return total, np.clip(total - margen, 0, None), total + margen
+
+def calcular_predicciones(productos, fechas, matriz) -> Dict[str, dict]:
+    """Predicción de 7 y 30 días para cada fila de la matriz"""
+    if not productos:
+        return {}
+    modelo = ajustar_modelos(matriz, fechas)
+    total_7, inferior_7, superior_7 = pronosticar(modelo, fechas[-1], 7)
+    total_30, inferior_30, superior_30 = pronosticar(modelo, fechas[-1], 30)
+
+    # Pendiente actual sin amortiguar: la amortiguación solo aplica al extrapolar
+    nivel = np.maximum(modelo["nivel"], 1e-9)
+    cambio_semanal = 7 * modelo["tendencia"] / nivel
+    variacion = np.divide(modelo["sigma"], modelo["media"], out=np.ones_like(modelo["sigma"]), where=modelo["media"] > 0)
+    cobertura = modelo["dias_con_ventas"] / matriz.shape[1]
+    confianza = np.clip(cobertura / (1 + variacion), 0.0, 0.99)
+
+    predicciones = {}
+    for i, producto_id in enumerate(productos):
+        if cambio_semanal[i] > UMBRAL_TENDENCIA:
+            tendencia = "creciente"
+        elif cambio_semanal[i] < -UMBRAL_TENDENCIA:
+            tendencia = "decreciente"
+        else:
+            tendencia = "estable"
+        predicciones[producto_id] = {
+            "producto_id": producto_id,
+            "demanda_estimada_7_dias": int(round(total_7[i])),
+            "demanda_estimada_30_dias": int(round(total_30[i])),
+            "intervalo_7_dias": {"inferior": int(inferior_7[i]), "superior": int(np.ceil(superior_7[i]))},
+            "intervalo_30_dias": {"inferior": int(inferior_30[i]), "superior": int(np.ceil(superior_30[i]))},
+            "tendencia": tendencia,
+            "confianza": round(float(confianza[i]), 3),
+            "factores": [
+                f"Historial de ventas ({int(modelo['dias_con_ventas'][i])} de {matriz.shape[1]} días con ventas)",
+                "Tendencia (suavizado exponencial doble)",
+                "Estacionalidad semanal"
+            ]
+        }
+    return predicciones
+
+def prediccion_sin_historial(producto_id: str) -> dict:
+    """Predicción vacía para productos sin ventas en la ventana"""
+    return {
+        "producto_id": producto_id,
+        "demanda_estimada_7_dias": 0,
+        "demanda_estimada_30_dias": 0,
+        "intervalo_7_dias": {"inferior": 0, "superior": 0},
+        "intervalo_30_dias": {"inferior": 0, "superior": 0},
+        "tendencia": "estable",
+        "confianza": 0.0,
+        "factores": [f"Sin ventas en los últimos {DIAS_HISTORIA} días"]
+    }
+
+class CachePredicciones:
+    """Predicciones por producto, recalculadas en lote cuando vencen"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._predicciones: Dict[str, dict] = {}
+        self._calculado_en: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _vigente(self) -> bool:
+        return self._calculado_en is not None and time.monotonic() - self._calculado_en < self.ttl
+
+    async def todas(self) -> Dict[str, dict]:
+        if self._vigente():
+            self.hits += 1
+            return self._predicciones
+        # Un solo recálculo aunque lleguen varias peticiones a la vez
+        async with self._lock:
+            if not self._vigente():
+                self.misses += 1
+                productos, fechas, matriz = await series_demanda()
+                self._predicciones = await asyncio.to_thread(calcular_predicciones, productos, fechas, matriz)
+                self._calculado_en = time.monotonic()
+            else:
+                self.hits += 1
+        return self._predicciones
+
+    async def obtener(self, producto_id: str) -> dict:
+        predicciones = await self.todas()
+        return predicciones.get(producto_id) or prediccion_sin_historial(producto_id)
+
+    def invalidar(self):
+        self._calculado_en = None
+
+cache_predicciones = CachePredicciones(PREDICCION_TTL_SEGUNDOS)
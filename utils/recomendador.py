@@ -0,0 +1,214 @@
+"""
+Recomendador por co-ocurrencia de productos en los tickets.
+
+Una tarea periódica recorre las ventas finalizadas y construye una matriz
+dispersa producto x producto (CSR sobre arrays de NumPy) con el número de
+tickets en que cada par se compró junto. Las ventas que se finalizan entre
+reconstrucciones se suman en memoria como canastas pendientes, de modo que
+las recomendaciones las reflejan sin esperar a la siguiente pasada.
+
+El score de un candidato es la similitud coseno de co-ocurrencia con los
+productos que el cliente ya compró, ponderada por cuántas veces los compró.
+"""
+import asyncio
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from database import get_transacciones_collection
+
+RECOMENDADOR_DIAS = int(os.getenv("RECOMENDADOR_DIAS", "180"))
+RECOMENDADOR_INTERVALO_SEGUNDOS = float(os.getenv("RECOMENDADOR_INTERVALO_SEGUNDOS", "3600"))
+
+MAX_PRODUCTOS_CANASTA = 50  # Tickets más grandes aportan pares poco informativos
+PARES_POR_BLOQUE = 1_000_000
+
+def construir_csr(canastas: List[List[int]], n_productos: int):
+    """(indptr, indices, datos) con los pares de cada canasta contados una vez por ticket"""
+    bloques = []
+    claves = []
+    pendientes = 0
+    for canasta in canastas:
+        if len(canasta) < 2:
+            continue
+        items = np.asarray(canasta, dtype=np.int64)
+        filas = np.repeat(items, len(items))
+        columnas = np.tile(items, len(items))
+        distintos = filas != columnas
+        claves.append(filas[distintos] * n_productos + columnas[distintos])
+        pendientes += len(items) * (len(items) - 1)
+        # Reducir por bloques para no acumular todos los pares en memoria
+        if pendientes >= PARES_POR_BLOQUE:
+            bloques.append(np.unique(np.concatenate(claves), return_counts=True))
+            claves = []
+            pendientes = 0
+    if claves:
+        bloques.append(np.unique(np.concatenate(claves), return_counts=True))
+
+    if bloques:
+        todas = np.concatenate([b[0] for b in bloques])
+        conteos = np.concatenate([b[1] for b in bloques])
+        unicas, inverso = np.unique(todas, return_inverse=True)
+        datos = np.bincount(inverso, weights=conteos).astype(np.float32)
+    else:
+        unicas = np.zeros(0, dtype=np.int64)
+        datos = np.zeros(0, dtype=np.float32)
+
+    filas = unicas // max(n_productos, 1)
+    indices = (unicas % max(n_productos, 1)).astype(np.int32)
+    indptr = np.zeros(n_productos + 1, dtype=np.int64)
+    np.cumsum(np.bincount(filas, minlength=n_productos), out=indptr[1:])
+    return indptr, indices, datos
+
+class Recomendador:
+    def __init__(self):
+        self._ids: List[str] = []
+        self._indice: Dict[str, int] = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._datos = np.zeros(0, dtype=np.float32)
+        # Tickets por producto, incluidas las canastas pendientes
+        self._frecuencia = np.zeros(0, dtype=np.float64)
+        # Ventas registradas desde la última reconstrucción
+        self._pendientes: List[tuple] = []
+        self._delta: Dict[int, Counter] = defaultdict(Counter)
+        self._lock = asyncio.Lock()
+        self.construido_en: Optional[datetime] = None
+
+    def _indice_de(self, producto_id: str) -> int:
+        indice = self._indice.get(producto_id)
+        if indice is None:
+            indice = len(self._ids)
+            self._ids.append(producto_id)
+            self._indice[producto_id] = indice
+            self._frecuencia = np.append(self._frecuencia, 0.0)
+        return indice
+
+    def _sumar_canasta(self, items: List[int]):
+        self._frecuencia[items] += 1
+        for a in items:
+            for b in items:
+                if a != b:
+                    self._delta[a][b] += 1
+
+    def registrar_canasta(self, productos: Iterable[str], fecha: Optional[datetime] = None):
+        """Sumar una venta recién finalizada sin esperar a la reconstrucción"""
+        ids = list(dict.fromkeys(productos))[:MAX_PRODUCTOS_CANASTA]
+        if not ids:
+            return
+        fecha = fecha or datetime.utcnow()
+        self._pendientes.append((fecha, ids))
+        self._sumar_canasta([self._indice_de(producto_id) for producto_id in ids])
+
+    async def reconstruir(self):
+        """Recalcular la matriz desde las ventas finalizadas de la ventana"""
+        async with self._lock:
+            inicio = time.monotonic()
+            corte = datetime.utcnow()
+            collection = await get_transacciones_collection()
+
+            ids: List[str] = []
+            indice: Dict[str, int] = {}
+            canastas: List[List[int]] = []
+            cursor = collection.aggregate([
+                {"$match": {
+                    "estado": "finalizada",
+                    "fecha_finalizacion": {"$gte": corte - timedelta(days=RECOMENDADOR_DIAS), "$lt": corte}
+                }},
+                {"$project": {"_id": 0, "productos": {"$setUnion": ["$productos.producto_id"]}}}
+            ], batchSize=5000)
+            async for ticket in cursor:
+                canasta = []
+                for producto_id in ticket["productos"][:MAX_PRODUCTOS_CANASTA]:
+                    if producto_id not in indice:
+                        indice[producto_id] = len(ids)
+                        ids.append(producto_id)
+                    canasta.append(indice[producto_id])
+                canastas.append(canasta)
+
+            indptr, indices, datos = await asyncio.to_thread(construir_csr, canastas, len(ids))
+            frecuencia = np.zeros(len(ids), dtype=np.float64)
+            for canasta in canastas:
+                frecuencia[canasta] += 1
+
+            # Reemplazo atómico para las consultas concurrentes
+            self._ids, self._indice = ids, indice
+            self._indptr, self._indices, self._datos = indptr, indices, datos
+            self._frecuencia = frecuencia
+            # Las ventas posteriores al corte no entraron en la agregación
+            pendientes = [(fecha, productos) for fecha, productos in self._pendientes if fecha >= corte]
+            self._pendientes = []
+            self._delta = defaultdict(Counter)
+            for fecha, productos in pendientes:
+                self.registrar_canasta(productos, fecha)
+            self.construido_en = corte
+
+            print(
+                f"🧮 Recomendador: {len(ids)} productos, {len(datos)} pares de {len(canastas)} tickets "
+                f"en {time.monotonic() - inicio:.2f}s"
+            )
+
+    def recomendar(self, historial: Dict[str, float], limite: int = 5) -> List[dict]:
+        """[{producto_id, score, relacionado}] para un historial {producto_id: veces comprado}"""
+        n_productos = len(self._ids)
+        comprados = [(self._indice[p], peso) for p, peso in historial.items() if p in self._indice]
+        if n_productos == 0:
+            return []
+
+        norma = np.sqrt(np.maximum(self._frecuencia, 1.0))
+        scores = np.zeros(n_productos)
+        # Producto del historial que más aporta a cada candidato, para explicar la recomendación
+        mejor_aporte = np.zeros(n_productos)
+        relacionado = np.full(n_productos, -1, dtype=np.int64)
+        for fila, peso in comprados:
+            aporte = np.zeros(n_productos)
+            if fila < len(self._indptr) - 1:
+                inicio, fin = self._indptr[fila], self._indptr[fila + 1]
+                aporte[self._indices[inicio:fin]] = self._datos[inicio:fin]
+            for columna, conteo in self._delta.get(fila, {}).items():
+                aporte[columna] += conteo
+            aporte = peso * aporte / (norma[fila] * norma)
+            scores += aporte
+            mejora = aporte > mejor_aporte
+            mejor_aporte[mejora] = aporte[mejora]
+            relacionado[mejora] = fila
+
+        if comprados:
+            scores /= sum(peso for _, peso in comprados)
+            scores[[fila for fila, _ in comprados]] = -np.inf
+
+        candidatos = np.flatnonzero(scores > 0)
+        if len(candidatos) < limite:
+            # Completar con los más vendidos si la co-ocurrencia no alcanza
+            populares = np.argsort(-self._frecuencia)
+            excluidos = set(candidatos.tolist()) | {fila for fila, _ in comprados}
+            relleno = [i for i in populares if i not in excluidos and self._frecuencia[i] > 0]
+            candidatos = np.concatenate([candidatos, np.asarray(relleno[:limite - len(candidatos)], dtype=np.int64)])
+        if len(candidatos) > limite:
+            mejores = np.argpartition(-scores[candidatos], limite - 1)[:limite]
+            candidatos = candidatos[mejores]
+        orden = sorted(candidatos.tolist(), key=lambda i: (-max(scores[i], 0), -self._frecuencia[i]))
+
+        frecuencia_maxima = max(self._frecuencia.max(), 1.0)
+        return [
+            {
+                "producto_id": self._ids[i],
+                "score": float(scores[i]) if scores[i] > 0 else float(self._frecuencia[i] / frecuencia_maxima) * 0.5,
+                "relacionado": self._ids[relacionado[i]] if scores[i] > 0 and relacionado[i] >= 0 else None
+            }
+            for i in orden
+        ]
+
+    def estadisticas(self) -> dict:
+        return {
+            "productos": len(self._ids),
+            "pares": int(len(self._datos)),
+            "ventas_pendientes": len(self._pendientes),
+            "construido_en": self.construido_en
+        }
+
+recomendador = Recomendador()
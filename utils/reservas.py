@@ -0,0 +1,69 @@
+"""
+Expiración de las reservas de stock de carritos abandonados.
+
+agregar_producto reserva stock y renueva reserva_expira en la transacción.
+El barrido cancela las transacciones iniciadas cuya reserva venció y
+devuelve lo reservado al stock disponible, ambas cosas en una transacción.
+"""
+import os
+from datetime import datetime, timedelta
+
+from database import get_transacciones_collection, ejecutar_en_transaccion
+from models.ventas import EstadoTransaccion
+from utils.stock import lineas_inventario, liberar_reservas
+
+RESERVA_TTL = timedelta(minutes=int(os.getenv("RESERVA_TTL_MINUTOS", "30")))
+BARRIDO_RESERVAS_SEGUNDOS = int(os.getenv("BARRIDO_RESERVAS_SEGUNDOS", "60"))
+
+def vencimiento_reserva() -> datetime:
+    return datetime.utcnow() + RESERVA_TTL
+
+async def cancelar_carrito_vencido(transaccion_id: str) -> bool:
+    """Cancelar un carrito vencido y liberar sus reservas"""
+    collection = await get_transacciones_collection()
+    
+    async def cancelar(session):
+        ahora = datetime.utcnow()
+        # La guarda por estado y vencimiento evita competir con finalizar_venta
+        transaccion = await collection.find_one_and_update(
+            {
+                "transaccion_id": transaccion_id,
+                "estado": EstadoTransaccion.INICIADA,
+                "reserva_expira": {"$lt": ahora}
+            },
+            {"$set": {"estado": EstadoTransaccion.CANCELADA, "fecha_cancelacion": ahora}},
+            projection={"sucursal_id": 1, "productos": 1},
+            session=session
+        )
+        if transaccion is None:
+            return False
+        
+        lineas = await lineas_inventario(transaccion.get("productos", []))
+        await liberar_reservas(
+            {
+                producto_id: linea["reservada"]
+                for producto_id, linea in lineas.items()
+                if linea["reservada"] and not producto_id.startswith("codigo:")
+            },
+            transaccion["sucursal_id"],
+            session=session
+        )
+        return True
+    
+    return await ejecutar_en_transaccion(cancelar)
+
+async def liberar_reservas_vencidas(limite: int = 500) -> int:
+    """Barrer los carritos con la reserva vencida; devuelve cuántos se cancelaron"""
+    collection = await get_transacciones_collection()
+    vencidas = await collection.find(
+        {"estado": EstadoTransaccion.INICIADA, "reserva_expira": {"$lt": datetime.utcnow()}},
+        {"transaccion_id": 1}
+    ).limit(limite).to_list(limite)
+    
+    canceladas = 0
+    for transaccion in vencidas:
+        if await cancelar_carrito_vencido(transaccion["transaccion_id"]):
+            canceladas += 1
+    if canceladas:
+        print(f"🧹 Liberadas las reservas de {canceladas} carritos vencidos")
+    return canceladas
@@ -0,0 +1,39 @@
+"""
+Resolución por lotes de productos referenciados por _id o por código.
+
+Las colecciones guardan referencias a productos de dos formas: el _id del
+producto (ObjectId o string) en inventario y el código en las líneas de
+venta. resolver_productos recibe todas las claves que necesita una petición
+y las resuelve con una única consulta $in.
+"""
+from typing import Dict, Iterable
+
+from bson import ObjectId
+
+from database import get_productos_collection
+
+async def resolver_productos(claves: Iterable[str], proyeccion: dict = None) -> Dict[str, dict]:
+    """Devolver {clave: producto} para las claves encontradas"""
+    claves = {str(clave) for clave in claves if clave}
+    if not claves:
+        return {}
+    
+    ids = [ObjectId(clave) for clave in claves if ObjectId.is_valid(clave)]
+    # Los productos creados por la API usan un _id string como "P1A2B3C4D"
+    ids.extend(claves)
+    
+    collection = await get_productos_collection()
+    productos = await collection.find(
+        {"$or": [{"_id": {"$in": ids}}, {"codigo": {"$in": list(claves)}}]},
+        proyeccion
+    ).to_list(None)
+    
+    por_id = {str(p["_id"]): p for p in productos}
+    por_codigo = {p["codigo"]: p for p in productos if p.get("codigo")}
+    
+    resueltos = {}
+    for clave in claves:
+        producto = por_id.get(clave) or por_codigo.get(clave)
+        if producto:
+            resueltos[clave] = producto
+    return resueltos
@@ -0,0 +1,174 @@
+"""
+Resumen de ventas pre-agregado por (fecha, hora, sucursal_id, producto_id).
+
+Cada venta finalizada incrementa un bucket por producto vendido y un bucket
+con producto_id = PRODUCTO_TOTAL que acumula el total del ticket (después de
+descuentos), de modo que los reportes leen O(buckets) en vez de recorrer
+las transacciones.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, List, Tuple
+
+from pymongo import UpdateOne
+
+from database import get_ventas_resumen_collection
+
+PRODUCTO_TOTAL = "*"
+
+def valor_base(valor) -> float:
+    """Normalizar montos guardados como número o como {"base": ...}"""
+    if isinstance(valor, dict):
+        return valor.get("base", 0)
+    return valor or 0
+
+def expr_valor_base(campo: str):
+    """Equivalente de valor_base como expresión de agregación"""
+    return {
+        "$cond": [
+            {"$eq": [{"$type": campo}, "object"]},
+            {"$ifNull": [f"{campo}.base", 0]},
+            {"$ifNull": [campo, 0]}
+        ]
+    }
+
+def clave_fecha(fecha: datetime) -> str:
+    return fecha.strftime("%Y-%m-%d")
+
+def incrementos_resumen(transaccion: dict, fecha: datetime) -> List[Tuple[dict, dict]]:
+    """(bucket, $inc) que registran una venta en el resumen"""
+    bucket = {
+        "fecha": clave_fecha(fecha),
+        "hora": fecha.hour,
+        "sucursal_id": transaccion["sucursal_id"]
+    }
+
+    # Un mismo producto puede aparecer en varias líneas del carrito
+    por_producto = {}
+    for producto in transaccion.get("productos", []):
+        stats = por_producto.setdefault(producto["producto_id"], {"cantidad": 0, "ingresos": 0})
+        stats["cantidad"] += producto["cantidad"]
+        stats["ingresos"] += valor_base(producto.get("subtotal", 0))
+
+    incrementos = [(
+        {**bucket, "producto_id": PRODUCTO_TOTAL},
+        {
+            "cantidad": sum(s["cantidad"] for s in por_producto.values()),
+            "ingresos": valor_base(transaccion.get("total", 0)),
+            "transacciones": 1
+        }
+    )]
+    for producto_id, stats in por_producto.items():
+        incrementos.append((
+            {**bucket, "producto_id": producto_id},
+            {"cantidad": stats["cantidad"], "ingresos": stats["ingresos"], "transacciones": 1}
+        ))
+    return incrementos
+
+def operaciones_resumen_lote(ventas: Iterable[Tuple[dict, datetime]]) -> List[UpdateOne]:
+    """Operaciones de varias ventas con un solo $inc por bucket"""
+    incrementos = {}
+    for transaccion, fecha in ventas:
+        for filtro, inc in incrementos_resumen(transaccion, fecha):
+            clave = (filtro["fecha"], filtro["hora"], filtro["sucursal_id"], filtro["producto_id"])
+            acumulado = incrementos.setdefault(clave, {"cantidad": 0, "ingresos": 0, "transacciones": 0})
+            for campo, valor in inc.items():
+                acumulado[campo] += valor
+    return [
+        UpdateOne(
+            {"fecha": fecha, "hora": hora, "sucursal_id": sucursal_id, "producto_id": producto_id},
+            {"$inc": inc},
+            upsert=True
+        )
+        for (fecha, hora, sucursal_id, producto_id), inc in incrementos.items()
+    ]
+
+async def registrar_ventas(ventas: Iterable[Tuple[dict, datetime]], session=None):
+    """Aplicar un lote de ventas al resumen; las de la misma hora y sucursal comparten buckets"""
+    operaciones = operaciones_resumen_lote(ventas)
+    if not operaciones:
+        return
+    collection = await get_ventas_resumen_collection()
+    await collection.bulk_write(operaciones, ordered=False, session=session)
+
+def pipelines_reconstruccion(desde: datetime, hasta: datetime):
+    """Pipelines que recalculan los buckets de [desde, hasta) y los fusionan en el resumen"""
+    inicio = [
+        {"$match": {
+            "estado": "finalizada",
+            "$or": [
+                {"fecha_finalizacion": {"$gte": desde, "$lt": hasta}},
+                {"fecha_finalizacion": None, "fecha_creacion": {"$gte": desde, "$lt": hasta}}
+            ]
+        }},
+        {"$addFields": {"_fecha": {"$ifNull": ["$fecha_finalizacion", "$fecha_creacion"]}}},
+        {"$addFields": {
+            "_bucket": {
+                "fecha": {"$dateToString": {"format": "%Y-%m-%d", "date": "$_fecha"}},
+                "hora": {"$hour": "$_fecha"},
+                "sucursal_id": "$sucursal_id"
+            }
+        }}
+    ]
+    merge = {"$merge": {
+        "into": "ventas_resumen",
+        "on": ["fecha", "hora", "sucursal_id", "producto_id"],
+        "whenMatched": "replace",
+        "whenNotMatched": "insert"
+    }}
+    salida = {"$project": {
+        "_id": 0,
+        "fecha": "$_id.fecha",
+        "hora": "$_id.hora",
+        "sucursal_id": "$_id.sucursal_id",
+        "producto_id": "$_id.producto_id",
+        "cantidad": 1,
+        "ingresos": 1,
+        "transacciones": 1
+    }}
+
+    totales = inicio + [
+        {"$group": {
+            "_id": {
+                "fecha": "$_bucket.fecha",
+                "hora": "$_bucket.hora",
+                "sucursal_id": "$_bucket.sucursal_id",
+                "producto_id": PRODUCTO_TOTAL
+            },
+            "cantidad": {"$sum": {"$sum": "$productos.cantidad"}},
+            "ingresos": {"$sum": expr_valor_base("$total")},
+            "transacciones": {"$sum": 1}
+        }},
+        salida,
+        merge
+    ]
+
+    productos = inicio + [
+        {"$unwind": "$productos"},
+        # Primero por ticket para contar cada transacción una sola vez por producto
+        {"$group": {
+            "_id": {"t": "$_id", "bucket": "$_bucket", "producto_id": "$productos.producto_id"},
+            "cantidad": {"$sum": "$productos.cantidad"},
+            "ingresos": {"$sum": expr_valor_base("$productos.subtotal")}
+        }},
+        {"$group": {
+            "_id": {
+                "fecha": "$_id.bucket.fecha",
+                "hora": "$_id.bucket.hora",
+                "sucursal_id": "$_id.bucket.sucursal_id",
+                "producto_id": "$_id.producto_id"
+            },
+            "cantidad": {"$sum": "$cantidad"},
+            "ingresos": {"$sum": "$ingresos"},
+            "transacciones": {"$sum": 1}
+        }},
+        salida,
+        merge
+    ]
+    return [totales, productos]
+
+def dias_entre(desde: datetime, hasta: datetime):
+    """Fechas (medianoche UTC) de cada día en [desde, hasta)"""
+    dia = desde.replace(hour=0, minute=0, second=0, microsecond=0)
+    while dia < hasta:
+        yield dia
+        dia += timedelta(days=1)
@@ -0,0 +1,175 @@
+"""
+Serialización de documentos de MongoDB para las respuestas de la API.
+
+convertir_bson recorre el documento una sola vez y reemplaza en el lugar
+los tipos BSON que pydantic no acepta (ObjectId, Decimal128). RespuestaBSON
+escribe el JSON con orjson, que también resuelve esos tipos y los datetime
+sin pasar por jsonable_encoder.
+
+Para lecturas de documentos que ya vienen de la base, SerializadorModelo
+puede saltarse la re-validación del response_model (modo confiable,
+opcional con SERIALIZACION_CONFIABLE=true): pide a
+MongoDB solo los campos del modelo, con los alias ya aplicados, completa
+los valores por defecto y devuelve la respuesta directamente.
+
+El parámetro fields de los endpoints de lectura reduce esa proyección a las
+columnas pedidas y valida contra un modelo parcial con solo esos campos.
+"""
+import os
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Optional, Tuple, Type
+
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi import HTTPException, Query
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict, Field, create_model
+
+# Apagado por defecto: sin re-validación, un documento que no cumple el
+# modelo llega al cliente sin error. Activarlo tras medir con
+# scripts/benchmark_serializacion.py y revisar que los datos cumplan el modelo
+SERIALIZACION_CONFIABLE = os.getenv("SERIALIZACION_CONFIABLE", "false").lower() == "true"
+
+def parametro_campos():
+    """Query param fields compartido por los endpoints de lectura"""
+    return Query(None, description="Campos a devolver separados por coma, p. ej. nombre,precio")
+
+def convertir_bson(valor: Any) -> Any:
+    """Reemplazar ObjectId y Decimal128 en el lugar; datetime se deja para pydantic/orjson"""
+    if isinstance(valor, dict):
+        for clave, item in valor.items():
+            if isinstance(item, (dict, list)):
+                convertir_bson(item)
+            elif isinstance(item, ObjectId):
+                valor[clave] = str(item)
+            elif isinstance(item, Decimal128):
+                valor[clave] = float(item.to_decimal())
+    elif isinstance(valor, list):
+        for i, item in enumerate(valor):
+            if isinstance(item, (dict, list)):
+                convertir_bson(item)
+            elif isinstance(item, ObjectId):
+                valor[i] = str(item)
+            elif isinstance(item, Decimal128):
+                valor[i] = float(item.to_decimal())
+    elif isinstance(valor, ObjectId):
+        return str(valor)
+    elif isinstance(valor, Decimal128):
+        return float(valor.to_decimal())
+    return valor
+
+def _bson_default(valor):
+    """Tipos que orjson no conoce; lo llama solo al encontrarlos"""
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, Decimal128):
+        return float(valor.to_decimal())
+    if isinstance(valor, BaseModel):
+        return valor.model_dump(by_alias=True)
+    if isinstance(valor, date) and not isinstance(valor, datetime):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+def dumps(contenido: Any) -> bytes:
+    return orjson.dumps(
+        contenido,
+        default=_bson_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    )
+
+class RespuestaBSON(JSONResponse):
+    """JSONResponse con orjson que entiende ObjectId y Decimal128"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class SerializadorModelo:
+    """Proyección y respuesta confiable derivadas de un modelo de pydantic"""
+
+    def __init__(self, modelo: Type[BaseModel]):
+        self.modelo = modelo
+        self.proyeccion = {}
+        self.defaults = {}
+        # Nombre o alias aceptado en fields -> clave de salida
+        self._claves = {}
+        for nombre, campo in modelo.model_fields.items():
+            salida = campo.alias or nombre
+            self._claves[nombre] = self._claves[salida] = salida
+            if salida == "_id":
+                self.proyeccion["_id"] = 1
+            elif salida != nombre:
+                # El documento guarda el nombre del campo y la API responde con el alias
+                self.proyeccion[salida] = f"${nombre}"
+            else:
+                self.proyeccion[nombre] = 1
+            if not campo.is_required() and campo.default_factory is None:
+                default = campo.default
+                self.defaults[salida] = default.model_dump(by_alias=True) if isinstance(default, BaseModel) else default
+
+        self.modelo_parcial = lru_cache(maxsize=64)(self._crear_modelo_parcial)
+
+    def seleccion(self, fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+        """Claves de salida pedidas en fields; None si se piden todas"""
+        if not fields:
+            return None
+        pedidas = [campo.strip() for campo in fields.split(",") if campo.strip()]
+        desconocidas = [campo for campo in pedidas if campo not in self._claves]
+        if desconocidas:
+            raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(desconocidas)}")
+        # El _id siempre viaja: lo usa el cursor de paginación
+        return tuple(sorted({"_id", *(self._claves[campo] for campo in pedidas)}))
+
+    def proyeccion_campos(self, fields: Optional[str]) -> dict:
+        """Proyección de MongoDB limitada a los campos pedidos"""
+        seleccion = self.seleccion(fields)
+        if seleccion is None:
+            return self.proyeccion
+        return {clave: self.proyeccion[clave] for clave in seleccion}
+
+    def _crear_modelo_parcial(self, seleccion: Tuple[str, ...]) -> Type[BaseModel]:
+        """Modelo con solo los campos seleccionados; los obligatorios pasan a opcionales"""
+        definiciones = {}
+        for nombre, campo in self.modelo.model_fields.items():
+            if (campo.alias or nombre) not in seleccion:
+                continue
+            if campo.is_required():
+                definiciones[nombre] = (Optional[campo.annotation], Field(default=None, alias=campo.alias))
+            else:
+                definiciones[nombre] = (campo.annotation, campo)
+        return create_model(
+            f"{self.modelo.__name__}Parcial",
+            __config__=ConfigDict(populate_by_name=True, arbitrary_types_allowed=True),
+            **definiciones
+        )
+
+    def _completar(self, documento: dict, seleccion: Optional[Tuple[str, ...]]) -> dict:
+        if seleccion is None:
+            return {**self.defaults, **documento}
+        return {**{k: v for k, v in self.defaults.items() if k in seleccion}, **documento}
+
+    def _parciales(self, documentos: list, seleccion: Tuple[str, ...]) -> list:
+        modelo = self.modelo_parcial(seleccion)
+        return [modelo.model_validate(d).model_dump(by_alias=True) for d in convertir_bson(documentos)]
+
+    def documento(self, documento: dict, fields: Optional[str] = None):
+        """Respuesta de un documento leído con proyeccion_campos(fields)"""
+        seleccion = self.seleccion(fields)
+        if SERIALIZACION_CONFIABLE:
+            return RespuestaBSON(self._completar(documento, seleccion))
+        if seleccion is not None:
+            # El response_model de la ruta exige todos los campos
+            return RespuestaBSON(self._parciales([documento], seleccion)[0])
+        return convertir_bson(documento)
+
+    def pagina(self, documentos: list, next_cursor: Optional[str], fields: Optional[str] = None):
+        """Respuesta de una página leída con proyeccion_campos(fields)"""
+        seleccion = self.seleccion(fields)
+        if SERIALIZACION_CONFIABLE:
+            return RespuestaBSON({
+                "items": [self._completar(d, seleccion) for d in documentos],
+                "next_cursor": next_cursor
+            })
+        if seleccion is not None:
+            return RespuestaBSON({"items": self._parciales(documentos, seleccion), "next_cursor": next_cursor})
+        return {"items": convertir_bson(documentos), "next_cursor": next_cursor}
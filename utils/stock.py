@@ -0,0 +1,182 @@
+"""
+Operaciones de stock compartidas por ventas y el barrido de reservas.
+
+El carrito guarda el código del producto y el inventario el _id, así que
+las líneas se traducen con el cache del catálogo y se agrupan antes de
+escribir. Las escrituras usan guardas en el filtro para que el stock nunca
+quede negativo ni por debajo de lo reservado por otros carritos, y cada
+cambio de stock_actual queda registrado en utils/movimientos.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+from database import get_inventario_collection
+from utils.cache_catalogo import obtener_productos
+from utils.movimientos import movimiento, registrar_movimientos
+
+def expr_disponible():
+    """Stock vendible: stock_actual menos lo reservado por carritos abiertos"""
+    return {"$subtract": ["$stock_actual", {"$ifNull": ["$stock_reservado", 0]}]}
+
+async def lineas_inventario(productos: Iterable[dict]) -> Dict[str, dict]:
+    """Agrupar las líneas del carrito por el producto_id que usa inventario.
+
+    Devuelve {producto_id: {"codigo", "cantidad", "reservada"}}, donde
+    "reservada" es la parte de la cantidad que ya tiene reserva. Los
+    códigos que no existen usan la clave "codigo:<codigo>", que nunca
+    coincide con el inventario y por eso se reportan como líneas fallidas.
+    """
+    productos = list(productos)
+    catalogo = await obtener_productos(p["producto_id"] for p in productos)
+    lineas = {}
+    for producto in productos:
+        codigo = producto["producto_id"]
+        encontrado = catalogo.get(codigo)
+        clave = str(encontrado["_id"]) if encontrado else f"codigo:{codigo}"
+        linea = lineas.setdefault(clave, {"codigo": codigo, "cantidad": 0, "reservada": 0})
+        linea["cantidad"] += producto["cantidad"]
+        if producto.get("reservado"):
+            linea["reservada"] += producto["cantidad"]
+    return lineas
+
+async def descontar_stock(
+    lineas: Dict[str, dict],
+    sucursal_id: str,
+    session,
+    tipo: str = "venta",
+    referencia: Optional[str] = None,
+    **detalle
+) -> List[dict]:
+    """Descontar todas las líneas en un bulk_write con guarda de stock.
+
+    La parte reservada de cada línea se convierte en descuento (baja
+    stock_actual y stock_reservado); el resto exige stock disponible.
+    Si todas las líneas se descuentan se registran sus movimientos.
+    Devuelve las líneas que no pudieron descontarse (vacío si todas lo
+    hicieron); quien llama debe abortar la transacción en ese caso.
+    """
+    inventario_collection = await get_inventario_collection()
+    ahora = datetime.utcnow()
+    
+    operaciones = []
+    for producto_id, linea in lineas.items():
+        sin_reserva = linea["cantidad"] - linea["reservada"]
+        update = {
+            "$inc": {"stock_actual": -linea["cantidad"]},
+            "$set": {"ultima_actualizacion": ahora}
+        }
+        if linea["reservada"]:
+            update["$inc"]["stock_reservado"] = -linea["reservada"]
+        operaciones.append(UpdateOne(
+            {
+                "producto_id": producto_id,
+                "sucursal_id": sucursal_id,
+                "stock_actual": {"$gte": linea["cantidad"]},
+                "$expr": {"$gte": [expr_disponible(), sin_reserva]}
+            },
+            update
+        ))
+    resultado = await inventario_collection.bulk_write(operaciones, ordered=True, session=session)
+    if resultado.matched_count == len(operaciones):
+        await registrar_movimientos(
+            (
+                (producto_id, sucursal_id, movimiento(tipo, -linea["cantidad"], referencia, **detalle))
+                for producto_id, linea in lineas.items()
+            ),
+            session=session
+        )
+        return []
+    
+    # Solo en el caso de fallo se consulta qué líneas no tenían stock
+    existentes = {
+        item["producto_id"]: item
+        async for item in inventario_collection.find(
+            {"sucursal_id": sucursal_id, "producto_id": {"$in": list(lineas)}},
+            {"producto_id": 1, "stock_actual": 1, "stock_reservado": 1},
+            session=session
+        )
+    }
+    fallidas = []
+    for producto_id, linea in lineas.items():
+        item = existentes.get(producto_id)
+        disponible = 0
+        if item:
+            disponible = item["stock_actual"] - item.get("stock_reservado", 0) + linea["reservada"]
+        if disponible < linea["cantidad"]:
+            fallidas.append({
+                "producto_id": linea["codigo"],
+                "cantidad": linea["cantidad"],
+                "disponible": max(disponible, 0)
+            })
+    return fallidas
+
+async def acreditar_stock(
+    lineas: Dict[str, dict],
+    sucursal_id: str,
+    session,
+    tipo: str = "transferencia_entrada",
+    referencia: Optional[str] = None,
+    **detalle
+):
+    """Sumar stock en la sucursal, creando el registro si no existe, y registrar los movimientos"""
+    inventario_collection = await get_inventario_collection()
+    ahora = datetime.utcnow()
+    await inventario_collection.bulk_write(
+        [
+            UpdateOne(
+                {"producto_id": producto_id, "sucursal_id": sucursal_id},
+                {
+                    "$inc": {"stock_actual": linea["cantidad"]},
+                    "$set": {"ultima_actualizacion": ahora},
+                    "$setOnInsert": {"stock_minimo": 10, "stock_maximo": 1000, "stock_reservado": 0}
+                },
+                upsert=True
+            )
+            for producto_id, linea in lineas.items()
+        ],
+        ordered=False,
+        session=session
+    )
+    await registrar_movimientos(
+        (
+            (producto_id, sucursal_id, movimiento(tipo, linea["cantidad"], referencia, **detalle))
+            for producto_id, linea in lineas.items()
+        ),
+        session=session
+    )
+
+async def reservar_stock(producto_id: str, sucursal_id: str, cantidad: int) -> bool:
+    """Reservar cantidad si hay stock disponible, en una sola escritura atómica"""
+    inventario_collection = await get_inventario_collection()
+    resultado = await inventario_collection.update_one(
+        {
+            "producto_id": producto_id,
+            "sucursal_id": sucursal_id,
+            "$expr": {"$gte": [expr_disponible(), cantidad]}
+        },
+        {
+            "$inc": {"stock_reservado": cantidad},
+            "$set": {"ultima_actualizacion": datetime.utcnow()}
+        }
+    )
+    return resultado.matched_count == 1
+
+async def liberar_reservas(reservas: Dict[str, int], sucursal_id: str, session=None):
+    """Devolver al stock disponible las cantidades reservadas {producto_id: cantidad}"""
+    if not reservas:
+        return
+    inventario_collection = await get_inventario_collection()
+    ahora = datetime.utcnow()
+    await inventario_collection.bulk_write(
+        [
+            UpdateOne(
+                {"producto_id": producto_id, "sucursal_id": sucursal_id},
+                {"$inc": {"stock_reservado": -cantidad}, "$set": {"ultima_actualizacion": ahora}}
+            )
+            for producto_id, cantidad in reservas.items()
+        ],
+        ordered=False,
+        session=session
+    )
@@ -0,0 +1,25 @@
+"""
+Tareas periódicas en segundo plano que se arrancan en el lifespan de main.py.
+"""
+import asyncio
+
+async def ejecutar_periodicamente(nombre: str, funcion, intervalo: float):
+    """Ejecutar la corrutina funcion() cada intervalo segundos hasta ser cancelada"""
+    while True:
+        try:
+            await funcion()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Un fallo puntual no debe detener la tarea
+            print(f"❌ Error en la tarea periódica {nombre}: {e}")
+        await asyncio.sleep(intervalo)
+
+def iniciar_tarea_periodica(nombre: str, funcion, intervalo: float) -> asyncio.Task:
+    return asyncio.create_task(ejecutar_periodicamente(nombre, funcion, intervalo), name=nombre)
+
+async def detener_tareas(tareas):
+    """Cancelar las tareas y esperar a que terminen"""
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
@@ -0,0 +1,314 @@
+"""
+Contadores de ventas del día en memoria para el dashboard en vivo.
+
+PanelTiempoReal guarda el total, las transacciones y las unidades de hoy y
+de ayer por sucursal. Se carga al arrancar y cada
+TIEMPO_REAL_RESINCRONIZAR_SEGUNDOS desde ventas_resumen más las ventas que
+siguen en el outbox post-venta sin llegar al resumen, y cada venta finalizada lo incrementa y
+publica un delta a los dashboards conectados por Server-Sent Events: con N
+dashboards abiertos cada venta cuesta una actualización en memoria, no N
+agregaciones por intervalo de sondeo.
+
+Las ventas llegan de finalizar-venta y checkout de este proceso o, con
+TIEMPO_REAL_CHANGE_STREAM=true, de un change stream sobre transacciones
+(requiere replica set), que también ve las ventas de los demás workers.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from database import (
+    ejecutar_en_transaccion, get_tareas_collection, get_transacciones_collection, get_ventas_resumen_collection
+)
+from utils.post_venta import PENDIENTE, EN_PROCESO
+from utils.resumen_ventas import PRODUCTO_TOTAL, clave_fecha, valor_base
+from utils.serializers import dumps
+
+TIEMPO_REAL_CHANGE_STREAM = os.getenv("TIEMPO_REAL_CHANGE_STREAM", "false").lower() == "true"
+TIEMPO_REAL_RESINCRONIZAR_SEGUNDOS = int(os.getenv("TIEMPO_REAL_RESINCRONIZAR_SEGUNDOS", "300"))
+TIEMPO_REAL_HEARTBEAT_SEGUNDOS = int(os.getenv("TIEMPO_REAL_HEARTBEAT_SEGUNDOS", "15"))
+# Eventos pendientes por dashboard antes de considerarlo atrasado
+MAX_EVENTOS_PENDIENTES = 100
+
+def _vacio() -> dict:
+    return {"total": 0.0, "transacciones": 0, "unidades": 0}
+
+def _variacion(actual: float, anterior: float) -> float:
+    return (actual - anterior) / anterior * 100 if anterior > 0 else 0
+
+def resumen_dia(hoy: dict, ayer: dict) -> dict:
+    """Mismas métricas que /ventas/tiempo-real a partir de los contadores"""
+    return {
+        "ventas_hoy": hoy["total"],
+        "transacciones_hoy": hoy["transacciones"],
+        "ticket_promedio": hoy["total"] / hoy["transacciones"] if hoy["transacciones"] > 0 else 0,
+        "productos_vendidos": hoy["unidades"],
+        "comparacion_ayer": {
+            "ventas": _variacion(hoy["total"], ayer["total"]),
+            "transacciones": _variacion(hoy["transacciones"], ayer["transacciones"])
+        }
+    }
+
+class Suscripcion:
+    """Cola de eventos de un dashboard conectado"""
+
+    def __init__(self, sucursal_id: Optional[str] = None):
+        self.sucursal_id = sucursal_id
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=MAX_EVENTOS_PENDIENTES)
+        # Si el cliente no consume a tiempo se descartan sus deltas y se le manda un snapshot
+        self.atrasado = False
+
+    def publicar(self, evento: dict):
+        if self.sucursal_id is not None and evento["sucursal_id"] != self.sucursal_id:
+            return
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.atrasado = True
+
+    def marcar_atrasada(self):
+        self.atrasado = True
+        try:
+            # Despertar al generador aunque no lleguen más ventas
+            self.cola.put_nowait({"tipo": "snapshot"})
+        except asyncio.QueueFull:
+            pass
+
+    def vaciar(self):
+        while not self.cola.empty():
+            self.cola.get_nowait()
+        self.atrasado = False
+
+class PanelTiempoReal:
+    def __init__(self):
+        self.dia: Optional[str] = None
+        self.hoy: Dict[str, dict] = {}
+        self.ayer: Dict[str, dict] = {}
+        self.cargado = False
+        self.suscripciones: Set[Suscripcion] = set()
+        self._token_reanudacion = None
+        # Ventas registradas mientras corre una resincronización, por transaccion_id
+        self._recientes: Optional[Dict[str, tuple]] = None
+        self._resincronizando = asyncio.Lock()
+
+    async def resincronizar(self):
+        """Recargar los contadores de hoy y ayer desde ventas_resumen y el outbox"""
+        # Una a la vez: comparten el registro de ventas recientes
+        async with self._resincronizando:
+            await self._resincronizar()
+
+    async def _resincronizar(self):
+        resumen_collection = await get_ventas_resumen_collection()
+        tareas_collection = await get_tareas_collection()
+        transacciones_collection = await get_transacciones_collection()
+        hoy = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        claves = {clave_fecha(hoy): {}, clave_fecha(hoy - timedelta(days=1)): {}}
+        # Las ventas que lleguen durante la lectura siguen aplicándose a los
+        # contadores actuales y además se guardan para reaplicarlas a los nuevos
+        self._recientes = {}
+        incluidas: Set[str] = set()
+
+        async def leer(session):
+            # Las dos lecturas en una transacción ven el mismo estado: una venta
+            # está en el resumen o sigue pendiente en el outbox, nunca en ambos
+            resumen = await resumen_collection.aggregate([
+                {"$match": {"fecha": {"$in": list(claves)}, "producto_id": PRODUCTO_TOTAL}},
+                {"$group": {
+                    "_id": {"fecha": "$fecha", "sucursal_id": "$sucursal_id"},
+                    "total": {"$sum": "$ingresos"},
+                    "transacciones": {"$sum": "$transacciones"},
+                    "unidades": {"$sum": "$cantidad"}
+                }}
+            ], session=session).to_list(None)
+            pendientes = await tareas_collection.aggregate([
+                {"$match": {
+                    "tipo": "resumen_ventas",
+                    "estado": {"$in": [PENDIENTE, EN_PROCESO]},
+                    "datos.fecha": {"$gte": hoy - timedelta(days=1), "$lt": hoy + timedelta(days=1)}
+                }},
+                {"$group": {
+                    "_id": {
+                        "fecha": {"$dateToString": {"format": "%Y-%m-%d", "date": "$datos.fecha"}},
+                        "sucursal_id": "$datos.sucursal_id"
+                    },
+                    "total": {"$sum": "$datos.total"},
+                    "transacciones": {"$sum": 1},
+                    "unidades": {"$sum": {"$sum": "$datos.productos.cantidad"}}
+                }}
+            ], session=session).to_list(None)
+
+            # Las ventas recibidas durante la lectura pueden haberse confirmado
+            # antes o después del snapshot: las que el snapshot ya ve como
+            # finalizadas están contadas arriba
+            revisadas: Set[str] = set()
+            while len(revisadas) < len(self._recientes):
+                nuevas = [t for t in self._recientes if t not in revisadas]
+                revisadas.update(nuevas)
+                async for documento in transacciones_collection.find(
+                    {"transaccion_id": {"$in": nuevas}, "estado": "finalizada"},
+                    {"_id": 0, "transaccion_id": 1},
+                    session=session
+                ):
+                    incluidas.add(documento["transaccion_id"])
+            return resumen + pendientes
+
+        try:
+            buckets = await ejecutar_en_transaccion(leer)
+            recientes = self._recientes
+        finally:
+            self._recientes = None
+
+        for bucket in buckets:
+            contadores = claves[bucket["_id"]["fecha"]].setdefault(bucket["_id"]["sucursal_id"], _vacio())
+            for clave in contadores:
+                contadores[clave] += bucket[clave]
+        # Las que llegaron durante el commit de la lectura se confirmaron
+        # después del snapshot y también se reaplican
+        for transaccion_id, (dia, sucursal_id, incremento) in recientes.items():
+            if transaccion_id not in incluidas and dia in claves:
+                contadores = claves[dia].setdefault(sucursal_id, _vacio())
+                for clave, valor in incremento.items():
+                    contadores[clave] += valor
+
+        # Desde aquí no hay await: ninguna venta se aplica a los contadores
+        # viejos después de copiar las recientes
+        self.dia = clave_fecha(hoy)
+        self.hoy, self.ayer = claves.values()
+        self.cargado = True
+        self._difundir({"tipo": "snapshot", "sucursal_id": None})
+
+    def _cambiar_dia(self, dia: str):
+        if self.dia is None or dia <= self.dia:
+            return
+        anterior = (datetime.strptime(dia, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+        self.ayer = self.hoy if self.dia == anterior else {}
+        self.hoy = {}
+        self.dia = dia
+        self._difundir({"tipo": "snapshot", "sucursal_id": None})
+
+    def registrar_venta(self, transaccion: dict, fecha: datetime):
+        """Aplicar una venta finalizada a los contadores y publicar el delta"""
+        dia = clave_fecha(fecha)
+        sucursal_id = transaccion["sucursal_id"]
+        incremento = {
+            "total": valor_base(transaccion.get("total", 0)),
+            "transacciones": 1,
+            "unidades": sum(p["cantidad"] for p in transaccion.get("productos", []))
+        }
+        if self._recientes is not None:
+            self._recientes[transaccion["transaccion_id"]] = (dia, sucursal_id, incremento)
+
+        if not self.cargado:
+            return
+        self._cambiar_dia(dia)
+        if dia != self.dia:
+            # Venta de un día anterior que llega tarde (p. ej. por el change stream)
+            return
+
+        contadores = self.hoy.setdefault(sucursal_id, _vacio())
+        for clave, valor in incremento.items():
+            contadores[clave] += valor
+
+        self._difundir({
+            "tipo": "delta",
+            "sucursal_id": sucursal_id,
+            "transaccion_id": transaccion.get("transaccion_id"),
+            "incremento": incremento,
+            "sucursal": self.estado_sucursal(sucursal_id),
+            "global": self.estado_global()
+        })
+
+    def venta_local(self, transaccion: dict, fecha: datetime):
+        """Venta finalizada en este proceso; con change stream la registra el stream"""
+        if not TIEMPO_REAL_CHANGE_STREAM:
+            self.registrar_venta(transaccion, fecha)
+
+    def estado_sucursal(self, sucursal_id: str) -> dict:
+        return resumen_dia(self.hoy.get(sucursal_id, _vacio()), self.ayer.get(sucursal_id, _vacio()))
+
+    def estado_global(self) -> dict:
+        hoy, ayer = _vacio(), _vacio()
+        for acumulado, por_sucursal in ((hoy, self.hoy), (ayer, self.ayer)):
+            for contadores in por_sucursal.values():
+                for clave, valor in contadores.items():
+                    acumulado[clave] += valor
+        return resumen_dia(hoy, ayer)
+
+    def snapshot(self, sucursal_id: Optional[str] = None) -> dict:
+        """Estado completo que recibe un dashboard al conectarse o al quedar atrasado"""
+        if sucursal_id is not None:
+            return {"fecha": self.dia, "sucursal_id": sucursal_id, "sucursal": self.estado_sucursal(sucursal_id)}
+        return {
+            "fecha": self.dia,
+            "global": self.estado_global(),
+            "por_sucursal": {s: self.estado_sucursal(s) for s in sorted(self.hoy.keys() | self.ayer.keys())}
+        }
+
+    def suscribir(self, sucursal_id: Optional[str] = None) -> Suscripcion:
+        suscripcion = Suscripcion(sucursal_id)
+        self.suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion):
+        self.suscripciones.discard(suscripcion)
+
+    def _difundir(self, evento: dict):
+        if evento["tipo"] == "snapshot":
+            # Los contadores cambiaron por completo: cada dashboard pide un snapshot nuevo
+            for suscripcion in self.suscripciones:
+                suscripcion.marcar_atrasada()
+            return
+        for suscripcion in self.suscripciones:
+            suscripcion.publicar(evento)
+
+    async def escuchar_cambios(self):
+        """Registrar las ventas finalizadas que publica el change stream de transacciones"""
+        if not self.cargado:
+            await self.resincronizar()
+        collection = await get_transacciones_collection()
+        pipeline = [
+            {"$match": {"$or": [
+                {"operationType": "insert", "fullDocument.estado": "finalizada"},
+                {"operationType": "update", "updateDescription.updatedFields.estado": "finalizada"}
+            ]}}
+        ]
+        async with collection.watch(
+            pipeline,
+            full_document="updateLookup",
+            resume_after=self._token_reanudacion
+        ) as stream:
+            print("📡 Change stream de transacciones activo para el dashboard en vivo")
+            async for cambio in stream:
+                self._token_reanudacion = cambio["_id"]
+                documento = cambio.get("fullDocument")
+                if documento:
+                    self.registrar_venta(documento, documento.get("fecha_finalizacion") or datetime.utcnow())
+
+panel_tiempo_real = PanelTiempoReal()
+
+def evento_sse(tipo: str, datos: dict) -> bytes:
+    return b"event: " + tipo.encode() + b"\ndata: " + dumps(datos) + b"\n\n"
+
+async def flujo_eventos(sucursal_id: Optional[str] = None):
+    """Snapshot inicial y luego un delta por venta, con heartbeats para mantener viva la conexión"""
+    if not panel_tiempo_real.cargado:
+        await panel_tiempo_real.resincronizar()
+    suscripcion = panel_tiempo_real.suscribir(sucursal_id)
+    try:
+        yield b"retry: 3000\n\n"
+        yield evento_sse("snapshot", panel_tiempo_real.snapshot(sucursal_id))
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), TIEMPO_REAL_HEARTBEAT_SEGUNDOS)
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+            if suscripcion.atrasado:
+                suscripcion.vaciar()
+                yield evento_sse("snapshot", panel_tiempo_real.snapshot(sucursal_id))
+                continue
+            yield evento_sse("delta", evento)
+    finally:
+        # Al desconectarse el cliente Starlette cancela el generador
+        panel_tiempo_real.cancelar(suscripcion)